@@ -5,8 +5,8 @@ NL2SQL FastAPI 服务
 import os
 import time
 import logging
-import zipfile
 import json
+import decimal
 import tempfile
 import shutil
 import asyncio
@@ -16,10 +16,9 @@ from typing import Optional, List, Dict, Any
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException, Body, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
 from pydantic import BaseModel, Field
 from langchain_openai import ChatOpenAI
-import pandas as pd
 
 # 配置日志
 logging.basicConfig(
@@ -32,8 +31,13 @@ logger = logging.getLogger(__name__)
 from src.Improve.clients import create_vanna_client
 
 # 导入 Agent 相关模块
-from src.Improve.agent import create_nl2sql_agent, PostTrainingProcessor
-from src.Improve.shared import set_vanna_client, set_api_key, set_llm_instance, get_last_query_result, clear_last_query_result
+from src.Improve.agent import create_nl2sql_agent, AgentRunner, AnswerStreamer, SemanticAnswerCache
+from src.Improve.training import TrainingDataImporter, TrainingQueue
+from src.Improve.middleware import configure_tool_descriptions
+from src.Improve.shared import set_vanna_client, set_api_key, set_llm_instance, get_last_query_result, clear_last_query_result, SchemaCatalog, set_schema_catalog, get_schema_catalog, get_capability_registry
+from src.Improve.shared import Tracer, create_jsonl_exporter, create_otlp_exporter, get_tracer, set_tracer
+from src.Improve.shared import render_metrics, update_runtime_gauges
+from src.Improve.shared.metrics import CHAT_DURATION
 
 # 加载环境变量
 load_dotenv()
@@ -46,6 +50,7 @@ class ChatRequest(BaseModel):
     db_name: Optional[str] = Field(None, description="数据库名称（用于切换数据库）")
     stream: bool = Field(default=False, description="是否流式返回")
     enable_training: bool = Field(default=False, description="是否启用训练决策")
+    use_cache: bool = Field(default=True, description="是否使用语义问答缓存（相似问题直接返回缓存的回答）")
 
 class ChatResponse(BaseModel):
     """对话响应"""
@@ -54,6 +59,8 @@ class ChatResponse(BaseModel):
     execution_time: float
     timestamp: str
     ui_events: Optional[List[Dict[str, Any]]] = Field(None, description="UI 事件列表（工具调用描述）")
+    cached: bool = Field(default=False, description="是否命中语义问答缓存")
+    run_id: Optional[str] = Field(None, description="Agent run ID（可用于查询 /api/v1/traces/{run_id}）")
 
 class TrainingDataRequest(BaseModel):
     """添加训练数据请求"""
@@ -79,6 +86,18 @@ class DeleteTrainingDataResponse(BaseModel):
     success: bool
     message: str
 
+class DeleteDatabaseTrainingDataResponse(BaseModel):
+    """按数据库删除训练数据响应"""
+    success: bool
+    message: str
+    deleted: Dict[str, int] = Field(default_factory=dict, description="每个集合删除的记录数")
+
+class InvalidateSQLCacheResponse(BaseModel):
+    """查询结果缓存失效响应"""
+    success: bool
+    message: str
+    invalidated: int = Field(0, description="删除的缓存条目数")
+
 class QueryRequest(BaseModel):
     """查询请求"""
     query: Optional[str] = Field(None, description="自然语言查询")
@@ -97,6 +116,7 @@ class QueryResponse(BaseModel):
     answer: Optional[str] = None
     total_rows: int
     returned_rows: int
+    truncated: bool = False  # 结果超过 SQL_MAX_ROWS / SQL_MAX_MB，total_rows 只是已读取的行数
 
 class DatabaseConnectionRequest(BaseModel):
     """数据库连接请求"""
@@ -133,6 +153,13 @@ app = None  # 会在下面的 lifespan 部分重新创建
 vn = None  # Vanna 客户端
 agent = None  # Agent 实例
 llm = None  # LLM 实例
+agent_runner = None  # Agent 执行器（有界线程池，避免阻塞事件循环）
+training_importer = None  # 训练数据流式导入器
+training_queue = None  # 后台训练决策队列
+answer_cache = None  # 语义问答缓存
+
+# 上传文件分块写入磁盘的大小（字节）
+UPLOAD_CHUNK_SIZE = 1024 * 1024
 
 # 数据库连接配置缓存 (db_name -> connection_config)
 db_connection_configs: Dict[str, Dict[str, Any]] = {}
@@ -140,6 +167,10 @@ db_connection_configs: Dict[str, Dict[str, Any]] = {}
 # 数据库连接配置持久化文件路径
 DB_CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "db_connections.json")
 
+# 后台训练队列默认存储路径
+TRAINING_QUEUE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "training_queue.db")
+EMBEDDING_STORE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "embedding_store.db")
+
 def load_db_connections():
     """从文件加载数据库连接配置"""
     global db_connection_configs
@@ -161,11 +192,31 @@ def save_db_connections():
     except Exception as e:
         logger.warning(f"Failed to save db connections: {e}")
 
+def resolve_request_db_name(db_name: Optional[str]) -> Optional[str]:
+    """
+    校验请求指定的数据库（只做路由，不修改全局 vn 的连接）
+
+    Args:
+        db_name: 请求中的数据库名称
+
+    Returns:
+        已登记的数据库名称；未指定时返回 None（使用默认数据库）
+
+    Raises:
+        HTTPException: 数据库未登记
+    """
+    if not db_name:
+        return None
+    if not vn.has_mysql_database(db_name):
+        logger.warning(f"Database {db_name} not found in connection cache")
+        raise HTTPException(status_code=400, detail=f"Database {db_name} not found. Please reconnect to this database first.")
+    return db_name
+
 # ==================== 初始化函数 ====================
 
 def initialize_system():
     """初始化 NL2SQL 系统"""
-    global vn, agent, llm
+    global vn, agent, llm, agent_runner, training_importer, training_queue, answer_cache
 
     # 加载数据库连接配置
     load_db_connections()
@@ -188,6 +239,11 @@ def initialize_system():
     embedding_provider = os.getenv('EMBEDDING_PROVIDER', 'jina')
     embedding_api_key = os.getenv('EMBEDDING_API_KEY')
     embedding_model_name = os.getenv('EMBEDDING_MODEL_NAME')
+    embedding_query_cache_size = int(os.getenv('EMBEDDING_QUERY_CACHE_SIZE', '1024'))
+    embedding_query_cache_ttl = float(os.getenv('EMBEDDING_QUERY_CACHE_TTL', '3600'))
+    embedding_max_batch_size = int(os.getenv('EMBEDDING_MAX_BATCH_SIZE', '0')) or None
+    embedding_max_concurrency = int(os.getenv('EMBEDDING_MAX_CONCURRENCY', '4'))
+    embedding_store_path = os.getenv('EMBEDDING_STORE_PATH', EMBEDDING_STORE_FILE)
     metric_type = os.getenv('MILVUS_METRIC_TYPE', 'COSINE')
     mysql_host = os.getenv('MYSQL_HOST')
     mysql_port = int(os.getenv('MYSQL_PORT', '3306'))
@@ -196,6 +252,32 @@ def initialize_system():
     mysql_password = os.getenv('MYSQL_PASSWORD')
     llm_temperature = float(os.getenv('LLM_TEMPERATURE', '0.1'))
     llm_max_tokens = int(os.getenv('LLM_MAX_TOKENS', '14000'))
+    mysql_pool_size = int(os.getenv('MYSQL_POOL_SIZE', '8'))
+    mysql_pool_min_idle = int(os.getenv('MYSQL_POOL_MIN_IDLE', '1'))
+    mysql_pool_max_lifetime = float(os.getenv('MYSQL_POOL_MAX_LIFETIME', '1800'))
+    mysql_pool_timeout = float(os.getenv('MYSQL_POOL_TIMEOUT', '30'))
+    sql_max_rows = int(os.getenv('SQL_MAX_ROWS', '100000'))
+    sql_max_bytes = int(os.getenv('SQL_MAX_MB', '256')) * 1024 * 1024
+    sql_result_cache_ttl = float(os.getenv('SQL_RESULT_CACHE_TTL', '60'))
+    sql_result_cache_max_bytes = int(os.getenv('SQL_RESULT_CACHE_MAX_MB', '64')) * 1024 * 1024
+    schema_cache_ttl = float(os.getenv('SCHEMA_CACHE_TTL', '300'))
+    schema_cache_check_interval = float(os.getenv('SCHEMA_CACHE_CHECK_INTERVAL', '30'))
+    import_batch_size = int(os.getenv('TRAINING_IMPORT_BATCH_SIZE', '64'))
+    import_workers = int(os.getenv('TRAINING_IMPORT_WORKERS', '4'))
+    import_insert_batch_size = int(os.getenv('TRAINING_IMPORT_INSERT_BATCH_SIZE', '512'))
+    training_queue_path = os.getenv('TRAINING_QUEUE_PATH', TRAINING_QUEUE_FILE)
+    training_queue_workers = int(os.getenv('TRAINING_QUEUE_WORKERS', '1'))
+    training_queue_max_attempts = int(os.getenv('TRAINING_QUEUE_MAX_ATTEMPTS', '3'))
+    training_queue_retry_backoff = float(os.getenv('TRAINING_QUEUE_RETRY_BACKOFF', '30'))
+    answer_cache_max_entries = int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', '500'))
+    answer_cache_threshold = float(os.getenv('ANSWER_CACHE_THRESHOLD', '0.95'))
+    answer_cache_ttl = float(os.getenv('ANSWER_CACHE_TTL', '86400'))
+    answer_cache_result_ttl = float(os.getenv('ANSWER_CACHE_RESULT_TTL', '300'))
+    answer_cache_max_rows = int(os.getenv('ANSWER_CACHE_MAX_ROWS', '1000'))
+    trace_enabled = os.getenv('TRACE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    trace_max_traces = int(os.getenv('TRACE_MAX_TRACES', '200'))
+    trace_jsonl_path = os.getenv('TRACE_JSONL_PATH', '')
+    trace_otlp_endpoint = os.getenv('TRACE_OTLP_ENDPOINT', '')
     
     # 验证必填参数
     required_params = {
@@ -215,6 +297,14 @@ def initialize_system():
     
     logger.info("\nInitialize NL2SQL system...")
 
+    # 链路追踪（run → LLM 轮次 → 工具 → 嵌入 / Milvus / SQL），结束的 trace 可导出到文件或 OTLP collector
+    trace_exporters = []
+    if trace_jsonl_path:
+        trace_exporters.append(create_jsonl_exporter(trace_jsonl_path))
+    if trace_otlp_endpoint:
+        trace_exporters.append(create_otlp_exporter(trace_otlp_endpoint))
+    set_tracer(Tracer(enabled=trace_enabled, max_traces=trace_max_traces, exporters=trace_exporters))
+
     # 创建 Vanna 客户端
     vn = create_vanna_client(
         openai_api_key=api_key,
@@ -226,9 +316,26 @@ def initialize_system():
         embedding_provider=embedding_provider,
         embedding_api_key=embedding_api_key,
         embedding_model_name=embedding_model_name,
+        embedding_query_cache_size=embedding_query_cache_size,
+        embedding_query_cache_ttl=embedding_query_cache_ttl,
+        embedding_max_batch_size=embedding_max_batch_size,
+        embedding_max_concurrency=embedding_max_concurrency,
+        embedding_store_path=embedding_store_path or None,
         metric_type=metric_type,
+        mysql_pool_size=mysql_pool_size,
+        mysql_pool_min_idle=mysql_pool_min_idle,
+        mysql_pool_max_lifetime=mysql_pool_max_lifetime,
+        mysql_pool_timeout=mysql_pool_timeout,
+        sql_max_rows=sql_max_rows,
+        sql_max_bytes=sql_max_bytes,
+        sql_result_cache_ttl=sql_result_cache_ttl,
+        sql_result_cache_max_bytes=sql_result_cache_max_bytes,
     )
     
+    # 登记已保存的数据库连接配置（首次使用时才建立连接池）
+    for db_name, config in db_connection_configs.items():
+        vn.register_mysql_database(db_name, config)
+
     # 连接数据库
     vn.connect_to_mysql(
         host=mysql_host,
@@ -239,8 +346,17 @@ def initialize_system():
     )
     logger.info("Success connect to MySQL")
 
+    # 训练数据导入器（流式读取 ZIP，批量并发向量化）
+    training_importer = TrainingDataImporter(
+        vn,
+        batch_size=import_batch_size,
+        workers=import_workers,
+        insert_batch_size=import_insert_batch_size,
+    )
+
     # 设置全局上下文
     set_vanna_client(vn)
+    set_schema_catalog(SchemaCatalog(ttl=schema_cache_ttl, check_interval=schema_cache_check_interval))
     set_api_key(api_key)
     
     # 创建 LLM
@@ -252,14 +368,46 @@ def initialize_system():
     )
 
     set_llm_instance(llm)
+    # 工具描述：模板描述立即可用，LLM 描述在后台生成后以 step update 事件推送
+    configure_tool_descriptions(
+        llm_enabled=os.getenv('TOOL_DESCRIPTION_LLM', 'true').lower() in ('1', 'true', 'yes'),
+        cache_size=int(os.getenv('TOOL_DESCRIPTION_CACHE_SIZE', '256')),
+    )
     
     # 创建 Agent（启用中间件和 UI 事件）
     logger.info("Creating NL2SQL Agent...")
     agent = create_nl2sql_agent(
         llm,
         enable_middleware=True,
-        enable_ui_events=True  # 启用 UI 事件中间件
+        enable_ui_events=True,  # 启用 UI 事件中间件
+        enable_prefetch=os.getenv('AGENT_PREFETCH', 'true').lower() in ('1', 'true', 'yes'),
+    )
+
+    # 创建 Agent 执行器（同步 agent.stream 在工作线程中运行）
+    max_concurrent_runs = int(os.getenv('AGENT_MAX_CONCURRENT_RUNS', '4'))
+    agent_runner = AgentRunner(agent, max_concurrent_runs=max_concurrent_runs)
+    logger.info(f"Agent runner ready (max concurrent runs: {max_concurrent_runs})")
+
+    # 后台训练队列（enable_training 的训练决策不阻塞对话响应）
+    training_queue = TrainingQueue(
+        vn,
+        training_queue_path,
+        workers=training_queue_workers,
+        max_attempts=training_queue_max_attempts,
+        retry_backoff=training_queue_retry_backoff,
+    )
+    training_queue.start()
+
+    # 语义问答缓存（训练数据变化时按 db_name 失效）
+    answer_cache = SemanticAnswerCache(
+        vn.embedding_function,
+        threshold=answer_cache_threshold,
+        ttl=answer_cache_ttl,
+        result_ttl=answer_cache_result_ttl,
+        max_entries=answer_cache_max_entries,
+        max_rows=answer_cache_max_rows,
     )
+    vn.add_training_listener(answer_cache.invalidate)
 
     logger.info("System initialized successfully\n")
 
@@ -273,7 +421,23 @@ async def lifespan(app: FastAPI):
     # 启动时初始化
     initialize_system()
     yield
-    # 关闭时清理（如果需要）
+    # 关闭时清理
+    if agent_runner:
+        agent_runner.shutdown()
+    if training_importer:
+        training_importer.shutdown()
+    if training_queue:
+        training_queue.shutdown()
+    if vn:
+        vn.close_mysql_pools()
+        aclose = getattr(vn.embedding_function, "aclose", None)
+        if aclose is not None:
+            await aclose()
+        # 关闭 HTTP 连接池、请求线程池和文档向量存储（SQLite）
+        close = getattr(vn.embedding_function, "close", None)
+        if close is not None:
+            close()
+    get_tracer().shutdown()
     logger.info("Service shutdown")
 
 # 使用新的 lifespan 方式
@@ -321,26 +485,51 @@ async def chat(request: ChatRequest):
     Returns:
         ChatResponse: 包含答案、SQL、执行时间等信息
     """
-    if not agent:
+    if not agent or not agent_runner:
         raise HTTPException(status_code=500, detail="System not initialized")
     
     start_time = time.time()
+    run_id = f"api-{uuid.uuid4().hex}"
+    db_name = resolve_request_db_name(request.db_name)
+    cache_db = _answer_cache_db(db_name) if request.use_cache else None
+
+    # 相似问题已有回答时直接返回（不执行 Agent）
+    hit = await _lookup_answer(request.question, cache_db)
+    if hit:
+        entry, _ = hit
+        try:
+            records = await _cached_records(entry, db_name)
+        except Exception as e:
+            # 缓存的 SQL 重新执行失败时按未命中处理
+            logger.warning(f"[AnswerCache] Refresh failed, running agent: {e}")
+            records = None
+        if records is not None:
+            CHAT_DURATION.observe(time.time() - start_time, endpoint="chat", outcome="cached")
+            return ChatResponse(
+                question=request.question,
+                answer=entry.answer,
+                execution_time=time.time() - start_time,
+                timestamp=time.strftime('%Y-%m-%d %H:%M:%S'),
+                cached=True,
+            )
     
     try:
         # 准备配置
         cfg = {
-            "configurable": {"thread_id": f"api-{int(time.time())}"},
+            "configurable": {"thread_id": run_id},
             "recursion_limit": int(os.getenv('AGENT_RECURSION_LIMIT', '150')),
         }
         
-        # 执行 Agent
-        final_event = None
-        for event in agent.stream(
+        # 执行 Agent（在工作线程中运行，不阻塞事件循环）
+        final_event = await agent_runner.invoke(
             {"messages": [{"role": "user", "content": request.question}]},
-            stream_mode="values",
             config=cfg,
-        ):
-            final_event = event
+            run_id=run_id,
+            db_name=db_name,
+        )
+        # 非流式接口不返回数据，释放本次 run 的查询结果（先取出写入问答缓存）
+        df = get_last_query_result(run_id)
+        clear_last_query_result(run_id)
         
         if not final_event:
             raise HTTPException(status_code=500, detail="Agent execution failed")
@@ -362,43 +551,183 @@ async def chat(request: ChatRequest):
                     break
         
         elapsed = time.time() - start_time
+        CHAT_DURATION.observe(elapsed, endpoint="chat", outcome="ok")
+
+        if cache_db is not None:
+            await _store_answer(request.question, cache_db, messages, _build_query_data_event(df, messages))
         
-        # 训练决策（如果启用）
+        # 训练决策（如果启用）：提交到后台队列，不阻塞响应
         if request.enable_training and final_event:
             try:
-                processor = PostTrainingProcessor()
-                decision_result = processor.decide_and_add_to_training(
-                    question=request.question,
-                    conversation_history=final_event["messages"],
-                    vanna_client=vn
-                )
-                logger.info(f"Training decision: {decision_result}")
+                job = training_queue.submit(request.question, final_event["messages"], db_name=db_name)
+                logger.info(f"Training decision queued: {job}")
             except Exception as e:
-                logger.warning(f"Training decision failed: {e}")
+                logger.warning(f"Failed to queue training decision: {e}")
         
         return ChatResponse(
             question=request.question,
             answer=answer,
             execution_time=elapsed,
             timestamp=time.strftime('%Y-%m-%d %H:%M:%S'),
-            ui_events=ui_events
+            ui_events=ui_events,
+            run_id=run_id
         )
         
     except Exception as e:
+        CHAT_DURATION.observe(time.time() - start_time, endpoint="chat", outcome="error")
         raise HTTPException(status_code=500, detail=f"Chat processing failed: {str(e)}")
 
+def _convert_decimal(obj):
+    """将 Decimal 转换为 float（查询结果需要 JSON 序列化）"""
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    elif isinstance(obj, dict):
+        return {k: _convert_decimal(v) for k, v in obj.items()}
+    elif isinstance(obj, list):
+        return [_convert_decimal(item) for item in obj]
+    return obj
+
+
+def _df_records(df) -> List[Dict[str, Any]]:
+    """DataFrame 转为可 JSON 序列化的 list of dicts"""
+    return [_convert_decimal(record) for record in df.to_dict('records')]
+
+
+def _data_event(records: List[Dict[str, Any]], sql: Optional[str]) -> Dict[str, Any]:
+    """SSE data 事件"""
+    return {
+        'type': 'data',
+        'data': records,
+        'columns': list(records[0].keys()) if records else [],
+        'sql': sql
+    }
+
+
+def _final_answer_text(messages: list) -> Optional[str]:
+    """最后一条有内容的 AI 消息（模型最终回答原文）"""
+    for msg in reversed(messages):
+        if getattr(msg, 'type', '') == 'ai':
+            content = getattr(msg, 'content', '').strip()
+            if content and len(content) > 10:
+                return content
+    return None
+
+
+def _last_executed_sql(messages: list) -> Optional[str]:
+    """最后一次 execute_sql 调用的 SQL（查询结果未记录 SQL 时使用）"""
+    for msg in reversed(messages):
+        if getattr(msg, 'type', '') == 'ai' and hasattr(msg, 'tool_calls'):
+            for tool_call in reversed(msg.tool_calls):
+                if tool_call.get('name') == 'execute_sql':
+                    sql = tool_call.get('args', {}).get('sql', '')
+                    if sql:
+                        return sql
+    return None
+
+
+def _build_query_data_event(df, messages: list) -> Optional[Dict[str, Any]]:
+    """
+    构造 SSE data 事件（本次 run 的查询结果 + 产生该结果的 SQL）
+
+    Args:
+        df: 本次 run 的查询结果（execute_sql 工具执行时按 run_id 保存，由调用方读取和释放）
+        messages: Agent 消息列表（查询结果未记录 SQL 时从中提取最后一次 execute_sql 的 SQL）
+
+    Returns:
+        data 事件；本次 run 没有查询结果时返回 None
+    """
+    logger.info(f"[Data Extraction] Total messages: {len(messages)}")
+
+    if df is None or len(df) == 0:
+        logger.warning(f"[Data Extraction] No query data found, cannot push data event")
+        return None
+
+    # 将 DataFrame 转换为 JSON 格式（list of dicts），处理 Decimal 类型
+    query_data = _df_records(df)
+    logger.info(f"[Data Extraction] Retrieved query data from cache, rows: {len(query_data)}")
+
+    # 产生该结果的 SQL（与缓存的结果一致，多次查询时为最后一次）
+    sql_query = df.attrs.get('sql') or _last_executed_sql(messages)
+
+    logger.info(f"[Data Extraction] Preparing to push data event, rows: {len(query_data)}, SQL: {sql_query[:100] if sql_query else 'None'}")
+    return _data_event(query_data, sql_query)
+
+# ==================== 语义问答缓存 ====================
+
+def _answer_cache_db(db_name: Optional[str]) -> Optional[str]:
+    """问答缓存的分组键（请求实际路由到的数据库）；缓存未启用时返回 None"""
+    if not answer_cache or not answer_cache.enabled:
+        return None
+    try:
+        return vn.mysql_target(db_name)["db_name"]
+    except Exception as e:
+        logger.debug(f"[AnswerCache] Cannot resolve database: {e}")
+        return None
+
+
+async def _lookup_answer(question: str, cache_db: Optional[str]):
+    """查找缓存回答，返回 (CachedAnswer, 相似度) 或 None（查找失败按未命中处理）"""
+    if cache_db is None:
+        return None
+    try:
+        return await answer_cache.alookup(question, cache_db)
+    except Exception as e:
+        logger.warning(f"[AnswerCache] Lookup failed: {e}")
+        return None
+
+
+async def _cached_records(entry, db_name: Optional[str]) -> Optional[List[Dict[str, Any]]]:
+    """
+    缓存回答对应的查询结果：仍在有效期内时直接返回，否则重新执行缓存的 SQL；
+    结果已变化（缓存的回答过时）时返回 None
+
+    Raises:
+        Exception: 重新执行 SQL 失败
+    """
+    if entry.result_fresh(answer_cache.result_ttl):
+        return entry.records
+    df = await asyncio.to_thread(vn.run_sql, entry.sql, db_name=db_name)
+    records = _df_records(df) if df is not None else []
+    if not answer_cache.refresh(entry, records):
+        return None
+    return records
+
+
+async def _store_answer(question: str, cache_db: Optional[str], messages: list,
+                        data_event: Optional[Dict[str, Any]]):
+    """
+    缓存本次 run 的 SQL、回答和查询结果
+
+    Args:
+        data_event: 已推送的 data 事件（必须取自本次 run 最终的查询结果，SQL 与结果一致）；
+                    为 None 或没有回答时不缓存
+    """
+    if cache_db is None or not data_event or not data_event.get('sql'):
+        return
+    answer = _final_answer_text(messages)
+    if not answer:
+        return
+    try:
+        await asyncio.to_thread(answer_cache.store, question, cache_db, data_event['sql'], answer,
+                                data_event['data'], data_event['columns'])
+    except Exception as e:
+        logger.warning(f"[AnswerCache] Store failed: {e}")
+
 @app.post("/api/v1/chat/stream")
 async def chat_stream(request: ChatRequest):
     """
     流式对话接口 - 两阶段响应
 
     第一阶段：实时推送 Agent 执行步骤
-    第二阶段：流式返回最终答案
+    第二阶段：模型生成最终答案时逐 token 推送（按 ANSWER_STREAM_FLUSH_MS 合并为块）
 
     SSE 事件格式：
     - {"type": "step", "action": "查询数据库结构", "status": "进行中"}
     - {"type": "step", "action": "生成SQL查询", "status": "完成"}
+    - {"type": "data", "data": [...], "columns": [...], "sql": "..."}（在第一段答案之前）
+    - {"type": "chart_config", "config": {...}}
     - {"type": "answer", "content": "女性客户的平均...", "done": false}
+    - {"type": "answer_reset"}（已推送的文本其实是调用工具前的开场白：清空已显示的回答和图表配置）
     - {"type": "done"}
 
     Args:
@@ -407,50 +736,162 @@ async def chat_stream(request: ChatRequest):
     Returns:
         StreamingResponse: SSE 流式响应
     """
-    if not agent:
+    if not agent or not agent_runner:
         raise HTTPException(status_code=500, detail="System not initialized")
 
-    # 如果请求中指定了 db_name，切换数据库连接
-    if request.db_name and vn:
-        try:
-            # 从缓存中获取数据库配置
-            if request.db_name in db_connection_configs:
-                config = db_connection_configs[request.db_name]
-                vn.connect_to_mysql(
-                    host=config.get("host", "localhost"),
-                    dbname=config.get("dbname", request.db_name),
-                    user=config.get("user", "root"),
-                    password=config.get("password", ""),
-                    port=config.get("port", 3306)
-                )
-                logger.info(f"切换到数据库: {request.db_name}")
-        except Exception as e:
-            logger.warning(f"切换数据库失败: {e}")
+    # 指定了 db_name 时只对本次 run 生效（工具通过 run 上下文路由到对应连接池）
+    db_name = resolve_request_db_name(request.db_name)
+
+    run_id = f"api-stream-{uuid.uuid4().hex}"
+    cache_db = _answer_cache_db(db_name) if request.use_cache else None
+    outcome = "cancelled"  # 客户端中途断开时保持不变
+
+    async def replay_cached(hit):
+        """按正常流程的 SSE 格式输出缓存的回答；查询结果已变化时返回 None"""
+        entry, similarity = hit
+        start = time.time()
+        records = await _cached_records(entry, db_name)
+        if records is None:
+            return None
+        frames = [{
+            'type': 'step',
+            'action': '命中问答缓存',
+            'tool_name': 'answer_cache',
+            'status': 'completed',
+            'duration_ms': int((time.time() - start) * 1000),
+            'result': f"相似问题: {entry.question}（相似度 {similarity:.3f}）",
+            'sql': entry.sql,
+        }]
+        if records:
+            frames.append(_data_event(records, entry.sql))
+        frames.extend(AnswerStreamer(flush_interval=0).replay(entry.answer))
+        frames.append({'type': 'done'})
+        return [f"data: {json.dumps(frame, ensure_ascii=False)}\n\n" for frame in frames]
 
     async def generate():
+        nonlocal outcome
+        data_sent = False
+        sent_event = None  # 已推送的 data 事件
+        sent_df = None     # sent_event 取自的查询结果
+        final_event = None
+
+        hit = await _lookup_answer(request.question, cache_db)
+        if hit:
+            try:
+                frames = await replay_cached(hit)
+            except Exception as e:
+                # 缓存的 SQL 重新执行失败时按未命中处理
+                logger.warning(f"[AnswerCache] Replay failed, running agent: {e}")
+            else:
+                if frames is not None:
+                    outcome = "cached"
+                    for frame in frames:
+                        yield frame
+                    return
+
+        def to_frames(sse_events):
+            """把 SSE 事件编码为帧（查询数据由 streamer 插在每轮第一段回答之前）"""
+            nonlocal data_sent, sent_event, sent_df
+            frames = []
+            for sse_event in sse_events:
+                if sse_event['type'] == 'answer_reset':
+                    # 随开场白推送的查询数据一并作废，最终回答前重新推送
+                    data_sent = False
+                    sent_event = sent_df = None
+                frames.append(f"data: {json.dumps(sse_event, ensure_ascii=False)}\n\n")
+            return frames
+
+        prefetched_sent = set()
+
+        def prefetched_frames(messages):
+            frames = []
+            for msg in messages:
+                if getattr(msg, 'type', '') != 'tool' or not msg.additional_kwargs.get('prefetched'):
+                    continue
+                if msg.tool_call_id in prefetched_sent:
+                    continue
+                prefetched_sent.add(msg.tool_call_id)
+                end = next((e for e in msg.additional_kwargs.get('ui_events', []) if e.get('kind') == 'tool_end'), {})
+                step_data = {
+                    'type': 'step',
+                    'action': end.get('title') or msg.name,
+                    'tool_name': msg.name,
+                    'status': 'completed',
+                    'duration_ms': end.get('duration_ms'),
+                    'result': msg.content,
+                }
+                frames.append(f"data: {json.dumps(step_data, ensure_ascii=False)}\n\n")
+            return frames
+
+        def data_events():
+            nonlocal data_sent, sent_event, sent_df
+            data_sent = True
+            messages = final_event.get("messages", []) if final_event else []
+            # 只读取不释放：开场白被撤回后需要重新推送，run 结束时释放
+            df = get_last_query_result(run_id)
+            data_event = _build_query_data_event(df, messages)
+            if not data_event:
+                return []
+            sent_event, sent_df = data_event, df
+            return [data_event]
+
         try:
             cfg = {
-                "configurable": {"thread_id": f"api-stream-{int(time.time())}"},
+                "configurable": {"thread_id": run_id},
                 "recursion_limit": int(os.getenv('AGENT_RECURSION_LIMIT', '150')),
             }
             
-            final_event = None
             last_tool = None
- 
+            last_step = None   # 最近推送的 last_tool 步骤（tool_label 更新时整体重发）
+            tool_label = None  # 后台生成的 last_tool 描述
+            streamer = AnswerStreamer(
+                flush_interval=int(os.getenv('ANSWER_STREAM_FLUSH_MS', '50')) / 1000,
+                hold_chars=int(os.getenv('ANSWER_STREAM_HOLD_CHARS', '64')),
+                before_answer=data_events,
+            )
 
-            # 第一阶段：实时推送 Agent 执行步骤（流式的工具调用）
-            for event in agent.stream(
-                
+            # 第一阶段：实时推送 Agent 执行步骤（流式的工具调用）和最终回答的 token
+            # Agent 在工作线程中运行，事件经 asyncio.Queue 桥接回来
+            async for mode, payload in agent_runner.stream(
                 {"messages": [{"role": "user", "content": request.question}]},
-                stream_mode="values",
                 config=cfg,
+                stream_mode=["values", "messages", "custom"],
+                run_id=run_id,
+                db_name=db_name,
             ):
-                final_event = event
-                messages = event.get("messages", [])
+                if mode == "messages":
+                    chunk, metadata = payload
+                    # 只转发 Agent 模型节点的输出（工具内部的 LLM 调用不属于回答）
+                    if metadata.get("langgraph_node") != "model":
+                        continue
+                    for frame in to_frames(streamer.feed(chunk)):
+                        yield frame
+                    continue
+
+                if mode == "custom":
+                    # 后台生成的工具描述：只更新仍是当前步骤的工具，过时的描述直接丢弃
+                    if isinstance(payload, dict) and payload.get('kind') == 'tool_label':
+                        if payload.get('name') == last_tool and last_step is not None:
+                            tool_label = payload.get('title')
+                            last_step = {**last_step, 'action': tool_label, 'update': True}
+                            yield f"data: {json.dumps(last_step, ensure_ascii=False)}\n\n"
+                    continue
+
+                final_event = payload
+                messages = payload.get("messages", [])
                 
                 if messages:
+                    # 预取的工具结果一次性写入，直接推送为已完成的步骤
+                    for frame in prefetched_frames(messages):
+                        yield frame
+
                     last_msg = messages[-1]
                     msg_type = getattr(last_msg, 'type', 'unknown')
+
+                    # 模型轮次结束：最终回答轮次输出剩余内容，工具调用轮次丢弃缓冲
+                    if msg_type == 'ai':
+                        for frame in to_frames(streamer.end_turn(last_msg)):
+                            yield frame
                     
                     # 检测工具调用（立即推送工具名，等待 ToolMessage 中的描述）
                     if msg_type == 'ai' and hasattr(last_msg, 'tool_calls'):
@@ -459,6 +900,7 @@ async def chat_stream(request: ChatRequest):
                             
                             if tool_name != last_tool:
                                 last_tool = tool_name
+                                tool_label = None
                                 
                                 # 立即推送"准备中"状态（等待 ToolMessage 更新）
                                 step_data = {
@@ -467,6 +909,7 @@ async def chat_stream(request: ChatRequest):
                                     'tool_name': tool_name,
                                     'status': 'preparing',
                                 }
+                                last_step = step_data
                                 yield f"data: {json.dumps(step_data, ensure_ascii=False)}\n\n"
                     
                     # 检测工具执行结果（从 ToolMessage 读取 ui_events）
@@ -496,7 +939,10 @@ async def chat_stream(request: ChatRequest):
                         if tool_content:
                             tool_result = tool_content  # 全部显示，不截取
 
-                        # 先推送"进行中"状态（带 LLM 描述）
+                        # 后台 LLM 描述已到达时优先使用
+                        llm_description = tool_label or llm_description
+
+                        # 先推送"进行中"状态（带描述）
                         if llm_description:
                             step_data = {
                                 'type': 'step',
@@ -518,136 +964,53 @@ async def chat_stream(request: ChatRequest):
                             'sql': tool_sql,  # 添加 SQL 语句（供前端显示）
                             'update': True  # 更新之前的状态
                         }
+                        last_step = step_data
                         yield f"data: {json.dumps(step_data, ensure_ascii=False)}\n\n"
-                
-                await asyncio.sleep(0.01)
             
-            # 第二阶段：提取并推送查询数据
+            # 第二阶段：输出剩余回答，并补发查询数据
             if final_event:
-                messages = final_event.get("messages", [])
-                answer = None
-                sql_query = None
-                query_data = None
-
-                logger.info(f"[Data Extraction] Total messages: {len(messages)}")
-
-                # 从全局缓存中获取 DataFrame（execute_sql 工具执行时保存的）
-                df = get_last_query_result()
-                if df is not None and len(df) > 0:
-                    # 将 DataFrame 转换为 JSON 格式（list of dicts）
-                    # 处理 Decimal 类型，确保 JSON 序列化
-                    import decimal
-                    
-                    def convert_decimal(obj):
-                        """将 Decimal 转换为 float 或 string"""
-                        if isinstance(obj, decimal.Decimal):
-                            return float(obj)
-                        elif isinstance(obj, dict):
-                            return {k: convert_decimal(v) for k, v in obj.items()}
-                        elif isinstance(obj, list):
-                            return [convert_decimal(item) for item in obj]
-                        return obj
-                    
-                    query_data = df.to_dict('records')
-                    query_data = [convert_decimal(record) for record in query_data]
-                    
-                    logger.info(f"[Data Extraction] Retrieved query data from cache, rows: {len(query_data)}")
-                    # 清空缓存，避免下次查询获取到旧数据
-                    clear_last_query_result()
+                if streamer.streamed:
+                    sse_events = streamer.finish()
                 else:
-                    logger.warning(f"[Data Extraction] No query result found in cache")
-
-                # 提取执行的 SQL
-                for msg in messages:
-                    if getattr(msg, 'type', '') == 'ai' and hasattr(msg, 'tool_calls'):
-                        for tool_call in msg.tool_calls:
-                            if tool_call.get('name') == 'execute_sql':
-                                args = tool_call.get('args', {})
-                                sql_query = args.get('sql', '')
-                                if sql_query:
-                                    break
-                        if sql_query:
-                            break
-
-                # 推送查询数据
-                if query_data:
-                    logger.info(f"[Data Extraction] Preparing to push data event, rows: {len(query_data)}, SQL: {sql_query[:100] if sql_query else 'None'}")
-                    data_event = {
-                        'type': 'data',
-                        'data': query_data,
-                        'columns': list(query_data[0].keys()) if query_data else [],
-                        'sql': sql_query
-                    }
-                    yield f"data: {json.dumps(data_event, ensure_ascii=False)}\n\n"
-                    logger.info(f"[Data Extraction] Data event pushed successfully")
-                else:
-                    logger.warning(f"[Data Extraction] No query data found, cannot push data event")
-
-                # 提取最终答案：找最后一条非空的 AI 消息
-                for msg in reversed(messages):
-                    if getattr(msg, 'type', '') == 'ai':
-                        content = getattr(msg, 'content', '').strip()
-                        # 只要有实质内容就使用（无论是否有 tool_calls）
-                        if content and len(content) > 10:
-                            answer = content
-                            break
-
-                if answer:
-                    # 处理图表
-                    import re
-
-                    # 匹配 ```chartconfig ... ``` 代码块
-                    chartconfig_pattern = r'```chartconfig\s*\n?(.*?)\n?```'
-
-                    # 先提取图表配置 JSON
-                    chartconfig_match = re.search(chartconfig_pattern, answer, re.DOTALL)
-                    chart_config = None
-                    if chartconfig_match:
-                        logger.info(f"[Answer Processing] Chart config JSON detected, removing from answer")
-                        try:
-                            # 提取 JSON 内容
-                            chart_config_str = chartconfig_match.group(1).strip()
-                            chart_config = json.loads(chart_config_str)
-                            logger.info(f"[Answer Processing] Chart config JSON extracted and parsed successfully")
-                        except json.JSONDecodeError as e:
-                            logger.warning(f"[Answer Processing] Chart config JSON parsing failed: {e}")
-                            chart_config = None
-                        except Exception as e:
-                            logger.warning(f"[Answer Processing] Chart config extraction failed: {e}")
-                            chart_config = None
-
-                        # 从答案中移除图表配置代码块
-                        answer = re.sub(chartconfig_pattern, '', answer, flags=re.DOTALL).strip()
-                        logger.info(f"[Answer Processing] Chart config removed from answer, remaining length: {len(answer)}")
-
-                    # 推送图表配置（如果存在）
-                    if chart_config:
-                        logger.info(f"[Chart Config] Preparing to push chart config")
-                        chart_event = {
-                            'type': 'chart_config',
-                            'config': chart_config
-                        }
-                        yield f"data: {json.dumps(chart_event, ensure_ascii=False)}\n\n"
-                        logger.info(f"[Chart Config] Chart config pushed successfully")
-
-                    # 流式推送 增量 Token
-                    for i, char in enumerate(answer):
-                        chunk_data = {
-                            'type': 'answer',
-                            'content': char,
-                            'done': False
-                        }
-                        yield f"data: {json.dumps(chunk_data, ensure_ascii=False)}\n\n"
-                        await asyncio.sleep(0.02)  
+                    # 模型未产生 token 流时，按最后一条有内容的 AI 消息输出
+                    answer = _final_answer_text(final_event.get("messages", []))
+                    sse_events = streamer.replay(answer) if answer else []
+                    if answer:
+                        logger.info("[Answer Stream] No streamed tokens, sent final answer at once")
+
+                for frame in to_frames(sse_events):
+                    yield frame
+                if not data_sent:
+                    for frame in to_frames(data_events()):
+                        yield frame
+
+                # 推送的数据不是本次 run 最终的查询结果时不缓存（SQL 与结果可能不一致）
+                final_df = get_last_query_result(run_id)
+                if sent_df is not None and sent_df is final_df:
+                    await _store_answer(request.question, cache_db, final_event.get("messages", []), sent_event)
 
             # 结束标记
-            yield f"data: {json.dumps({'type': 'done'}, ensure_ascii=False)}\n\n"
+            outcome = "ok"
+            yield f"data: {json.dumps({'type': 'done', 'run_id': run_id}, ensure_ascii=False)}\n\n"
             
         except Exception as e:
+            outcome = "error"
             error_data = {'type': 'error', 'message': str(e)}
             yield f"data: {json.dumps(error_data, ensure_ascii=False)}\n\n"
+        finally:
+            # 释放本次 run 的查询结果
+            clear_last_query_result(run_id)
     
-    return StreamingResponse(generate(), media_type="text/event-stream")
+    async def observed():
+        """记录端到端耗时（到最后一帧发送完毕）"""
+        start = time.time()
+        try:
+            async for frame in generate():
+                yield frame
+        finally:
+            CHAT_DURATION.observe(time.time() - start, endpoint="chat_stream", outcome=outcome)
+
+    return StreamingResponse(observed(), media_type="text/event-stream")
 
 @app.post("/api/v1/training/add", response_model=TrainingDataResponse)
 async def add_training_data(request: TrainingDataRequest):
@@ -671,7 +1034,8 @@ async def add_training_data(request: TrainingDataRequest):
                 raise HTTPException(status_code=400, detail="SQL type requires question parameter")
             if not isinstance(request.content, str):
                 raise HTTPException(status_code=400, detail="SQL type content must be a string")
-            ids = [vn.add_question_sql(
+            ids = [await asyncio.to_thread(
+                vn.add_question_sql,
                 question=request.question,
                 sql=request.content,
                 db_name=request.db_name,
@@ -679,7 +1043,8 @@ async def add_training_data(request: TrainingDataRequest):
             )]
 
         elif request.data_type == "ddl":
-            ids = vn.add_ddl(
+            ids = await asyncio.to_thread(
+                vn.add_ddl,
                 request.content,
                 db_name=request.db_name,
                 table_name=request.table_name
@@ -688,7 +1053,8 @@ async def add_training_data(request: TrainingDataRequest):
                 ids = [ids]
 
         elif request.data_type == "documentation":
-            ids = vn.add_documentation(
+            ids = await asyncio.to_thread(
+                vn.add_documentation,
                 request.content,
                 db_name=request.db_name,
                 table_name=request.table_name
@@ -696,7 +1062,8 @@ async def add_training_data(request: TrainingDataRequest):
             if isinstance(ids, str):
                 ids = [ids]
         elif request.data_type == "plan":
-            ids = vn.add_plan(
+            ids = await asyncio.to_thread(
+                vn.add_plan,
                 request.content,
                 db_name=request.db_name,
                 tables=request.tables
@@ -719,15 +1086,17 @@ async def add_training_data(request: TrainingDataRequest):
 async def get_training_data(
     limit: int = 100,
     offset: int = 0,
-    data_type: Optional[str] = None
+    data_type: Optional[str] = None,
+    db_name: Optional[str] = None
 ):
     """
-    获取训练数据
+    获取训练数据（分页和过滤在 Milvus 中执行，不返回向量）
     
     Args:
         limit: 返回数量限制
         offset: 偏移量
-        data_type: 数据类型过滤 ('sql', 'ddl', 'doc')
+        data_type: 数据类型过滤 ('sql', 'ddl', 'doc', 'plan')
+        db_name: 数据库名称过滤
         
     Returns:
         训练数据列表
@@ -736,56 +1105,13 @@ async def get_training_data(
         raise HTTPException(status_code=500, detail="System not initialized")
     
     try:
-        df = vn.get_training_data()
-
-        # 添加 data_type 列，根据ID后缀判断
-        def extract_data_type(row):
-            id_value = str(row.get('id', ''))
-            if id_value.endswith('-sql'):
-                return 'sql'
-            elif id_value.endswith('-ddl'):
-                return 'ddl'
-            elif id_value.endswith('-doc'):
-                return 'documentation'
-            elif id_value.endswith('-plan'):
-                return 'plan'
-            # 备用判断逻辑
-            elif 'question' in row.index and pd.notna(row['question']) and row['question']:
-                return 'sql'
-            elif 'content' in row.index and pd.notna(row['content']) and 'CREATE TABLE' in str(row['content']).upper():
-                return 'ddl'
-            else:
-                return 'documentation'
-
-        df['data_type'] = df.apply(extract_data_type, axis=1)
-
-        # 过滤数据类型
-        if data_type:
-            suffix_map = {
-                'sql': '-sql',
-                'ddl': '-ddl',
-                'doc': '-doc',
-                'documentation': '-doc',
-                'plan': '-plan'
-            }
-            suffix = suffix_map.get(data_type.lower())
-            if suffix:
-                df = df[df['id'].str.endswith(suffix)]
-
-        # 分页
-        total = len(df)
-        df = df.iloc[offset:offset + limit]
-
-        # 替换 NaN 值为 None，以便 JSON 序列化
-        df = df.fillna(value=pd.NA)
-
-        # 转换为字典时处理 NA 值
-        records = df.to_dict(orient='records')
-        # 将 pd.NA 转换为 None
-        for record in records:
-            for key, value in record.items():
-                if pd.isna(value):
-                    record[key] = None
+        records, total = await asyncio.to_thread(
+            vn.list_training_data,
+            limit=limit,
+            offset=offset,
+            data_type=data_type,
+            db_name=db_name,
+        )
 
         return {
             "success": True,
@@ -829,225 +1155,36 @@ async def delete_training_data(request: DeleteTrainingDataRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to delete training data: {str(e)}")
 
-async def _import_training_data_from_zip(zip_path: str, db_name: str, clear_before_import: bool = True) -> Dict[str, Any]:
+@app.delete("/api/v1/training/database/{db_name}", response_model=DeleteDatabaseTrainingDataResponse)
+async def delete_database_training_data(db_name: str, collections: Optional[str] = None):
     """
-    从ZIP文件批量导入训练数据到Milvus
+    删除某个数据库的全部训练数据
+    
+    每个集合执行一次按 db_name 过滤的删除（由 Milvus 服务端完成），不逐页查询 ID
     
     Args:
-        zip_path: ZIP文件路径
-        db_name: 数据库名称，用于标识导入的数据
-        clear_before_import: 是否在导入前清理该数据库的现有数据
+        db_name: 数据库名称
+        collections: 要清理的集合，逗号分隔（默认 vannasql,vannaddl,vannadoc,vannaplan）
         
     Returns:
-        Dict: 导入结果摘要
+        DeleteDatabaseTrainingDataResponse: 每个集合删除的记录数
     """
+    if not vn:
+        raise HTTPException(status_code=500, detail="System not initialized")
     
-    # 预期文件名
-    EXPECTED_FILES = {
-        "ddl.jsonl": "vannaddl",
-        "sql_parse.jsonl": "vannasql", 
-        "doc.jsonl": "vannadoc",
-        "plan.jsonl": "vannaplan"
-    }
-    
-    # 文件到集合的字段映射
-    FIELD_MAPPING = {
-        "ddl.jsonl": {
-            "db_name": "db_name",
-            "table_name": "table_name", 
-            "ddl_doc": "ddl"
-        },
-        "sql_parse.jsonl": {
-            "db_name": "db_name",
-            "question": "text",
-            "sql": "sql",
-            "tables": "tables"
-        },
-        "doc.jsonl": {
-            "db_name": "db_name",
-            "table_name": "table_name",
-            "document": "doc"
-        },
-        "plan.jsonl": {
-            "db_name": "db_name",
-            "topic": "topic",
-            "tables": "tables"
-        }
-    }
-    
-    summary = {
-        "vannaddl": {"parsed": 0, "inserted": 0},
-        "vannasql": {"parsed": 0, "inserted": 0},
-        "vannadoc": {"parsed": 0, "inserted": 0},
-        "vannaplan": {"parsed": 0, "inserted": 0}
-    }
-    
-    # 解压文件到临时目录
-    temp_dir = tempfile.mkdtemp()
-    extract_dir = os.path.join(temp_dir, "extracted")
-    os.makedirs(extract_dir, exist_ok=True)
+    collection_list = [c.strip() for c in collections.split(",") if c.strip()] if collections else None
     
     try:
-        # 解压ZIP文件
-        logger.info(f"Extracting ZIP file: {zip_path}")
-        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            zip_ref.extractall(extract_dir)
-        
-        # 检查文件
-        extracted_files = os.listdir(extract_dir)
-        logger.info(f"Extracted files: {extracted_files}")
-        
-        missing_files = set(EXPECTED_FILES.keys()) - set(extracted_files)
-        if missing_files:
-            raise ValueError(f"Missing required files in ZIP: {missing_files}")
-        
-        # 如果需要清理现有数据
-        if clear_before_import:
-            logger.info(f"Clearing existing data for db_name: {db_name}")
-            for collection_name in ["vannasql", "vannaddl", "vannadoc", "vannaplan"]:
-                try:
-                    # 分页查询并删除该db_name的所有数据（Milvus limit最大16384）
-                    batch_size = 10000
-                    offset = 0
-                    total_deleted = 0
-                    
-                    while True:
-                        result = vn.milvus_client.query(
-                            collection_name=collection_name,
-                            filter=f'db_name == "{db_name}"',
-                            output_fields=["id"],
-                            limit=batch_size,
-                            offset=offset
-                        )
-                        if not result:
-                            break
-                        
-                        ids_to_delete = [item["id"] for item in result]
-                        vn.milvus_client.delete(collection_name=collection_name, ids=ids_to_delete)
-                        total_deleted += len(ids_to_delete)
-                        
-                        # 如果返回数量小于batch_size，说明已经查询完毕
-                        if len(result) < batch_size:
-                            break
-                        offset += batch_size
-                    
-                    if total_deleted > 0:
-                        logger.info(f"Deleted {total_deleted} records from {collection_name}")
-                except Exception as e:
-                    logger.warning(f"Failed to clear {collection_name}: {e}")
-        
-        # 并行处理四个文件
-        async def process_file(jsonl_filename: str) -> tuple:
-            """异步处理单个jsonl文件"""
-            file_path = os.path.join(extract_dir, jsonl_filename)
-            collection_name = EXPECTED_FILES[jsonl_filename]
-            field_map = FIELD_MAPPING[jsonl_filename]
-            
-            # 读取jsonl文件，支持两种格式：
-            # 1. 标准jsonl格式：每行一个JSON对象
-            # 2. JSON数组格式：整个文件是一个JSON数组
-            records = []
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read().strip()
-                if not content:
-                    pass
-                elif content.startswith('['):
-                    # JSON数组格式
-                    try:
-                        records = json.loads(content)
-                        if not isinstance(records, list):
-                            records = [records]
-                    except json.JSONDecodeError as e:
-                        logger.warning(f"Failed to parse JSON array: {e}")
-                else:
-                    # 标准jsonl格式
-                    for line in content.split('\n'):
-                        line = line.strip()
-                        if line:
-                            try:
-                                record = json.loads(line)
-                                records.append(record)
-                            except json.JSONDecodeError as e:
-                                logger.warning(f"Failed to parse JSON line: {e}")
-            
-            logger.info(f"Parsed {len(records)} records from {jsonl_filename}")
-            summary[collection_name]["parsed"] = len(records)
-            
-            if not records:
-                return collection_name, 0
-            
-            # 提取需要向量化的文本字段
-            text_field = None
-            for src_field, dst_field in field_map.items():
-                if dst_field in ["text", "ddl", "doc", "topic"]:
-                    text_field = src_field
-                    break
-            
-            texts = [record.get(text_field, "") for record in records]
-            
-            # 批量生成向量
-            logger.info(f"Generating embeddings for {len(texts)} records...")
-            embeddings = vn.embedding_function.encode_documents(texts)
-            
-            # 构建插入数据
-            insert_data = []
-            for i, record in enumerate(records):
-                # 生成唯一ID（使用UUID确保每次导入都是新记录）
-                unique_id = str(uuid.uuid4())
-                if collection_name == "vannasql":
-                    record_id = unique_id + "-sql"
-                elif collection_name == "vannaddl":
-                    record_id = unique_id + "-ddl"
-                elif collection_name == "vannadoc":
-                    record_id = unique_id + "-doc"
-                else:  # vannaplan
-                    record_id = unique_id + "-plan"
-                
-                # 构建记录
-                insert_record = {"id": record_id}
-                for src_field, dst_field in field_map.items():
-                    value = record.get(src_field, "")
-                    # 处理tables字段：如果是数组则转为逗号分隔字符串
-                    if dst_field == "tables" and isinstance(value, list):
-                        value = ",".join(value)
-                    insert_record[dst_field] = value
-                
-                # 添加向量
-                embedding = embeddings[i]
-                insert_record["vector"] = embedding.tolist() if hasattr(embedding, 'tolist') else embedding
-                
-                insert_data.append(insert_record)
-            
-            # 批量插入
-            logger.info(f"Inserting {len(insert_data)} records to {collection_name}...")
-            vn.milvus_client.insert(collection_name=collection_name, data=insert_data)
-            logger.info(f"Successfully inserted {len(insert_data)} records to {collection_name}")
-            
-            return collection_name, len(insert_data)
-        
-        # 并行执行四个文件的处理
-        tasks = [
-            process_file("ddl.jsonl"),
-            process_file("sql_parse.jsonl"),
-            process_file("doc.jsonl"),
-            process_file("plan.jsonl")
-        ]
-        
-        results = await asyncio.gather(*tasks)
-        
-        for collection_name, inserted_count in results:
-            summary[collection_name]["inserted"] = inserted_count
-        
-        logger.info(f"Import completed. Summary: {summary}")
-        return summary
-        
-    finally:
-        # 清理临时目录
-        try:
-            shutil.rmtree(temp_dir)
-            logger.info(f"Cleaned up temp directory: {temp_dir}")
-        except Exception as e:
-            logger.warning(f"Failed to cleanup temp directory: {e}")
+        deleted = await asyncio.to_thread(vn.delete_by_db_name, db_name, collection_list)
+        return DeleteDatabaseTrainingDataResponse(
+            success=True,
+            message=f"Deleted {sum(deleted.values())} training records of database {db_name}",
+            deleted=deleted
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to delete training data: {str(e)}")
 
 @app.post("/api/v1/training/import", response_model=ImportDataResponse)
 async def import_training_data(
@@ -1062,7 +1199,8 @@ async def import_training_data(
     
     ZIP文件内容要求：
     - 必须包含四个jsonl文件：ddl.jsonl, sql_parse.jsonl, doc.jsonl, plan.jsonl
-    - 文件名必须完全匹配
+    - 文件名必须完全匹配（可以位于压缩包内的单层目录中）
+    - 文件按流式读取、分批向量化并分块插入，无法解析的行会被跳过并计入 skipped
     
     字段映射规则：
     - ddl.jsonl → vannaddl集合: db_name, table_name, ddl_doc→ddl
@@ -1078,7 +1216,7 @@ async def import_training_data(
     Returns:
         ImportDataResponse: 导入结果摘要
     """
-    if not vn:
+    if not vn or not training_importer:
         raise HTTPException(status_code=500, detail="System not initialized")
     
     # 验证文件类型
@@ -1090,17 +1228,23 @@ async def import_training_data(
     zip_path = os.path.join(temp_dir, file.filename)
     
     try:
-        # 保存上传的文件
+        # 分块保存上传的文件（不把整个压缩包读入内存）
         logger.info(f"Saving uploaded file to: {zip_path}")
+        size = 0
         with open(zip_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                buffer.write(chunk)
+                size += len(chunk)
         
-        logger.info(f"File size: {len(content)} bytes")
+        logger.info(f"File size: {size} bytes")
         
-        # 执行导入
-        import hashlib
-        summary = await _import_training_data_from_zip(zip_path, db_name, clear_before_import)
+        # 在工作线程中执行导入，不阻塞事件循环
+        summary = await asyncio.to_thread(
+            training_importer.import_zip, zip_path, db_name, clear_before_import
+        )
         
         total_inserted = sum(s["inserted"] for s in summary.values())
         total_parsed = sum(s["parsed"] for s in summary.values())
@@ -1127,6 +1271,32 @@ async def import_training_data(
         except Exception as e:
             logger.warning(f"Failed to cleanup temp files: {e}")
 
+@app.get("/api/v1/training/queue")
+async def get_training_queue(status: Optional[str] = None, limit: int = 20):
+    """
+    查看后台训练队列
+    
+    Args:
+        status: 任务状态过滤 ('pending', 'running', 'done', 'failed')
+        limit: 返回的最近任务数量
+        
+    Returns:
+        队列深度、各状态任务数和最近的任务（含训练决策结果）
+    """
+    if not training_queue:
+        raise HTTPException(status_code=500, detail="System not initialized")
+    
+    try:
+        stats = await asyncio.to_thread(training_queue.stats)
+        jobs = await asyncio.to_thread(training_queue.list_jobs, status, limit)
+        return {
+            "success": True,
+            "stats": stats,
+            "jobs": jobs,
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get training queue: {str(e)}")
+
 @app.post("/api/v1/database/test", response_model=DatabaseConnectionResponse)
 async def test_database_connection(request: DatabaseConnectionRequest):
     """
@@ -1239,6 +1409,8 @@ async def connect_database(request: DatabaseConnectionRequest):
                 logger.info(f"Cached connection config for database: {request.database}")
                 # 持久化到文件
                 save_db_connections()
+                if vn:
+                    vn.register_mysql_database(request.database, db_connection_configs[request.database])
 
             # 更新全局vn客户端连接
             if vn:
@@ -1308,6 +1480,46 @@ async def get_connected_databases():
         "database_configs": databases  # 返回完整配置信息
     }
 
+@app.delete("/api/v1/database/{db_name}/cache", response_model=InvalidateSQLCacheResponse)
+async def invalidate_sql_cache(db_name: str, tables: Optional[str] = None):
+    """
+    使某个数据库的查询结果缓存失效（数据在本服务之外被修改后调用）
+
+    Args:
+        db_name: 数据库名称
+        tables: 表名，逗号分隔（默认该数据库的全部缓存结果）
+
+    Returns:
+        InvalidateSQLCacheResponse: 删除的缓存条目数
+    """
+    if not vn:
+        raise HTTPException(status_code=500, detail="System not initialized")
+
+    db_name = resolve_request_db_name(db_name)
+    table_list = [t.strip() for t in tables.split(",") if t.strip()] if tables else None
+    invalidated = vn.invalidate_sql_cache(db_name, table_list)
+    return InvalidateSQLCacheResponse(
+        success=True,
+        message=f"Invalidated {invalidated} cached results of database {db_name}",
+        invalidated=invalidated
+    )
+
+@app.get("/api/v1/traces/{run_id}")
+async def get_trace(run_id: str):
+    """
+    查询一次 Agent run 的链路追踪（进行中的 run 也可查询，只包含已结束的 span）
+
+    Args:
+        run_id: run ID（/api/v1/chat 响应或 /api/v1/chat/stream 的 done 事件中返回）
+
+    Returns:
+        dict: trace_id / duration_ms / spans（按开始时间排序，parent_id 指向父 span）/ summary（按类型汇总耗时）
+    """
+    trace = get_tracer().get_trace(run_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail=f"Trace {run_id} not found")
+    return trace
+
 @app.post("/api/query", response_model=QueryResponse)
 async def query_data(request: QueryRequest):
     """
@@ -1324,25 +1536,14 @@ async def query_data(request: QueryRequest):
     if not vn:
         raise HTTPException(status_code=500, detail="System not initialized")
 
-    # 如果提供了 db_name，切换到对应的数据库连接
-    if request.db_name:
-        if request.db_name in db_connection_configs:
-            config = db_connection_configs[request.db_name]
-            try:
-                vn.connect_to_mysql(**config)
-                logger.info(f"[Query] Switched to database: {request.db_name}")
-            except Exception as e:
-                logger.warning(f"[Query] Failed to switch to database {request.db_name}: {str(e)}")
-                raise HTTPException(status_code=500, detail=f"Failed to connect to database {request.db_name}: {str(e)}")
-        else:
-            logger.warning(f"[Query] Database {request.db_name} not found in connection cache")
-            raise HTTPException(status_code=400, detail=f"Database {request.db_name} not found. Please reconnect to this database first.")
+    # 如果提供了 db_name，本次查询路由到对应的连接池（不切换全局连接）
+    db_name = resolve_request_db_name(request.db_name)
 
     try:
         # 如果提供了SQL，直接执行
         if request.sql:
             logger.info(f"[Direct SQL Query] Executing SQL: {request.sql[:100]}...")
-            df = vn.run_sql(request.sql)
+            df = await asyncio.to_thread(vn.run_sql, request.sql, db_name=db_name)
 
             if df is None or df.empty:
                 return QueryResponse(
@@ -1360,24 +1561,27 @@ async def query_data(request: QueryRequest):
                 data=df.to_dict(orient='records'),
                 columns=df.columns.tolist(),
                 sql=request.sql,
-                answer=f"Query successful, returned {len(df)} records",
+                answer=f"Query successful, returned {len(df)} records"
+                + (" (truncated: result exceeds the row/size limit)" if df.attrs.get("truncated") else ""),
                 total_rows=len(df),
-                returned_rows=len(df)
+                returned_rows=len(df),
+                truncated=bool(df.attrs.get("truncated"))
             )
 
         # 如果提供了自然语言查询，使用vanna生成SQL
         elif request.query:
             logger.info(f"[Natural Language Query] Question: {request.query}")
 
-            # 使用vanna生成SQL
-            generated_sql = vn.generate_sql(question=request.query)
+            # 使用vanna生成SQL（RAG 检索走异步嵌入接口，LLM 调用在线程中执行，不阻塞事件循环）
+            retrieval = await vn.aretrieve_context(request.query)
+            generated_sql = await asyncio.to_thread(vn.generate_sql, question=request.query, retrieval=retrieval)
             logger.info(f"[Generated SQL] {generated_sql}")
 
             if not generated_sql:
                 raise HTTPException(status_code=500, detail="Unable to generate SQL query")
 
             # 执行SQL
-            df = vn.run_sql(generated_sql)
+            df = await asyncio.to_thread(vn.run_sql, generated_sql, db_name=db_name)
 
             if df is None or df.empty:
                 return QueryResponse(
@@ -1392,6 +1596,8 @@ async def query_data(request: QueryRequest):
 
             # 生成自然语言答案（简化版本）
             answer = f"Query successful, found {len(df)} records"
+            if df.attrs.get("truncated"):
+                answer = f"Query successful, found at least {len(df)} records (result truncated)"
 
             limit = request.limit or 100
             return QueryResponse(
@@ -1401,7 +1607,8 @@ async def query_data(request: QueryRequest):
                 sql=generated_sql,
                 answer=answer,
                 total_rows=len(df),
-                returned_rows=min(len(df), limit)
+                returned_rows=min(len(df), limit),
+                truncated=bool(df.attrs.get("truncated"))
             )
         else:
             raise HTTPException(status_code=400, detail="Must provide either query or sql parameter")
@@ -1418,9 +1625,29 @@ async def health_check():
         "vanna_initialized": vn is not None,
         "agent_initialized": agent is not None,
         "llm_initialized": llm is not None,
+        "agent_runs": agent_runner.stats() if agent_runner else None,
+        "mysql_pools": vn.mysql_pool_stats() if vn else None,
+        "sql_result_cache": vn.sql_cache_stats() if vn else None,
+        "embedding_query_cache": vn.embedding_cache_stats() if vn else None,
+        "embedding_store": vn.embedding_store_stats() if vn else None,
+        "schema_cache": get_schema_catalog().stats(),
+        "mysql_capabilities": get_capability_registry().stats(),
+        "training_import": training_importer.stats() if training_importer else None,
+        "training_queue": training_queue.stats() if training_queue else None,
+        "answer_cache": answer_cache.stats() if answer_cache else None,
+        "tracing": get_tracer().stats(),
         "timestamp": time.strftime('%Y-%m-%d %H:%M:%S')
     }
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus 指标（文本格式 0.0.4）"""
+    update_runtime_gauges(
+        agent_stats=agent_runner.stats() if agent_runner else None,
+        pool_stats=vn.mysql_pool_stats() if vn else None,
+    )
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 # ==================== 主函数 ====================
 
 if __name__ == "__main__":
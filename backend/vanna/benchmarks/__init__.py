@@ -0,0 +1 @@
+# benchmarks 包初始化文件（离线性能基准，见 offline_pipeline.py）
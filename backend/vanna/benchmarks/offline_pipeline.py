@@ -0,0 +1,733 @@
+"""
+离线端到端性能基准
+在不访问任何网络服务的情况下运行完整的 create_nl2sql_agent + MyVanna 链路：
+
+- LLM：按问题返回固定工具调用和回答的脚本化模型（可模拟网络延迟，返回 usage 便于统计 token）
+- 嵌入：字符 n-gram 哈希向量（确定性，相似问题的向量相近），继承 EmbeddingBase 走真实的批量 / 缓存逻辑
+- 向量库：Milvus Lite（本地文件）
+- MySQL：SQLite 替身（实现 query_limited，并模拟 VERSION()、@@sql_mode 和 information_schema）
+
+按阶段（训练数据写入、查询向量化、RAG 检索、SQL 执行、单客户端 Agent、N 并发 Agent）
+输出 p50 / p95 延迟、吞吐量和阶段内的峰值内存增量（tracemalloc），
+可保存为 JSON 并与基线比较（p95 退化超过阈值时返回非 0 退出码）
+
+使用示例:
+    python -m benchmarks.offline_pipeline --iterations 5 --concurrency 4
+    python -m benchmarks.offline_pipeline --json bench.json --baseline baseline.json --max-regression 0.2
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import numpy as np
+
+# 与 api_server 相同的导入方式（src.Improve.*）
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from langchain_core.language_models.chat_models import BaseChatModel  # type: ignore
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, ToolMessage  # type: ignore
+from langchain_core.outputs import ChatGeneration, ChatResult  # type: ignore
+from pymilvus import MilvusClient
+
+from src.Improve.clients import MyVanna
+from src.Improve.clients.embedding_providers import EmbeddingBase
+from src.Improve.clients.mysql_pool import MySQLPoolRegistry
+from src.Improve.agent import create_nl2sql_agent, AgentRunner
+from src.Improve.middleware import configure_tool_descriptions
+from src.Improve.shared import set_vanna_client, set_schema_catalog, SchemaCatalog
+
+
+# ==================== 基准数据集 ====================
+
+TABLES = {
+    "customers": (
+        "客户表",
+        """CREATE TABLE customers (
+    id INT PRIMARY KEY COMMENT '客户ID',
+    name VARCHAR(50) NOT NULL COMMENT '客户姓名',
+    gender VARCHAR(4) COMMENT '性别',
+    city VARCHAR(20) COMMENT '所在城市',
+    created_at DATE COMMENT '注册日期'
+) COMMENT='客户表'""",
+    ),
+    "products": (
+        "商品表",
+        """CREATE TABLE products (
+    id INT PRIMARY KEY COMMENT '商品ID',
+    name VARCHAR(50) NOT NULL COMMENT '商品名称',
+    category VARCHAR(20) COMMENT '品类',
+    price DECIMAL(10,2) COMMENT '单价'
+) COMMENT='商品表'""",
+    ),
+    "orders": (
+        "订单表",
+        """CREATE TABLE orders (
+    id INT PRIMARY KEY COMMENT '订单ID',
+    customer_id INT NOT NULL COMMENT '客户ID',
+    product_id INT NOT NULL COMMENT '商品ID',
+    quantity INT COMMENT '数量',
+    amount DECIMAL(10,2) COMMENT '订单金额',
+    order_date DATE COMMENT '下单日期'
+) COMMENT='订单表'""",
+    ),
+}
+
+DOCUMENTATION = [
+    "订单金额 amount = 商品单价 price × 数量 quantity",
+    "客单价指每个订单的平均金额",
+    "性别 gender 取值为 '男' 或 '女'",
+]
+
+# 问题 -> SQL（同时作为训练数据和脚本化 LLM 的回答；SQL 同时兼容 MySQL 和 SQLite）
+QUESTIONS = {
+    "一共有多少客户": "SELECT COUNT(*) AS customer_count FROM customers",
+    "每个城市的客户数量": (
+        "SELECT city, COUNT(*) AS customers FROM customers GROUP BY city ORDER BY customers DESC"
+    ),
+    "销售额最高的 5 个商品": (
+        "SELECT p.name, SUM(o.amount) AS sales FROM orders o JOIN products p ON o.product_id = p.id "
+        "GROUP BY p.id, p.name ORDER BY sales DESC LIMIT 5"
+    ),
+    "各品类的平均客单价": (
+        "SELECT p.category, AVG(o.amount) AS avg_amount FROM orders o JOIN products p ON o.product_id = p.id "
+        "GROUP BY p.category ORDER BY avg_amount DESC"
+    ),
+    "女性客户的平均订单金额": (
+        "SELECT AVG(o.amount) AS avg_amount FROM orders o JOIN customers c ON o.customer_id = c.id "
+        "WHERE c.gender = '女'"
+    ),
+    "每个月的订单数和销售额": (
+        "SELECT SUBSTR(order_date, 1, 7) AS month, COUNT(*) AS orders, SUM(amount) AS sales "
+        "FROM orders GROUP BY SUBSTR(order_date, 1, 7) ORDER BY month"
+    ),
+    "列出所有订单明细": "SELECT * FROM orders",
+}
+
+_CITIES = ["北京", "上海", "广州", "深圳", "杭州", "成都", "武汉", "南京"]
+_CATEGORIES = ["数码", "家电", "服装", "食品", "图书"]
+
+
+def build_sqlite_database(path: str, customers: int = 1_000, orders: int = 20_000, seed: int = 42):
+    """生成基准数据库（固定随机种子，结果可复现）"""
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    try:
+        conn.executescript("""
+            CREATE TABLE customers (id INTEGER PRIMARY KEY, name TEXT NOT NULL, gender TEXT, city TEXT, created_at TEXT);
+            CREATE TABLE products (id INTEGER PRIMARY KEY, name TEXT NOT NULL, category TEXT, price REAL);
+            CREATE TABLE orders (id INTEGER PRIMARY KEY, customer_id INTEGER NOT NULL, product_id INTEGER NOT NULL,
+                                 quantity INTEGER, amount REAL, order_date TEXT);
+        """)
+        conn.executemany("INSERT INTO customers VALUES (?, ?, ?, ?, ?)", [
+            (i, f"客户{i}", rng.choice("男女"), rng.choice(_CITIES), f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}")
+            for i in range(1, customers + 1)
+        ])
+        products = [(i, f"商品{i}", rng.choice(_CATEGORIES), round(rng.uniform(5, 2000), 2)) for i in range(1, 201)]
+        conn.executemany("INSERT INTO products VALUES (?, ?, ?, ?)", products)
+        rows = []
+        for i in range(1, orders + 1):
+            product = rng.choice(products)
+            quantity = rng.randint(1, 5)
+            rows.append((
+                i, rng.randint(1, customers), product[0], quantity, round(product[3] * quantity, 2),
+                f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            ))
+        conn.executemany("INSERT INTO orders VALUES (?, ?, ?, ?, ?, ?)", rows)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+# ==================== MySQL 替身（SQLite） ====================
+
+_SQL_MODE = re.compile(r"@@(?:SESSION\.|GLOBAL\.)?sql_mode", re.IGNORECASE)
+
+
+class SQLiteStandInPool:
+    """
+    与 MySQLConnectionPool.query_limited / stats 接口一致的 SQLite 连接池替身
+
+    每个线程一个连接；连接上附加内存库 information_schema（TABLES / COLUMNS 由 SQLite 表结构生成），
+    并注册 VERSION()、DATABASE() 函数，表结构缓存和能力探测的 SQL 无需修改即可执行
+    """
+
+    version = "8.0.36-sqlite-standin"
+    sql_mode = "ONLY_FULL_GROUP_BY,STRICT_TRANS_TABLES"
+
+    def __init__(self, path: str, database: str, table_comments: Optional[Dict[str, str]] = None):
+        self.path = path
+        self.database = database
+        self.table_comments = table_comments or {}
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._in_use = 0
+        self._lock = threading.Lock()
+
+    def query_limited(self, sql: str, max_rows: Optional[int] = None, max_bytes: Optional[int] = None,
+                      chunk_size: int = 1000):
+        """
+        执行 SQL，超过 max_rows / max_bytes 时停止读取
+
+        Returns:
+            (列名, 行, 截断原因)；语句无结果集时列名为 None
+        """
+        sql = _SQL_MODE.sub(f"'{self.sql_mode}'", sql)
+        conn = self._connection()
+        with self._lock:
+            self._in_use += 1
+        try:
+            cursor = conn.execute(sql)
+            if cursor.description is None:
+                conn.commit()
+                return None, [], None
+            columns = [d[0] for d in cursor.description]
+            rows: List[tuple] = []
+            size = 0
+            while True:
+                chunk = cursor.fetchmany(chunk_size)
+                if not chunk:
+                    return columns, rows, None
+                rows.extend(chunk)
+                size += sum(len(str(v)) if isinstance(v, (str, bytes)) else 8 for row in chunk for v in row)
+                if max_rows and max_rows > 0 and len(rows) > max_rows:
+                    return columns, rows[:max_rows], "max_rows"
+                if max_bytes and max_bytes > 0 and size > max_bytes:
+                    return columns, rows, "max_bytes"
+        finally:
+            with self._lock:
+                self._in_use -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "database": self.database,
+                "host": "sqlite",
+                "pool_size": len(self._connections),
+                "total": len(self._connections),
+                "idle": len(self._connections) - self._in_use,
+                "in_use": self._in_use,
+            }
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.create_function("VERSION", 0, lambda: self.version)
+            conn.create_function("DATABASE", 0, lambda: self.database)
+            self._attach_information_schema(conn)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _attach_information_schema(self, conn: sqlite3.Connection):
+        conn.execute("ATTACH DATABASE ':memory:' AS information_schema")
+        conn.execute("""CREATE TABLE information_schema.TABLES (
+            TABLE_SCHEMA TEXT, TABLE_NAME TEXT, TABLE_COMMENT TEXT, UPDATE_TIME TEXT, CREATE_TIME TEXT)""")
+        conn.execute("""CREATE TABLE information_schema.COLUMNS (
+            TABLE_SCHEMA TEXT, TABLE_NAME TEXT, COLUMN_NAME TEXT, ORDINAL_POSITION INTEGER, COLUMN_TYPE TEXT,
+            IS_NULLABLE TEXT, COLUMN_KEY TEXT, COLUMN_DEFAULT TEXT, COLUMN_COMMENT TEXT)""")
+        tables = [r[0] for r in conn.execute(
+            "SELECT name FROM main.sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+        )]
+        for table in tables:
+            conn.execute(
+                "INSERT INTO information_schema.TABLES VALUES (?, ?, ?, NULL, NULL)",
+                (self.database, table, self.table_comments.get(table, "")),
+            )
+            for cid, name, col_type, notnull, default, pk in conn.execute(f'PRAGMA main.table_info("{table}")'):
+                conn.execute(
+                    "INSERT INTO information_schema.COLUMNS VALUES (?, ?, ?, ?, ?, ?, ?, ?, '')",
+                    (self.database, table, name, cid + 1, col_type.lower() or "text",
+                     "NO" if notnull or pk else "YES", "PRI" if pk else "", default),
+                )
+
+
+class SQLitePoolRegistry(MySQLPoolRegistry):
+    """按 db_name 返回 SQLite 替身连接池的 MySQLPoolRegistry（connect_to_mysql 的登记流程不变）"""
+
+    def __init__(self, databases: Dict[str, str], table_comments: Optional[Dict[str, str]] = None):
+        """
+        Args:
+            databases: db_name -> SQLite 文件路径
+            table_comments: 表名 -> 表说明（写入 information_schema.TABLES）
+        """
+        super().__init__()
+        self.databases = databases
+        self.table_comments = table_comments or {}
+
+    def get(self, db_name: str) -> SQLiteStandInPool:
+        with self._lock:
+            pool = self._pools.get(db_name)
+            if pool is None:
+                if db_name not in self._configs:
+                    raise KeyError(f"Database {db_name} is not registered")
+                pool = SQLiteStandInPool(self.databases[db_name], self._configs[db_name]["database"], self.table_comments)
+                self._pools[db_name] = pool
+            return pool
+
+
+# ==================== 嵌入模型替身 ====================
+
+class HashEmbedding(EmbeddingBase):
+    """字符 n-gram 哈希向量（确定性；共享字词越多的文本余弦相似度越高）"""
+
+    default_max_batch_size = 32
+
+    def __init__(self, dim: int = 256, latency_ms: float = 0.0):
+        """
+        Args:
+            dim: 向量维度
+            latency_ms: 每次请求模拟的网络延迟（毫秒）
+        """
+        super().__init__(api_url="mock://hash-embedding", model_name=f"hash-{dim}")
+        self.dim = dim
+        self.embedding_dim = dim
+        self.latency_ms = latency_ms
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            text = text.lower()
+            for n in (1, 2, 3):
+                for j in range(max(len(text) - n + 1, 0)):
+                    digest = hashlib.blake2b(text[j:j + n].encode("utf-8"), digest_size=4).digest()
+                    vectors[i, int.from_bytes(digest, "little") % self.dim] += 1.0
+            norm = np.linalg.norm(vectors[i])
+            if norm:
+                vectors[i] /= norm
+            else:
+                vectors[i, 0] = 1.0
+        return vectors
+
+
+# ==================== LLM 替身 ====================
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    按对话状态返回固定回答的聊天模型（线程安全，无内部游标）
+
+    - 还没有表结构信息时：调用 get_all_tables_info + get_table_schema（关闭预取时）
+    - 有表结构、还没有执行结果时：调用 execute_sql（SQL 取自 script，未知问题使用第一条）
+    - 有执行结果时：输出最终回答
+    """
+
+    script: Dict[str, str] = {}
+    latency_ms: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _generate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs) -> ChatResult:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        message = self._respond(messages)
+        input_tokens = sum(len(str(m.content)) for m in messages) // 4
+        output_tokens = (len(message.content) + len(json.dumps([c["args"] for c in message.tool_calls]))) // 4
+        message.usage_metadata = {
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+        }
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _respond(self, messages: List[BaseMessage]) -> AIMessage:
+        start = max((i for i, m in enumerate(messages) if isinstance(m, HumanMessage)), default=0)
+        question = str(messages[start].content) if messages else ""
+        results = {m.name: str(m.content) for m in messages[start + 1:] if isinstance(m, ToolMessage)}
+
+        if "execute_sql" in results:
+            summary = results["execute_sql"].strip().splitlines()
+            return AIMessage(content=f"根据查询结果回答「{question}」：\n" + "\n".join(summary[:8]))
+        if "get_table_schema" not in results:
+            return AIMessage(content="", tool_calls=[
+                self._tool_call("get_all_tables_info", {"question": question}),
+                self._tool_call("get_table_schema", {"question": question}),
+            ])
+        sql = self.script.get(question) or next(iter(self.script.values()), "SELECT 1")
+        return AIMessage(content="", tool_calls=[self._tool_call("execute_sql", {"sql": sql})])
+
+    @staticmethod
+    def _tool_call(name: str, args: Dict[str, Any]) -> Dict[str, Any]:
+        return {"name": name, "args": args, "id": f"call_{uuid.uuid4().hex[:12]}", "type": "tool_call"}
+
+
+# ==================== 统计 ====================
+
+@dataclass
+class StageResult:
+    """一个阶段的统计结果（延迟单位毫秒）"""
+    stage: str
+    count: int
+    p50_ms: float
+    p95_ms: float
+    mean_ms: float
+    max_ms: float
+    wall_s: float
+    throughput: float  # 每秒完成的操作数
+    peak_memory_mb: Optional[float]  # 阶段内相对阶段开始时的峰值内存增量（未追踪内存时为 None）
+
+
+def percentile(values: List[float], q: float) -> float:
+    """线性插值的分位数（q 取 0-100）"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    pos = (len(ordered) - 1) * q / 100
+    low = int(pos)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (pos - low)
+
+
+class _Stage:
+    """收集一个阶段内每次操作的耗时"""
+
+    def __init__(self, name: str, trace_memory: bool):
+        self.name = name
+        self.trace_memory = trace_memory
+        self.latencies: List[float] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def op(self) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.latencies.append((time.perf_counter() - t0) * 1000)
+
+    @contextmanager
+    def run(self) -> Iterator["_Stage"]:
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        t0 = time.perf_counter()
+        yield self
+        self.wall_s = time.perf_counter() - t0
+        self.peak_memory_mb = (
+            round((tracemalloc.get_traced_memory()[1] - base) / 1024 / 1024, 2) if self.trace_memory else None
+        )
+
+    def result(self) -> StageResult:
+        values = self.latencies
+        return StageResult(
+            stage=self.name,
+            count=len(values),
+            p50_ms=round(percentile(values, 50), 2),
+            p95_ms=round(percentile(values, 95), 2),
+            mean_ms=round(sum(values) / len(values), 2) if values else 0.0,
+            max_ms=round(max(values), 2) if values else 0.0,
+            wall_s=round(self.wall_s, 3),
+            throughput=round(len(values) / self.wall_s, 2) if self.wall_s > 0 else 0.0,
+            peak_memory_mb=self.peak_memory_mb,
+        )
+
+
+# ==================== 基准流程 ====================
+
+@dataclass
+class BenchmarkConfig:
+    """基准参数"""
+    iterations: int = 3  # 每个阶段把问题集重复执行的次数
+    concurrency: int = 4  # 并发阶段的客户端数（同时也是 AgentRunner 的工作线程数）
+    questions: Optional[List[str]] = None  # 默认使用全部 QUESTIONS
+    customers: int = 1_000
+    orders: int = 20_000
+    llm_latency_ms: float = 0.0
+    embedding_latency_ms: float = 0.0
+    enable_prefetch: bool = True
+    enable_caches: bool = False  # 是否启用查询向量缓存和 SQL 结果缓存（默认关闭，每次都走完整链路）
+    trace_memory: bool = True
+    workdir: Optional[str] = None  # 默认使用临时目录，结束后删除
+
+
+class OfflineBenchmark:
+    """
+    离线基准：搭建替身环境并按阶段计时
+
+    使用示例:
+        with OfflineBenchmark(BenchmarkConfig(iterations=2)) as bench:
+            results = bench.run()
+        print(format_results(results))
+    """
+
+    db_name = "bench_shop"
+
+    def __init__(self, config: Optional[BenchmarkConfig] = None):
+        self.config = config or BenchmarkConfig()
+        self.questions = self.config.questions or list(QUESTIONS)
+        self.vn: Optional[MyVanna] = None
+        self.runner: Optional[AgentRunner] = None
+        self._workdir: Optional[str] = None
+
+    def __enter__(self) -> "OfflineBenchmark":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ==================== 公开接口 ====================
+
+    def run(self) -> List[StageResult]:
+        """执行全部阶段"""
+        cfg = self.config
+        started_tracing = cfg.trace_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        try:
+            results = [self._setup()]
+            results.append(self._timed("embedding", self._embed_question))
+            results.append(self._timed("retrieval", self._retrieve))
+            results.append(self._timed("sql", self._run_sql))
+            results.append(self._timed("agent", self._run_agent))
+            results.append(self._concurrent_agent())
+            return results
+        finally:
+            if started_tracing:
+                tracemalloc.stop()
+
+    def close(self):
+        if self.runner is not None:
+            self.runner.shutdown(wait=True)
+            self.runner = None
+        if self.vn is not None:
+            self.vn._mysql_pools.close_all()
+            self.vn.embedding_function.close()
+            self.vn = None
+        if self._workdir and not self.config.workdir:
+            shutil.rmtree(self._workdir, ignore_errors=True)
+        self._workdir = None
+
+    # ==================== 阶段 ====================
+
+    def _setup(self) -> StageResult:
+        """搭建环境并写入训练数据（计时单位：每条训练数据）"""
+        cfg = self.config
+        self._workdir = cfg.workdir or tempfile.mkdtemp(prefix="nl2sql-bench-")
+        Path(self._workdir).mkdir(parents=True, exist_ok=True)
+        sqlite_path = str(Path(self._workdir) / "bench_shop.sqlite")
+        milvus_path = str(Path(self._workdir) / "bench_milvus.db")
+        for path in (sqlite_path, milvus_path):
+            Path(path).unlink(missing_ok=True)
+        build_sqlite_database(sqlite_path, customers=cfg.customers, orders=cfg.orders)
+
+        embedding = HashEmbedding(latency_ms=cfg.embedding_latency_ms)
+        if not cfg.enable_caches:
+            embedding.configure_query_cache(max_size=0)
+        self.vn = MyVanna(config={
+            "model": "scripted",
+            "api_key": "offline",
+            "milvus_client": MilvusClient(uri=milvus_path),
+            "embedding_function": embedding,
+            "metric_type": "COSINE",
+            "dialect": "MySQL",
+            "language": "zh-CN",
+            "sql_result_cache_ttl": 60 if cfg.enable_caches else 0,
+        })
+        self.vn.static_documentation = ""
+        self.vn._mysql_pools = SQLitePoolRegistry(
+            {self.db_name: sqlite_path},
+            table_comments={name: comment for name, (comment, _) in TABLES.items()},
+        )
+        self.vn.connect_to_mysql(host="sqlite", dbname=self.db_name, user="bench", password="", port=3306)
+        set_vanna_client(self.vn)
+        set_schema_catalog(SchemaCatalog())
+        configure_tool_descriptions(llm_enabled=False)
+
+        items: List[Callable[[], Any]] = []
+        for name, (_, ddl) in TABLES.items():
+            items.append(lambda ddl=ddl, name=name: self.vn.add_ddl(ddl, db_name=self.db_name, table_name=name))
+        for doc in DOCUMENTATION:
+            items.append(lambda doc=doc: self.vn.add_documentation(doc, db_name=self.db_name))
+        for question, sql in QUESTIONS.items():
+            items.append(lambda q=question, s=sql: self.vn.add_question_sql(q, s, db_name=self.db_name))
+
+        stage = _Stage("training", cfg.trace_memory)
+        with stage.run():
+            for item in items:
+                with stage.op():
+                    item()
+
+        llm = ScriptedChatModel(script=dict(QUESTIONS), latency_ms=cfg.llm_latency_ms)
+        agent = create_nl2sql_agent(llm, enable_middleware=True, enable_ui_events=True,
+                                    enable_prefetch=cfg.enable_prefetch)
+        self.runner = AgentRunner(agent, max_concurrent_runs=max(1, cfg.concurrency))
+        return stage.result()
+
+    def _timed(self, name: str, fn: Callable[[str], Any]) -> StageResult:
+        """对问题集重复 iterations 次，逐个计时"""
+        stage = _Stage(name, self.config.trace_memory)
+        with stage.run():
+            for _ in range(self.config.iterations):
+                for question in self.questions:
+                    with stage.op():
+                        fn(question)
+        return stage.result()
+
+    def _embed_question(self, question: str):
+        self.vn.embedding_function.encode_queries([question])
+
+    def _retrieve(self, question: str):
+        self.vn.retrieve_context(question, db_name=self.db_name, threshold=0.5, top_k=5)
+
+    def _run_sql(self, question: str):
+        self.vn.run_sql(QUESTIONS.get(question, "SELECT 1"), db_name=self.db_name)
+
+    def _run_agent(self, question: str):
+        asyncio.run(self._invoke(question))
+
+    def _concurrent_agent(self) -> StageResult:
+        """concurrency 个客户端同时提问，每个客户端把问题集执行 iterations 次"""
+        cfg = self.config
+        stage = _Stage(f"agent_x{cfg.concurrency}", cfg.trace_memory)
+
+        async def client(offset: int):
+            for i in range(cfg.iterations * len(self.questions)):
+                question = self.questions[(offset + i) % len(self.questions)]
+                with stage.op():
+                    await self._invoke(question)
+
+        async def main():
+            await asyncio.gather(*(client(n) for n in range(cfg.concurrency)))
+
+        with stage.run():
+            asyncio.run(main())
+        return stage.result()
+
+    async def _invoke(self, question: str):
+        run_id = f"bench-{uuid.uuid4().hex}"
+        final_event = await self.runner.invoke(
+            {"messages": [{"role": "user", "content": question}]},
+            config={"configurable": {"thread_id": run_id}, "recursion_limit": 50},
+            run_id=run_id,
+            db_name=self.db_name,
+        )
+        messages = (final_event or {}).get("messages", [])
+        if not messages or getattr(messages[-1], "type", "") != "ai" or messages[-1].tool_calls:
+            raise RuntimeError(f"Agent run for {question!r} did not produce a final answer")
+        return messages
+
+
+# ==================== 报告 ====================
+
+def format_results(results: List[StageResult]) -> str:
+    """文本表格"""
+    header = f"{'stage':<12}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'mean ms':>10}{'max ms':>10}{'ops/s':>9}{'peak MB':>9}"
+    lines = [header, "-" * len(header)]
+    for r in results:
+        peak = "-" if r.peak_memory_mb is None else f"{r.peak_memory_mb:.2f}"
+        lines.append(
+            f"{r.stage:<12}{r.count:>7}{r.p50_ms:>10.2f}{r.p95_ms:>10.2f}{r.mean_ms:>10.2f}"
+            f"{r.max_ms:>10.2f}{r.throughput:>9.2f}{peak:>9}"
+        )
+    return "\n".join(lines)
+
+
+def compare_with_baseline(results: List[StageResult], baseline: List[Dict[str, Any]],
+                          max_regression: float = 0.2) -> List[str]:
+    """
+    与基线比较 p95 延迟
+
+    Returns:
+        退化超过 max_regression（相对比例）的阶段说明；为空表示没有退化
+    """
+    previous = {item["stage"]: item for item in baseline}
+    regressions = []
+    for r in results:
+        base = previous.get(r.stage)
+        if not base or not base.get("p95_ms"):
+            continue
+        ratio = r.p95_ms / base["p95_ms"] - 1
+        if ratio > max_regression:
+            regressions.append(f"{r.stage}: p95 {base['p95_ms']:.2f} ms -> {r.p95_ms:.2f} ms (+{ratio:.0%})")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="NL2SQL 离线端到端性能基准")
+    parser.add_argument("--iterations", type=int, default=3, help="每个阶段重复问题集的次数")
+    parser.add_argument("--concurrency", type=int, default=4, help="并发阶段的客户端数")
+    parser.add_argument("--customers", type=int, default=1_000, help="客户表行数")
+    parser.add_argument("--orders", type=int, default=20_000, help="订单表行数")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="每次 LLM 调用模拟的延迟")
+    parser.add_argument("--embedding-latency-ms", type=float, default=0.0, help="每次嵌入请求模拟的延迟")
+    parser.add_argument("--no-prefetch", action="store_true", help="关闭上下文预取")
+    parser.add_argument("--enable-caches", action="store_true", help="启用查询向量缓存和 SQL 结果缓存")
+    parser.add_argument("--no-memory", action="store_true", help="不使用 tracemalloc（内存追踪会放大延迟）")
+    parser.add_argument("--workdir", type=str, default=None, help="数据文件目录（默认临时目录）")
+    parser.add_argument("--json", type=str, default=None, help="结果写入 JSON 文件")
+    parser.add_argument("--baseline", type=str, default=None, help="基线 JSON 文件（比较 p95）")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="允许的 p95 相对退化比例")
+    args = parser.parse_args(argv)
+
+    config = BenchmarkConfig(
+        iterations=args.iterations,
+        concurrency=args.concurrency,
+        customers=args.customers,
+        orders=args.orders,
+        llm_latency_ms=args.llm_latency_ms,
+        embedding_latency_ms=args.embedding_latency_ms,
+        enable_prefetch=not args.no_prefetch,
+        enable_caches=args.enable_caches,
+        trace_memory=not args.no_memory,
+        workdir=args.workdir,
+    )
+    with OfflineBenchmark(config) as bench:
+        results = bench.run()
+
+    print(format_results(results))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"config": asdict(config), "results": [asdict(r) for r in results]}, f,
+                      ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare_with_baseline(results, baseline, args.max_regression)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    # 导入的模块已配置了根 logger，这里只调高级别，避免逐条日志影响计时
+    logging.getLogger().setLevel(logging.WARNING)
+    sys.exit(main())
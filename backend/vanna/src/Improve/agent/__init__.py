@@ -4,6 +4,9 @@ logger = logging.getLogger(__name__)
 from .nl2sql_agent import create_nl2sql_agent
 from ..shared import set_vanna_client, get_vanna_client, get_api_key, set_api_key
 from .post_training import PostTrainingProcessor, extract_conversation_summary
+from .executor import AgentRunner
+from .answer_stream import AnswerStreamer
+from .answer_cache import SemanticAnswerCache, CachedAnswer
 
 __all__ = [
     'create_nl2sql_agent',
@@ -13,4 +16,8 @@ __all__ = [
     'set_api_key',
     'PostTrainingProcessor',
     'extract_conversation_summary',
+    'AgentRunner',
+    'AnswerStreamer',
+    'SemanticAnswerCache',
+    'CachedAnswer',
 ]
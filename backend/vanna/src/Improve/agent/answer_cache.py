@@ -0,0 +1,349 @@
+"""
+语义问答缓存
+同一个问题每天会被反复提问，每次都要完整执行 Agent（多次 LLM 调用 + RAG + SQL）。
+这里按 (db_name, 问题向量) 缓存最终的 SQL、回答（含图表配置）和查询结果：
+
+- 问题向量与已缓存问题的余弦相似度达到阈值，且两个问题中的数字、日期和引号内的字面量完全一致才命中
+  （改写、标点差异也能命中；"2023年销售额" 与 "2024年销售额"、"top 10" 与 "top 5" 不会互相命中）
+- 回答在 ttl 内有效；查询结果在 result_ttl 内直接复用，超过后由调用方重新执行缓存的 SQL：
+  结果与缓存时一致（按摘要比较）才继续复用回答，否则回答已过时，条目失效并重新执行 Agent
+- 某个 db_name 的训练数据变化时，该库的缓存全部失效
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+import asyncio
+import hashlib
+import json
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+# 问题中必须完全一致的字面量：引号内的文本、数字、中文数字（带前后缀时）和相对日期
+_QUOTED_RE = re.compile(r"'([^']*)'|\"([^\"]*)\"|“([^”]*)”|‘([^’]*)’|「([^」]*)」|『([^』]*)』|《([^》]*)》")
+_NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
+_CN_NUMBER_RE = re.compile(
+    r"(?:前|后|近|第|top\s*)[零〇一二两三四五六七八九十百千万]+"
+    r"|[零〇一二两三四五六七八九十百千万]+(?=个|名|条|位|项|家|种|次|年|月|日|天|周|季度)",
+    re.IGNORECASE,
+)
+_RELATIVE_DATE_RE = re.compile(
+    r"(?:今|去|前|明)年|(?:本|上|下|这)(?:个)?(?:月|周|季度)|今天|昨天|前天|今日|昨日"
+    r"|\b(?:this|last|next|previous)\s+(?:year|quarter|month|week)\b|\btoday\b|\byesterday\b",
+    re.IGNORECASE,
+)
+
+
+def _normalize_number(text: str) -> str:
+    integer, _, fraction = text.partition(".")
+    integer = integer.lstrip("0") or "0"
+    fraction = fraction.rstrip("0")
+    return f"{integer}.{fraction}" if fraction else integer
+
+
+def question_literals(question: str) -> Tuple[str, ...]:
+    """
+    问题中的字面量（排序后的元组），两个问题的字面量不同时不能共用回答
+
+    Examples:
+        question_literals("2023年1月销售额 top 10") -> ('1', '10', '2023')
+    """
+    literals = []
+    for match in _QUOTED_RE.finditer(question):
+        literals.append("q:" + next(g for g in match.groups() if g is not None).strip())
+    literals.extend(_normalize_number(n) for n in _NUMBER_RE.findall(question))
+    literals.extend("cn:" + re.sub(r"\s+", "", n.lower()) for n in _CN_NUMBER_RE.findall(question))
+    literals.extend("d:" + re.sub(r"\s+", " ", d.lower()) for d in _RELATIVE_DATE_RE.findall(question))
+    return tuple(sorted(literals))
+
+
+@dataclass
+class CachedAnswer:
+    """一次已完成的问答"""
+    question: str
+    db_name: str
+    sql: str
+    answer: str  # 模型最终回答原文（包含 ```chartconfig 代码块）
+    literals: Tuple[str, ...] = ()  # question_literals(question)
+    records: Optional[List[Dict[str, Any]]] = None  # 查询结果（行数超过 max_rows 时不保存）
+    columns: List[str] = field(default_factory=list)
+    result_digest: Optional[str] = None  # 回答所依据的查询结果的摘要（含未保存的大结果）
+    created_at: float = field(default_factory=time.time)
+    verified_at: float = field(default_factory=time.time)  # 最近一次确认查询结果未变化的时间
+    hits: int = 0
+
+    def result_fresh(self, result_ttl: float) -> bool:
+        """缓存的查询结果是否仍可直接返回"""
+        return self.records is not None and time.time() - self.verified_at <= result_ttl
+
+
+def result_digest(records: Optional[List[Dict[str, Any]]]) -> Optional[str]:
+    """查询结果的摘要（用于判断重新执行 SQL 后结果是否变化）"""
+    if records is None:
+        return None
+    payload = json.dumps(records, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SemanticAnswerCache:
+    """
+    按数据库分组的语义问答缓存（线程安全）
+
+    使用示例:
+        cache = SemanticAnswerCache(vn.embedding_function, threshold=0.95)
+        vn.add_training_listener(cache.invalidate)
+
+        hit = await cache.alookup(question, db_name)
+        if hit is None:
+            ...  # 执行 Agent
+            cache.store(question, db_name, sql=sql, answer=answer, records=records, columns=columns)
+    """
+
+    def __init__(
+        self,
+        embedding_function,
+        threshold: float = 0.95,
+        ttl: float = 86400,
+        result_ttl: float = 300,
+        max_entries: int = 500,
+        max_rows: int = 1000,
+    ):
+        """
+        Args:
+            embedding_function: 嵌入客户端（使用 encode_queries / aencode_queries，共用查询向量缓存）
+            threshold: 命中所需的最小余弦相似度
+            ttl: 回答的有效期（秒，<= 0 表示不过期）
+            result_ttl: 查询结果直接复用的时间窗口（秒），超过后需要重新执行 SQL
+            max_entries: 每个数据库最多缓存的问题数（<= 0 表示禁用缓存）
+            max_rows: 保存查询结果的最大行数，超过时只保存 SQL
+        """
+        self.embedding_function = embedding_function
+        self.threshold = threshold
+        self.ttl = ttl
+        self.result_ttl = result_ttl
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        # db_name -> (条目列表, 单位化后的问题向量矩阵)，两者按行对应
+        self._entries: Dict[str, List[CachedAnswer]] = {}
+        self._vectors: Dict[str, np.ndarray] = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._stores = 0
+        self._invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    # ==================== 查找 ====================
+
+    def lookup(self, question: str, db_name: str) -> Optional[Tuple[CachedAnswer, float]]:
+        """
+        查找相似问题的缓存回答
+
+        Returns:
+            (缓存条目, 相似度)；未命中时返回 None
+        """
+        if not self.enabled or not self._has_entries(db_name):
+            return None
+        vec = self.embedding_function.encode_queries([question])[0]
+        return self._match(db_name, question, vec)
+
+    async def alookup(self, question: str, db_name: str) -> Optional[Tuple[CachedAnswer, float]]:
+        """lookup 的异步版本（嵌入客户端支持时使用异步接口）"""
+        if not self.enabled or not self._has_entries(db_name):
+            return None
+        aencode_queries = getattr(self.embedding_function, "aencode_queries", None)
+        if aencode_queries is not None:
+            vec = (await aencode_queries([question]))[0]
+        else:
+            vec = (await asyncio.to_thread(self.embedding_function.encode_queries, [question]))[0]
+        return self._match(db_name, question, vec)
+
+    def _has_entries(self, db_name: str) -> bool:
+        with self._lock:
+            if self._entries.get(db_name):
+                return True
+            self._misses += 1
+            return False
+
+    def _match(self, db_name: str, question: str, vec: np.ndarray) -> Optional[Tuple[CachedAnswer, float]]:
+        vec = self._normalize(vec)
+        literals = question_literals(question)
+        with self._lock:
+            self._evict_expired(db_name)
+            best = self._best_index(db_name, literals, vec)
+            if best is not None:
+                index, similarity = best
+                entry = self._entries[db_name][index]
+                entry.hits += 1
+                self._hits += 1
+                logger.info(
+                    f"[AnswerCache] Hit for db_name={db_name!r} (similarity {similarity:.4f}): {entry.question[:50]}"
+                )
+                return entry, similarity
+            self._misses += 1
+            return None
+
+    # ==================== 写入 / 失效 ====================
+
+    def store(
+        self,
+        question: str,
+        db_name: str,
+        sql: str,
+        answer: str,
+        records: Optional[List[Dict[str, Any]]] = None,
+        columns: Optional[List[str]] = None,
+    ):
+        """
+        缓存一次完成的问答（已缓存问题可以命中本问题时替换该条目）
+
+        Args:
+            question: 用户问题
+            db_name: 数据库名称
+            sql: 产生查询结果的 SQL
+            answer: 模型最终回答原文
+            records: 查询结果（list of dicts，可直接 JSON 序列化；超过 max_rows 时只保存摘要）
+            columns: 查询结果的列名
+        """
+        if not self.enabled or not sql or not answer:
+            return
+        digest = result_digest(records)
+        if records is not None and len(records) > self.max_rows:
+            records = None
+        entry = CachedAnswer(
+            question=question,
+            db_name=db_name,
+            sql=sql,
+            answer=answer,
+            literals=question_literals(question),
+            records=records,
+            columns=list(columns or []),
+            result_digest=digest,
+        )
+        vec = self._normalize(self.embedding_function.encode_queries([question])[0])
+
+        with self._lock:
+            self._evict_expired(db_name)
+            entries = self._entries.setdefault(db_name, [])
+            vectors = self._vectors.get(db_name)
+            best = self._best_index(db_name, entry.literals, vec)
+            if best is not None:
+                del entries[best[0]]
+                vectors = np.delete(vectors, best[0], axis=0)
+            entries.append(entry)
+            if vectors is None or len(vectors) == 0:
+                vectors = vec[None, :]
+            else:
+                vectors = np.vstack([vectors, vec])
+            # 超出容量时淘汰最早写入的条目
+            overflow = len(entries) - self.max_entries
+            if overflow > 0:
+                del entries[:overflow]
+                vectors = vectors[overflow:]
+            self._vectors[db_name] = vectors
+            self._stores += 1
+
+    def refresh(self, entry: CachedAnswer, records: List[Dict[str, Any]]) -> bool:
+        """
+        用重新执行 SQL 得到的结果刷新条目
+
+        结果与缓存回答所依据的结果一致时更新确认时间并返回 True；
+        不一致（或缓存时没有结果摘要）时删除该条目并返回 False，调用方应重新执行 Agent
+
+        Args:
+            entry: lookup 返回的缓存条目
+            records: 重新执行缓存 SQL 的结果
+        """
+        digest = result_digest(records)
+        with self._lock:
+            if entry.result_digest is not None and digest == entry.result_digest:
+                entry.records = records if len(records) <= self.max_rows else None
+                entry.verified_at = time.time()
+                return True
+            entries = self._entries.get(entry.db_name, [])
+            for i, e in enumerate(entries):
+                if e is entry:
+                    del entries[i]
+                    self._vectors[entry.db_name] = np.delete(self._vectors[entry.db_name], i, axis=0)
+                    break
+            logger.info(f"[AnswerCache] Query result changed, dropping cached answer: {entry.question[:50]}")
+            return False
+
+    def invalidate(self, db_name: Optional[str] = None) -> int:
+        """
+        使缓存失效（训练数据变化时调用）
+
+        Args:
+            db_name: 数据库名称（None 表示全部）
+
+        Returns:
+            删除的条目数
+        """
+        with self._lock:
+            names = list(self._entries) if db_name is None else [db_name]
+            removed = 0
+            for name in names:
+                removed += len(self._entries.pop(name, []))
+                self._vectors.pop(name, None)
+            if removed:
+                self._invalidations += 1
+                logger.info(f"[AnswerCache] Invalidated {removed} answers (db_name={db_name!r})")
+            return removed
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存状态"""
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                "entries": sum(len(e) for e in self._entries.values()),
+                "databases": len(self._entries),
+                "threshold": self.threshold,
+                "hits": self._hits,
+                "misses": self._misses,
+                "stores": self._stores,
+                "invalidations": self._invalidations,
+                "hit_rate": round(self._hits / total, 4) if total else 0.0,
+            }
+
+    # ==================== 内部实现 ====================
+
+    def _best_index(self, db_name: str, literals: Tuple[str, ...],
+                    vec: np.ndarray) -> Optional[Tuple[int, float]]:
+        """相似度达到阈值且字面量一致的最相似条目 (下标, 相似度)（调用方需持有锁）"""
+        entries = self._entries.get(db_name)
+        if not entries:
+            return None
+        scores = self._vectors[db_name] @ vec
+        for index in np.argsort(-scores):
+            similarity = float(scores[index])
+            if similarity < self.threshold:
+                break
+            if entries[index].literals == literals:
+                return int(index), similarity
+        return None
+
+    def _evict_expired(self, db_name: str):
+        """删除过期条目（调用方需持有锁）"""
+        entries = self._entries.get(db_name)
+        if not entries or self.ttl <= 0:
+            return
+        now = time.time()
+        keep = [i for i, e in enumerate(entries) if now - e.created_at <= self.ttl]
+        if len(keep) == len(entries):
+            return
+        self._entries[db_name] = [entries[i] for i in keep]
+        self._vectors[db_name] = self._vectors[db_name][keep]
+
+    @staticmethod
+    def _normalize(vec) -> np.ndarray:
+        vec = np.asarray(vec, dtype=np.float32).ravel()
+        norm = float(np.linalg.norm(vec))
+        return vec / norm if norm > 0 else vec
@@ -0,0 +1,271 @@
+"""
+最终回答的流式输出：把模型逐 token 产生的内容整理为 SSE 事件
+
+- 只转发最终回答所在的模型轮次（出现 tool_call 的轮次在开始转发前整体丢弃；
+  已开始转发后才出现 tool_call 时推送 answer_reset 事件，客户端清空已显示的回答）
+- ```chartconfig 代码块不进入回答正文，解析后作为 chart_config 事件推送
+- 按 flush_interval 合并 token，减少 SSE 帧数和 JSON 编码次数
+- 每个轮次输出第一段内容之前先插入 before_answer() 返回的事件（如查询数据）；轮次被撤回后重新插入
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+import json
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+CHART_CONFIG_FENCE = "```chartconfig"
+_FENCE = "```"
+
+
+def _chunk_text(chunk: Any) -> str:
+    """提取消息块中的文本（content 可能是 str 或 content blocks 列表）"""
+    content = getattr(chunk, "content", "")
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        parts = []
+        for block in content:
+            if isinstance(block, str):
+                parts.append(block)
+            elif isinstance(block, dict) and block.get("type") == "text":
+                parts.append(block.get("text", ""))
+        return "".join(parts)
+    return ""
+
+
+class _ChartConfigFilter:
+    """从文本流中剥离 ```chartconfig ... ``` 代码块（可跨 token 边界）"""
+
+    def __init__(self):
+        self._buf = ""
+        self._in_block = False
+
+    def feed(self, text: str) -> Tuple[str, List[Dict[str, Any]]]:
+        """
+        输入一段文本
+
+        Returns:
+            (可以立即输出的正文, 本次解析出的图表配置列表)
+        """
+        self._buf += text
+        visible: List[str] = []
+        configs: List[Dict[str, Any]] = []
+
+        while True:
+            if not self._in_block:
+                idx = self._buf.find(CHART_CONFIG_FENCE)
+                if idx >= 0:
+                    visible.append(self._buf[:idx])
+                    self._buf = self._buf[idx + len(CHART_CONFIG_FENCE):]
+                    self._in_block = True
+                    continue
+                # 保留可能是代码块开头的后缀，等待后续 token
+                keep = self._partial_fence_len(self._buf)
+                visible.append(self._buf[:len(self._buf) - keep])
+                self._buf = self._buf[len(self._buf) - keep:]
+                break
+
+            end = self._buf.find(_FENCE)
+            if end < 0:
+                break
+            raw = self._buf[:end].strip()
+            self._buf = self._buf[end + len(_FENCE):]
+            self._in_block = False
+            try:
+                configs.append(json.loads(raw))
+                logger.info("[Answer Stream] Chart config extracted from answer")
+            except json.JSONDecodeError as e:
+                logger.warning(f"[Answer Stream] Chart config JSON parsing failed: {e}")
+
+        return "".join(visible), configs
+
+    def flush(self) -> str:
+        """输出剩余文本（未闭合的代码块按原文输出）"""
+        rest = self._buf
+        if self._in_block:
+            logger.warning("[Answer Stream] Unclosed chartconfig block, emitting as text")
+            rest = CHART_CONFIG_FENCE + rest
+        self._buf = ""
+        self._in_block = False
+        return rest
+
+    @staticmethod
+    def _partial_fence_len(text: str) -> int:
+        for n in range(min(len(text), len(CHART_CONFIG_FENCE) - 1), 0, -1):
+            if CHART_CONFIG_FENCE.startswith(text[-n:]):
+                return n
+        return 0
+
+
+class AnswerStreamer:
+    """
+    把 agent.stream(stream_mode=["values", "messages"]) 中模型节点的 token 转为 SSE 事件
+
+    使用示例:
+        streamer = AnswerStreamer(flush_interval=0.05)
+        for mode, payload in events:
+            if mode == "messages":
+                sse_events = streamer.feed(payload[0])
+            elif ...:  # 模型轮次结束（values 事件的最后一条是 AI 消息）
+                sse_events = streamer.end_turn(last_msg)
+        sse_events = streamer.finish()
+
+    返回的事件为 dict：{'type': 'answer', ...}、{'type': 'chart_config', ...} 或 {'type': 'answer_reset'}
+    """
+
+    def __init__(
+        self,
+        flush_interval: float = 0.05,
+        hold_chars: int = 64,
+        before_answer: Optional[Callable[[], List[Dict[str, Any]]]] = None,
+    ):
+        """
+        Args:
+            flush_interval: 合并 token 的时间窗口（秒），0 表示每个 token 立即输出
+            hold_chars: 轮次开头先缓冲的字符数；在此之前出现 tool_call 的轮次不会输出
+                        （模型在调用工具前常输出一句"我先查询..."，不属于最终回答）
+            before_answer: 回答内容开始输出前调用，返回的事件插在回答之前（如查询数据）；
+                           已输出的内容被撤回后，下一次输出前会再次调用
+        """
+        self.flush_interval = flush_interval
+        self.hold_chars = hold_chars
+        self.before_answer = before_answer
+        self.streamed = False  # 是否已经输出过回答内容
+        self.prefaced = False  # 是否已经插入 before_answer 的事件（撤回后重置）
+        self._filter = _ChartConfigFilter()
+        self._pending = ""
+        self._last_flush = time.monotonic()
+        self._reset_turn()
+
+    def _reset_turn(self):
+        self._turn_text = ""
+        self._turn_active = False
+        self._tool_turn = False
+        self._committed = False
+
+    # ==================== 输入 ====================
+
+    def feed(self, chunk: Any) -> List[Dict[str, Any]]:
+        """
+        输入模型节点产生的一个消息块（AIMessageChunk）
+
+        Returns:
+            需要推送的 SSE 事件列表
+        """
+        return self._preface(self._feed(chunk))
+
+    def _feed(self, chunk: Any) -> List[Dict[str, Any]]:
+        self._turn_active = True
+        if getattr(chunk, "tool_call_chunks", None):
+            events = self._retract() if self._committed and not self._tool_turn else []
+            self._tool_turn = True
+            self._turn_text = ""
+            return events
+        if self._tool_turn:
+            return []
+
+        text = _chunk_text(chunk)
+        if not text:
+            return []
+
+        if self._committed:
+            return self._push(text)
+
+        self._turn_text += text
+        head = self._turn_text.lstrip()
+        # 以 ```chartconfig 开头的一定是最终报告，立即开始转发
+        if len(head) >= self.hold_chars or head.startswith(CHART_CONFIG_FENCE):
+            return self._commit()
+        return []
+
+    def end_turn(self, message: Any) -> List[Dict[str, Any]]:
+        """
+        模型轮次结束（收到完整的 AIMessage）
+
+        Args:
+            message: 本轮的完整 AI 消息
+
+        Returns:
+            需要推送的 SSE 事件列表
+        """
+        if not self._turn_active:
+            return []
+        has_tool_calls = bool(getattr(message, "tool_calls", None)) or self._tool_turn
+        events: List[Dict[str, Any]] = []
+        if not has_tool_calls:
+            events.extend(self._commit())
+            events.extend(self._drain())
+        elif self._committed and not self._tool_turn:
+            # tool_call 只出现在完整消息中（没有 tool_call_chunks）
+            events.extend(self._retract())
+        self._reset_turn()
+        return self._preface(events)
+
+    def replay(self, answer: str) -> List[Dict[str, Any]]:
+        """模型未产生 token 流时（如不支持流式），按完整回答输出"""
+        events = self._push(answer)
+        events.extend(self._drain())
+        return self._preface(events)
+
+    def finish(self) -> List[Dict[str, Any]]:
+        """输出所有剩余内容"""
+        return self._preface(self._drain())
+
+    # ==================== 输出 ====================
+
+    def _preface(self, events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """在本轮第一段输出（回答或图表配置）之前插入 before_answer 的事件"""
+        if self.prefaced or self.before_answer is None or not events or events[0]["type"] == "answer_reset":
+            return events
+        self.prefaced = True
+        return list(self.before_answer()) + events
+
+    def _commit(self) -> List[Dict[str, Any]]:
+        self._committed = True
+        text, self._turn_text = self._turn_text, ""
+        return self._push(text) if text else []
+
+    def _retract(self) -> List[Dict[str, Any]]:
+        """撤回本轮已转发的文本（调用工具前的长开场白不是最终回答）"""
+        logger.info("[Answer Stream] Tool call after streamed text, retracting answer")
+        self._committed = False
+        self._filter = _ChartConfigFilter()
+        self._pending = ""
+        # 只输出过图表配置或插入的事件时同样需要客户端清空
+        sent = self.streamed or self.prefaced
+        self.prefaced = False
+        self.streamed = False
+        if not sent:
+            return []
+        return [{"type": "answer_reset"}]
+
+    def _push(self, text: str) -> List[Dict[str, Any]]:
+        visible, configs = self._filter.feed(text)
+        events: List[Dict[str, Any]] = []
+        if configs:
+            # 图表配置之前的正文先输出，保持顺序
+            events.extend(self._flush_pending())
+            events.extend({"type": "chart_config", "config": c} for c in configs)
+        self._append(visible)
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            events.extend(self._flush_pending())
+        return events
+
+    def _append(self, text: str):
+        if not self.streamed and not self._pending:
+            text = text.lstrip()  # 去掉图表配置块之后的空行
+        self._pending += text
+
+    def _drain(self) -> List[Dict[str, Any]]:
+        self._append(self._filter.flush())
+        return self._flush_pending()
+
+    def _flush_pending(self) -> List[Dict[str, Any]]:
+        self._last_flush = time.monotonic()
+        if not self._pending:
+            return []
+        content, self._pending = self._pending, ""
+        self.streamed = True
+        return [{"type": "answer", "content": content, "done": False}]
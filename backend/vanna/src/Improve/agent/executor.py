@@ -0,0 +1,221 @@
+"""
+Agent 执行层：在有界工作线程池中运行同步的 agent.stream()，
+并通过 asyncio.Queue 把事件桥接回 FastAPI 的异步处理函数（SSE 生成器）。
+
+避免单个慢请求（LLM / 工具调用）阻塞 uvicorn 事件循环。
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Dict, Optional
+
+from ..shared import set_current_run_id, set_current_db_name
+from ..shared.tracing import get_tracer
+
+
+# 队列中的消息类型
+_EVENT = "event"
+_ERROR = "error"
+_DONE = "done"
+
+
+def _question(inputs: Dict[str, Any]) -> Optional[str]:
+    """输入中最后一条消息的文本（用作 trace 属性）"""
+    try:
+        message = inputs["messages"][-1]
+        content = message["content"] if isinstance(message, dict) else message.content
+        return content[:500] if isinstance(content, str) else None
+    except Exception:
+        return None
+
+
+class AgentRunner:
+    """
+    Agent 运行器（有界并发）
+
+    - 最多同时运行 max_concurrent_runs 个 agent run，超出的请求排队等待
+    - 工作线程中产生的事件通过 loop.call_soon_threadsafe 投递到请求自己的 asyncio.Queue
+    - 客户端断开（生成器被关闭）时通知工作线程在下一个事件边界停止；仍在排队的 run 不再执行
+
+    使用示例:
+        runner = AgentRunner(agent, max_concurrent_runs=4)
+        async for event in runner.stream(inputs, config=cfg):
+            ...
+    """
+
+    def __init__(self, agent, max_concurrent_runs: int = 4):
+        """
+        初始化运行器
+
+        Args:
+            agent: create_nl2sql_agent 返回的 Agent 实例
+            max_concurrent_runs: 最大并发运行数（工作线程数）
+        """
+        if max_concurrent_runs < 1:
+            raise ValueError("max_concurrent_runs must be >= 1")
+
+        self.agent = agent
+        self.max_concurrent_runs = max_concurrent_runs
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrent_runs,
+            thread_name_prefix="agent-run",
+        )
+        self._lock = threading.Lock()
+        self._running = 0   # 正在执行的 run 数
+        self._queued = 0    # 已提交、等待空闲线程的 run 数
+        self._completed = 0
+        self._failed = 0
+        self._cancelled = 0  # 排队期间客户端断开、未执行的 run 数
+
+    # ==================== 公开接口 ====================
+
+    async def stream(
+        self,
+        inputs: Dict[str, Any],
+        config: Optional[Dict[str, Any]] = None,
+        stream_mode: Any = "values",
+        run_id: Optional[str] = None,
+        db_name: Optional[str] = None,
+    ) -> AsyncIterator[Any]:
+        """
+        异步迭代 agent.stream() 产生的事件（在工作线程中执行）
+
+        Args:
+            inputs: Agent 输入（{"messages": [...]}）
+            config: LangGraph 运行配置
+            stream_mode: 透传给 agent.stream 的 stream_mode
+            run_id: run ID（工具据此隔离查询结果等 run 级状态）
+            db_name: 本次 run 的目标数据库（工具中的 run_sql 据此选择连接池，不影响其他请求）
+
+        Yields:
+            与 agent.stream() 相同的事件
+        """
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        cancelled = threading.Event()
+
+        def put(kind: str, payload: Any = None):
+            # 事件循环关闭后（进程退出）丢弃即可
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, (kind, payload))
+            except RuntimeError:
+                pass
+
+        def worker():
+            with self._lock:
+                self._queued -= 1
+                # 排队期间客户端已断开：不再启动 run
+                if cancelled.is_set():
+                    self._cancelled += 1
+                    logger.info("[AgentRunner] Client disconnected while queued, skipping run")
+                    return
+                self._running += 1
+            # 在复制出的上下文中设置 run ID / 目标数据库，工具线程会继承该上下文
+            set_current_run_id(run_id)
+            set_current_db_name(db_name)
+            failed = False
+            try:
+                # 根 span：run 中的 LLM / 工具 / 检索 / SQL span 都挂在它下面（trace ID 即 run ID）
+                with get_tracer().trace(run_id, "agent.run", db_name=db_name, question=_question(inputs)):
+                    events = self.agent.stream(inputs, stream_mode=stream_mode, config=config)
+                    try:
+                        for event in events:
+                            if cancelled.is_set():
+                                logger.info("[AgentRunner] Client disconnected, stopping run")
+                                break
+                            put(_EVENT, event)
+                    finally:
+                        close = getattr(events, "close", None)
+                        if close:
+                            close()
+            except BaseException as e:
+                failed = True
+                put(_ERROR, e)
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    if failed:
+                        self._failed += 1
+                    else:
+                        self._completed += 1
+                put(_DONE)
+
+        def on_done(future):
+            # shutdown() 取消了排队中的 run：worker 不会执行，由这里结束流
+            if not future.cancelled():
+                return
+            with self._lock:
+                self._queued -= 1
+                self._cancelled += 1
+            logger.info("[AgentRunner] Runner shut down while queued, run cancelled")
+            put(_ERROR, RuntimeError("AgentRunner has been shut down"))
+            put(_DONE)
+
+        with self._lock:
+            self._queued += 1
+        # 复制当前上下文，保证 contextvars 在工作线程中可见
+        ctx = contextvars.copy_context()
+        try:
+            future = self._executor.submit(ctx.run, worker)
+        except RuntimeError:
+            # 线程池已关闭
+            with self._lock:
+                self._queued -= 1
+            raise
+        future.add_done_callback(on_done)
+
+        try:
+            while True:
+                kind, payload = await queue.get()
+                if kind == _EVENT:
+                    yield payload
+                elif kind == _ERROR:
+                    raise payload
+                else:
+                    break
+        finally:
+            cancelled.set()
+
+    async def invoke(
+        self,
+        inputs: Dict[str, Any],
+        config: Optional[Dict[str, Any]] = None,
+        stream_mode: Any = "values",
+        run_id: Optional[str] = None,
+        db_name: Optional[str] = None,
+    ) -> Any:
+        """
+        运行 Agent 并返回最后一个事件（非流式接口使用）
+
+        Returns:
+            最后一个事件；Agent 未产生任何事件时返回 None
+        """
+        final_event = None
+        async for event in self.stream(inputs, config=config, stream_mode=stream_mode, run_id=run_id, db_name=db_name):
+            final_event = event
+        return final_event
+
+    def stats(self) -> Dict[str, int]:
+        """
+        运行器指标
+
+        Returns:
+            dict: max_concurrent_runs / running / queue_depth / completed / failed / cancelled
+        """
+        with self._lock:
+            return {
+                "max_concurrent_runs": self.max_concurrent_runs,
+                "running": self._running,
+                "queue_depth": self._queued,
+                "completed": self._completed,
+                "failed": self._failed,
+                "cancelled": self._cancelled,
+            }
+
+    def shutdown(self, wait: bool = False):
+        """关闭工作线程池（排队中的 run 被取消，其 stream() 抛出 RuntimeError）"""
+        self._executor.shutdown(wait=wait, cancel_futures=True)
@@ -26,6 +26,8 @@ from ..middleware import (
     trace_tool_call,
     ui_model_trace,
     ui_tool_trace,
+    mysql_capabilities_prompt,
+    context_prefetch,
 )
 
 # 导入配置（使用相对导入）
@@ -34,13 +36,19 @@ from ..config.prompts import SYSTEM_PROMPT
 
 # ==================== Agent 创建函数 ====================
 
-def create_nl2sql_agent(llm: ChatOpenAI, enable_middleware: bool = True, enable_ui_events: bool = True):
+def create_nl2sql_agent(
+    llm: ChatOpenAI,
+    enable_middleware: bool = True,
+    enable_ui_events: bool = True,
+    enable_prefetch: bool = True,
+):
     """创建 NL2SQL Agent（挂载 TraceMiddleware 和 UI 事件中间件）
     
     Args:
         llm: ChatOpenAI 模型实例
         enable_middleware: 是否启用中间件追踪（LLM/工具调用日志）
         enable_ui_events: 是否启用 UI 事件注入（用于前端展示）
+        enable_prefetch: 是否在第一次 LLM 调用前并发预取版本、表信息和 RAG 上下文
         
     Returns:
         Agent 实例
@@ -55,7 +63,11 @@ def create_nl2sql_agent(llm: ChatOpenAI, enable_middleware: bool = True, enable_
     ]
     
     # 中间件列表（按顺序执行）
-    middleware = []
+    # 数据库环境（版本 / 语法支持）直接写入系统提示词，省去 check_mysql_version 调用
+    middleware = [mysql_capabilities_prompt]
+    if enable_prefetch:
+        # 版本 / 表信息 / RAG 上下文作为已完成的工具调用写入消息，省去三次串行的 LLM 往返
+        middleware.append(context_prefetch)
     if enable_middleware:
         middleware.extend([trace_model_call, trace_tool_call])
     if enable_ui_events:
@@ -148,90 +148,108 @@ class PostTrainingProcessor:
         try:
             # 步骤1: 提取对话摘要
             summary = extract_conversation_summary(conversation_history)
-            
-            logger.info("📋 对话摘要：")
-            logger.info(f"  问题: {summary['question'][:100]}...")
-            logger.info(f"  SQL 数量: {len(summary['sql_list'])}")
-            logger.info(f"  工具调用: {len(summary['tool_calls'])} 次")
-            logger.info(f"  最终答案: {summary['final_answer'][:100]}...")
-            logger.info("")
-            
-            # 步骤2: 检索相似问题
-            similar_sqls = vanna_client.get_similar_question_sql(question, n_results=5)
-            
-            logger.info("🔍 相似度检查：")
-            if similar_sqls:
-                logger.info(f"  找到 {len(similar_sqls)} 个相似问题")
-                for i, pair in enumerate(similar_sqls[:3], 1):
-                    logger.info(f"  [{i}] {pair.get('question', 'N/A')[:60]}...")
-            else:
-                logger.info("  未找到相似问题")
-            logger.info("")
-            
-            # 步骤3: 评估相似度（使用结构化输出）
-            logger.info("🤖 第一步：评估相似度...")
-            
-            # ✅ 使用结构化输出，不需要正则解析！
-            similarity_result = self._evaluate_similarity_structured(
-                summary['question'], 
-                similar_sqls
-            )
-            
-            most_similar = similarity_result.most_similar_question
-            similarity_score = similarity_result.similarity_score
-            similarity_analysis = similarity_result.similarity_analysis
-            
-            logger.info(f"  最相似问题: {most_similar[:50]}{'...' if len(most_similar) > 50 else ''}")
-            logger.info(f"  相似度评分: {similarity_score:.2f}")
-            logger.info(f"  分析: {similarity_analysis[:80]}...")
-            logger.info("")
-            
-            # 步骤4: 基于相似度直接决策
-            if similarity_score >= 0.85:
-                return f"⏭️  未添加到训练集（相似度过高: {similarity_score:.2f}）"
-            
-            # 检查基本条件
-            if '查询成功' not in summary['execution_result']:
-                return f"⏭️  未添加到训练集（SQL执行失败）"
-            
-            if not summary['sql_list']:
-                return f"⏭️  未添加到训练集（未找到SQL）"
-            
-            # 步骤5: 选择最优SQL（使用结构化输出）
-            logger.info("🤖 第二步：从对话中选择最优 SQL...")
-            
-            # ✅ 使用结构化输出，不需要正则解析！
-            sql_result = self._select_best_sql_structured(
-                summary['question'],
-                summary['sql_list'],
-                summary['execution_result'],
-                summary['final_answer']
-            )
-            
-            selected_sql = sql_result.selected_sql
-            selection_reason = sql_result.reason
-            
-            logger.info(f"  选择的SQL: {selected_sql[:80]}{'...' if len(selected_sql) > 80 else ''}")
-            logger.info(f"  选择理由: {selection_reason[:80]}...")
-            logger.info("")
-            
-            # 步骤6: 执行添加
-            if selected_sql:
-                try:
-                    logger.info("💾 添加到训练集...")
-                    sql_id = vanna_client.train(question=question, sql=selected_sql)
-                    
-                    if "已存在" in str(sql_id):
-                        return f"⏭️  训练集决策结果: 未添加（数据已存在）\nSQL ID: {sql_id}"
-                    else:
-                        return f"✅ 已成功添加到训练集！\n训练数据ID: {sql_id[:50]}..."
-                except Exception as e:
-                    return f"❌ 添加到训练集失败\n错误信息: {str(e)}"
-            else:
-                return f"⏭️  未添加到训练集（SQL选择失败）"
-                
+            return self.decide_from_summary(question, summary, vanna_client)
         except Exception as e:
             return f"❌ 训练决策失败\n错误信息: {str(e)}"
+
+    def decide_from_summary(
+        self,
+        question: str,
+        summary: ConversationSummary,
+        vanna_client
+    ) -> str:
+        """基于已提取的对话摘要决策是否加入训练集（供后台训练队列调用）
+        
+        与 decide_and_add_to_training 不同，检索 / LLM / 写入失败时直接抛出异常，
+        由调用方决定是否重试
+        
+        Args:
+            question: 用户原始问题
+            summary: extract_conversation_summary 的结果
+            vanna_client: Vanna 客户端实例
+            
+        Returns:
+            训练决策结果
+        """
+        logger.info("📋 对话摘要：")
+        logger.info(f"  问题: {summary['question'][:100]}...")
+        logger.info(f"  SQL 数量: {len(summary['sql_list'])}")
+        logger.info(f"  工具调用: {len(summary['tool_calls'])} 次")
+        logger.info(f"  最终答案: {summary['final_answer'][:100]}...")
+        logger.info("")
+        
+        # 步骤2: 检索相似问题
+        similar_sqls = vanna_client.get_similar_question_sql(question, n_results=5)
+        
+        logger.info("🔍 相似度检查：")
+        if similar_sqls:
+            logger.info(f"  找到 {len(similar_sqls)} 个相似问题")
+            for i, pair in enumerate(similar_sqls[:3], 1):
+                logger.info(f"  [{i}] {pair.get('question', 'N/A')[:60]}...")
+        else:
+            logger.info("  未找到相似问题")
+        logger.info("")
+        
+        # 步骤3: 评估相似度（使用结构化输出）
+        logger.info("🤖 第一步：评估相似度...")
+        
+        # ✅ 使用结构化输出，不需要正则解析！
+        similarity_result = self._evaluate_similarity_structured(
+            summary['question'], 
+            similar_sqls
+        )
+        
+        most_similar = similarity_result.most_similar_question
+        similarity_score = similarity_result.similarity_score
+        similarity_analysis = similarity_result.similarity_analysis
+        
+        logger.info(f"  最相似问题: {most_similar[:50]}{'...' if len(most_similar) > 50 else ''}")
+        logger.info(f"  相似度评分: {similarity_score:.2f}")
+        logger.info(f"  分析: {similarity_analysis[:80]}...")
+        logger.info("")
+        
+        # 步骤4: 基于相似度直接决策
+        if similarity_score >= 0.85:
+            return f"⏭️  未添加到训练集（相似度过高: {similarity_score:.2f}）"
+        
+        # 检查基本条件
+        if '查询成功' not in summary['execution_result']:
+            return f"⏭️  未添加到训练集（SQL执行失败）"
+        
+        if not summary['sql_list']:
+            return f"⏭️  未添加到训练集（未找到SQL）"
+        
+        # 步骤5: 选择最优SQL（使用结构化输出）
+        logger.info("🤖 第二步：从对话中选择最优 SQL...")
+        
+        # ✅ 使用结构化输出，不需要正则解析！
+        sql_result = self._select_best_sql_structured(
+            summary['question'],
+            summary['sql_list'],
+            summary['execution_result'],
+            summary['final_answer']
+        )
+        
+        selected_sql = sql_result.selected_sql
+        selection_reason = sql_result.reason
+        
+        logger.info(f"  选择的SQL: {selected_sql[:80]}{'...' if len(selected_sql) > 80 else ''}")
+        logger.info(f"  选择理由: {selection_reason[:80]}...")
+        logger.info("")
+        
+        # 步骤6: 执行添加
+        if not selected_sql:
+            return f"⏭️  未添加到训练集（SQL选择失败）"
+        
+        logger.info("💾 添加到训练集...")
+        try:
+            sql_id = vanna_client.train(question=question, sql=selected_sql)
+        except Exception as e:
+            raise RuntimeError(f"添加到训练集失败: {e}") from e
+        
+        if "已存在" in str(sql_id):
+            return f"⏭️  训练集决策结果: 未添加（数据已存在）\nSQL ID: {sql_id}"
+        return f"✅ 已成功添加到训练集！\n训练数据ID: {sql_id[:50]}..."
     
     def _build_similarity_prompt(self, question: str, similar_sqls: list) -> str:
         """构建相似度评估提示"""
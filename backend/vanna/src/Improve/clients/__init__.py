@@ -5,6 +5,10 @@
 import logging
 logger = logging.getLogger(__name__)
 from .vanna_client import create_vanna_client, MyVanna
+from .mysql_pool import MySQLConnectionPool, MySQLPoolRegistry, PoolTimeoutError
+from .sql_result_cache import SQLResultCache, normalize_sql, referenced_tables
+from .embedding_cache import EmbeddingCache
+from .embedding_store import EmbeddingStore
 from .embedding_providers import (
     EmbeddingBase,
     JinaEmbedding,
@@ -16,6 +20,14 @@ from .embedding_providers import (
 __all__ = [
     'create_vanna_client', 
     'MyVanna',
+    'MySQLConnectionPool',
+    'MySQLPoolRegistry',
+    'PoolTimeoutError',
+    'SQLResultCache',
+    'normalize_sql',
+    'referenced_tables',
+    'EmbeddingCache',
+    'EmbeddingStore',
     'EmbeddingBase',
     'JinaEmbedding',
     'QwenEmbedding',
@@ -0,0 +1,104 @@
+"""
+查询向量缓存
+同一个问题在一次对话中会被多个检索（DDL / 文档 / 问答对 / 业务计划）重复向量化，
+按 provider + model + 文本哈希缓存 encode_queries 的结果，避免重复请求向量服务
+
+- LRU 淘汰（最大条目数）
+- TTL 过期
+- 命中 / 未命中计数
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """
+    线程安全的 LRU + TTL 向量缓存
+
+    使用示例:
+        cache = EmbeddingCache(max_size=1024, ttl=3600)
+        key = cache.make_key("JinaEmbedding", "jina-v2", "女性客户的平均消费金额")
+        vec = cache.get(key)
+        if vec is None:
+            cache.put(key, embed(...))
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 3600):
+        """
+        Args:
+            max_size: 最大缓存条目数（<= 0 表示禁用缓存）
+            ttl: 条目存活时间（秒，<= 0 表示不过期）
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: "OrderedDict[str, Tuple[np.ndarray, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    @staticmethod
+    def make_key(provider: str, model: Optional[str], text: str) -> str:
+        """生成缓存键：provider:model:sha256(text)"""
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"{provider}:{model or ''}:{digest}"
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """
+        读取缓存向量（命中时刷新 LRU 位置）
+
+        Returns:
+            只读向量；未命中或已过期时返回 None
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                vec, ts = entry
+                if self.ttl <= 0 or time.time() - ts <= self.ttl:
+                    self._data.move_to_end(key)
+                    self._hits += 1
+                    return vec
+                del self._data[key]
+            self._misses += 1
+            return None
+
+    def put(self, key: str, vec: np.ndarray):
+        """写入缓存向量（超出容量时淘汰最久未使用的条目）"""
+        if not self.enabled:
+            return
+        vec = np.array(vec, dtype=np.float32)
+        vec.setflags(write=False)  # 缓存的向量被多个调用方共享，禁止原地修改
+        with self._lock:
+            self._data[key] = (vec, time.time())
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        """清空缓存（计数保留）"""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存状态"""
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / total, 4) if total else 0.0,
+            }
@@ -1,16 +1,30 @@
 """
 嵌入向量提供者（多模型支持）
 统一接口设计，支持 Jina、Qwen、BGE 等向量模型
+
+- 所有请求复用同一个 requests.Session（连接池，避免每次请求重新建立 TCP/TLS 连接）
+- 大批量文本按提供商的单次请求上限拆分为小批次，在有界线程池中并发请求，按原顺序拼接
+- aencode_queries / aencode_documents 使用 httpx.AsyncClient（连接池 + 超时），供 FastAPI 请求路径直接 await
+- 配置文档向量存储（EmbeddingStore）后，encode_documents 先按内容哈希复用已存储的向量，只对新文本发起请求
 """
 
 import logging
 logger = logging.getLogger(__name__)
 import os
-import json
+import asyncio
+import threading
+import httpx
 import requests
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from typing import List, Optional, Dict, Any
 
+from .embedding_cache import EmbeddingCache
+from .embedding_store import EmbeddingStore
+from ..shared.tracing import get_tracer
+from ..shared.metrics import EMBEDDING_DURATION
+
 
 # ==================== 嵌入向量基类 ====================
 
@@ -23,10 +37,16 @@ class EmbeddingBase:
     
     使用示例:
         class CustomEmbedding(EmbeddingBase):
+            default_max_batch_size = 32  # 服务单次请求的最大文本数
+
             def _embed(self, texts: List[str]) -> np.ndarray:
-                # 调用自定义服务
+                # 调用自定义服务（texts 不会超过 max_batch_size 条）
                 return np.array(...)
+
+    子类可以再实现 _aembed(texts) 提供原生异步请求，否则异步接口在线程中调用 _embed
     """
+    default_max_batch_size = 64
+
     def __init__(
         self,
         api_url: str,
@@ -51,6 +71,73 @@ class EmbeddingBase:
         self.timeout = timeout
         self.extra_headers = extra_headers or {}
         self.embedding_dim = None  # 子类可在首次调用后更新
+        self.query_cache = EmbeddingCache()  # 查询向量缓存（可通过 configure_query_cache 调整）
+        self.document_store: Optional[EmbeddingStore] = None  # 文档向量存储（可通过 configure_document_store 设置）
+        self.session = requests.Session()  # 共享连接池
+        self._async_client: Optional[httpx.AsyncClient] = None
+        self._async_loop = None  # _async_client 所属的事件循环
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        self.configure_batching()
+
+    def configure_query_cache(self, max_size: int = 1024, ttl: float = 3600):
+        """
+        配置查询向量缓存
+
+        Args:
+            max_size: 最大缓存条目数（<= 0 表示禁用）
+            ttl: 条目存活时间（秒，<= 0 表示不过期）
+        """
+        self.query_cache = EmbeddingCache(max_size=max_size, ttl=ttl)
+
+    def configure_document_store(self, store: Optional[EmbeddingStore]):
+        """
+        配置文档向量持久化存储
+
+        Args:
+            store: EmbeddingStore 实例（None 表示禁用）
+        """
+        self.document_store = store
+
+    def configure_batching(self, max_batch_size: Optional[int] = None, max_concurrency: int = 4):
+        """
+        配置批量请求
+
+        Args:
+            max_batch_size: 单次请求的最大文本数（默认使用提供商的 default_max_batch_size）
+            max_concurrency: 同时进行的最大请求数（同时也是连接池大小）
+        """
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be >= 1")
+        self.max_batch_size = max(1, max_batch_size or self.default_max_batch_size)
+        self.max_concurrency = max_concurrency
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(max_concurrency, 10))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        with self._executor_lock:
+            old, self._executor = self._executor, None
+        if old is not None:
+            old.shutdown(wait=False)
+
+    def close(self):
+        """关闭连接池、请求线程池和文档向量存储"""
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+        self.session.close()
+        if self.document_store is not None:
+            self.document_store.close()
+
+    async def aclose(self):
+        """关闭异步 HTTP 客户端"""
+        if self._async_loop is not asyncio.get_running_loop():
+            self._discard_async_client()
+            return
+        client, self._async_client = self._async_client, None
+        self._async_loop = None
+        if client is not None:
+            await client.aclose()
 
     # ==================== 统一的公开接口 ====================
     
@@ -66,7 +153,16 @@ class EmbeddingBase:
         """
         if not documents:
             return np.zeros((0, self.embedding_dim or 768), dtype=np.float32)
-        return self._embed(documents)
+
+        store = self.document_store
+        if store is None:
+            return self._embed_batched(documents)
+
+        # 先查文档向量存储，未存储的文本（去重后）才请求向量服务
+        keys, found, missing = self._lookup_documents(store, documents)
+        if missing:
+            found.update(self._save_documents(store, missing, self._embed_batched(list(missing.values()))))
+        return np.stack([found[k] for k in keys]).astype(np.float32, copy=False)
 
     def encode_queries(self, queries: List[str]) -> np.ndarray:
         """
@@ -80,7 +176,149 @@ class EmbeddingBase:
         """
         if not queries:
             return np.zeros((0, self.embedding_dim or 768), dtype=np.float32)
-        return self._embed(queries)
+
+        cache = self.query_cache
+        if cache is None or not cache.enabled:
+            return self._embed_batched(queries)
+
+        # 先查缓存，未命中的文本（去重后）合并为一次请求
+        provider = type(self).__name__
+        keys = [cache.make_key(provider, self._model_key(), q) for q in queries]
+        vectors = [cache.get(k) for k in keys]
+        missing: Dict[str, str] = {}
+        for q, k, v in zip(queries, keys, vectors):
+            if v is None:
+                missing.setdefault(k, q)
+
+        if missing:
+            embs = self._embed_batched(list(missing.values()))
+            fresh = dict(zip(missing.keys(), embs))
+            for k, v in fresh.items():
+                cache.put(k, v)
+            vectors = [v if v is not None else fresh[k] for k, v in zip(keys, vectors)]
+
+        return np.stack(vectors).astype(np.float32, copy=False)
+
+    async def aencode_documents(self, documents: List[str]) -> np.ndarray:
+        """encode_documents 的异步版本（共用文档向量存储）"""
+        if not documents:
+            return np.zeros((0, self.embedding_dim or 768), dtype=np.float32)
+
+        store = self.document_store
+        if store is None:
+            return await self._aembed_batched(documents)
+
+        keys, found, missing = await asyncio.to_thread(self._lookup_documents, store, documents)
+        if missing:
+            embs = await self._aembed_batched(list(missing.values()))
+            found.update(await asyncio.to_thread(self._save_documents, store, missing, embs))
+        return np.stack([found[k] for k in keys]).astype(np.float32, copy=False)
+
+    async def aencode_queries(self, queries: List[str]) -> np.ndarray:
+        """encode_queries 的异步版本（共用查询向量缓存）"""
+        if not queries:
+            return np.zeros((0, self.embedding_dim or 768), dtype=np.float32)
+
+        cache = self.query_cache
+        if cache is None or not cache.enabled:
+            return await self._aembed_batched(queries)
+
+        provider = type(self).__name__
+        keys = [cache.make_key(provider, self._model_key(), q) for q in queries]
+        vectors = [cache.get(k) for k in keys]
+        missing: Dict[str, str] = {}
+        for q, k, v in zip(queries, keys, vectors):
+            if v is None:
+                missing.setdefault(k, q)
+
+        if missing:
+            embs = await self._aembed_batched(list(missing.values()))
+            fresh = dict(zip(missing.keys(), embs))
+            for k, v in fresh.items():
+                cache.put(k, v)
+            vectors = [v if v is not None else fresh[k] for k, v in zip(keys, vectors)]
+
+        return np.stack(vectors).astype(np.float32, copy=False)
+
+    def _model_key(self) -> str:
+        """缓存 / 存储键中的模型标识：模型名 + 影响向量结果的请求参数"""
+        # 未指定模型名时用服务地址区分，避免不同服务的默认模型共用向量
+        model = self.model_name or self.api_url
+        params = self._vector_params()
+        return f"{model}|{params}" if params else model
+
+    def _vector_params(self) -> str:
+        """影响向量结果的请求参数（子类覆盖，如 Jina 的 normalize / pooling）"""
+        return ""
+
+    def _lookup_documents(self, store: EmbeddingStore, documents: List[str]):
+        """返回 (每个文档的键, 已存储的向量, 未存储的键 -> 文本)"""
+        provider = type(self).__name__
+        keys = [EmbeddingCache.make_key(provider, self._model_key(), d) for d in documents]
+        found = store.get_many(keys)
+        missing: Dict[str, str] = {}
+        for d, k in zip(documents, keys):
+            if k not in found:
+                missing.setdefault(k, d)
+        return keys, found, missing
+
+    @staticmethod
+    def _save_documents(store: EmbeddingStore, missing: Dict[str, str], embs: np.ndarray) -> Dict[str, np.ndarray]:
+        fresh = dict(zip(missing.keys(), embs))
+        store.put_many(fresh)
+        return fresh
+
+    # ==================== 批量调度 ====================
+
+    def _embed_batched(self, texts: List[str]) -> np.ndarray:
+        """按 max_batch_size 拆分请求，多个批次并发执行，结果按输入顺序拼接"""
+        size = self.max_batch_size
+        with get_tracer().span("embedding", kind="embedding", **self._span_attributes(texts)), \
+                EMBEDDING_DURATION.time(provider=type(self).__name__):
+            if len(texts) <= size:
+                return self._embed(texts)
+
+            batches = [texts[i:i + size] for i in range(0, len(texts), size)]
+            # executor.map 按提交顺序返回结果
+            results = list(self._get_executor().map(self._embed, batches))
+            return np.concatenate(results, axis=0).astype(np.float32, copy=False)
+
+    async def _aembed_batched(self, texts: List[str]) -> np.ndarray:
+        """_embed_batched 的异步版本：最多 max_concurrency 个批次同时请求"""
+        size = self.max_batch_size
+        with get_tracer().span("embedding", kind="embedding", **self._span_attributes(texts)), \
+                EMBEDDING_DURATION.time(provider=type(self).__name__):
+            if len(texts) <= size:
+                return await self._aembed(texts)
+
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+
+            async def run(batch: List[str]) -> np.ndarray:
+                async with semaphore:
+                    return await self._aembed(batch)
+
+            batches = [texts[i:i + size] for i in range(0, len(texts), size)]
+            results = await asyncio.gather(*(run(b) for b in batches))
+            return np.concatenate(results, axis=0).astype(np.float32, copy=False)
+
+    def _span_attributes(self, texts: List[str]) -> Dict[str, Any]:
+        """嵌入请求 span 的属性"""
+        return {
+            "provider": type(self).__name__,
+            "model": self.model_name,
+            "texts": len(texts),
+            "batches": -(-len(texts) // self.max_batch_size),
+            "chars": sum(len(t) for t in texts),
+        }
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_concurrency,
+                    thread_name_prefix=f"embed-{type(self).__name__}",
+                )
+            return self._executor
 
     # ==================== 子类必须实现 ====================
     
@@ -96,6 +334,10 @@ class EmbeddingBase:
         """
         raise NotImplementedError("子类必须实现 _embed() 方法")
 
+    async def _aembed(self, texts: List[str]) -> np.ndarray:
+        """异步嵌入方法（默认在线程中调用 _embed，子类可覆盖为原生异步请求）"""
+        return await asyncio.to_thread(self._embed, texts)
+
     # ==================== 工具方法：安全请求 ====================
     
     def _request_json(self, method: str, url: str, **kwargs) -> Any:
@@ -113,16 +355,10 @@ class EmbeddingBase:
         Raises:
             RuntimeError: 请求失败或响应格式错误
         """
-        headers = dict(self.extra_headers)
-        if self.api_key:
-            # 通用 Bearer Token 授权（子类可覆盖）
-            headers.setdefault("Authorization", f"Bearer {self.api_key}")
-        headers.setdefault("Content-Type", "application/json")
-
-        resp = requests.request(
+        resp = self.session.request(
             method, 
             url, 
-            headers=headers, 
+            headers=self._headers(), 
             timeout=self.timeout, 
             **kwargs
         )
@@ -137,6 +373,57 @@ class EmbeddingBase:
         except Exception as e:
             raise RuntimeError(f"Invalid JSON response: {resp.text[:400]}") from e
 
+    async def _arequest_json(self, method: str, url: str, **kwargs) -> Any:
+        """
+        _request_json 的异步版本（httpx.AsyncClient，连接在同一事件循环内复用）
+
+        Raises:
+            RuntimeError: 请求失败或响应格式错误
+        """
+        resp = await self._get_async_client().request(method, url, headers=self._headers(), **kwargs)
+
+        if resp.is_error:
+            raise RuntimeError(f"HTTP {resp.status_code}: {resp.text[:400]}")
+
+        try:
+            return resp.json()
+        except Exception as e:
+            raise RuntimeError(f"Invalid JSON response: {resp.text[:400]}") from e
+
+    def _headers(self) -> Dict[str, str]:
+        headers = dict(self.extra_headers)
+        if self.api_key:
+            # 通用 Bearer Token 授权（子类可覆盖）
+            headers.setdefault("Authorization", f"Bearer {self.api_key}")
+        headers.setdefault("Content-Type", "application/json")
+        return headers
+
+    def _get_async_client(self) -> httpx.AsyncClient:
+        # httpx 的连接池绑定创建时的事件循环，循环变化时（如测试中多次 asyncio.run）重新创建
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_loop is not loop:
+            self._discard_async_client()
+            self._async_client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(
+                    max_connections=max(self.max_concurrency, 10),
+                    max_keepalive_connections=max(self.max_concurrency, 10),
+                ),
+            )
+            self._async_loop = loop
+        return self._async_client
+
+    def _discard_async_client(self):
+        """丢弃属于其他事件循环的异步客户端：该循环仍在运行时在其中关闭，已关闭时连接已随循环释放"""
+        client, loop = self._async_client, self._async_loop
+        self._async_client, self._async_loop = None, None
+        if client is None or loop is None or loop.is_closed():
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+        except RuntimeError:
+            pass
+
 
 # ==================== Jina 向量模型 ====================
 
@@ -151,6 +438,8 @@ class JinaEmbedding(EmbeddingBase):
     
     说明：Jina 服务通常是单模型端点，无需 model_name
     """
+    default_max_batch_size = 64
+
     def __init__(
         self,
         api_url: str = "http://127.0.0.1:8603/v1/embeddings",
@@ -190,6 +479,15 @@ class JinaEmbedding(EmbeddingBase):
 
     def _embed(self, texts: List[str]) -> np.ndarray:
         """调用 Jina API 获取嵌入向量"""
+        return self._parse(self._request_json("POST", self.api_url, json=self._payload(texts)))
+
+    async def _aembed(self, texts: List[str]) -> np.ndarray:
+        return self._parse(await self._arequest_json("POST", self.api_url, json=self._payload(texts)))
+
+    def _vector_params(self) -> str:
+        return f"normalize={self.normalize},pooling={self.pooling}"
+
+    def _payload(self, texts: List[str]) -> Dict[str, Any]:
         payload = {
             "inputs": [{"text": t} for t in texts],
             "normalize": self.normalize,
@@ -199,8 +497,9 @@ class JinaEmbedding(EmbeddingBase):
         # 如果提供了 model_name，则在请求中携带
         if self.model_name:
             payload["model"] = self.model_name
+        return payload
 
-        data = self._request_json("POST", self.api_url, json=payload)
+    def _parse(self, data: Any) -> np.ndarray:
         embs = data.get("embeddings")
         if not embs:
             raise RuntimeError(f"Empty embeddings from Jina: {data}")
@@ -227,6 +526,8 @@ class QwenEmbedding(EmbeddingBase):
     
     注意：官方通常需要 model，但若未传 model_name，就不带此字段
     """
+    default_max_batch_size = 10  # DashScope text-embedding-v3/v4 单次最多 10 条
+
     def __init__(
         self,
         api_url: str = "https://dashscope.aliyuncs.com/compatible-mode/v1",
@@ -249,14 +550,20 @@ class QwenEmbedding(EmbeddingBase):
 
     def _embed(self, texts: List[str]) -> np.ndarray:
         """调用 Qwen API 获取嵌入向量"""
-        url = f"{self.api_url}/embeddings"
+        return self._parse(self._request_json("POST", f"{self.api_url}/embeddings", json=self._payload(texts)))
+
+    async def _aembed(self, texts: List[str]) -> np.ndarray:
+        return self._parse(await self._arequest_json("POST", f"{self.api_url}/embeddings", json=self._payload(texts)))
+
+    def _payload(self, texts: List[str]) -> Dict[str, Any]:
         payload = {"input": texts}
         
         # 如果提供了 model_name，则在请求中携带
         if self.model_name:
             payload["model"] = self.model_name
+        return payload
 
-        data = self._request_json("POST", url, json=payload)
+    def _parse(self, data: Any) -> np.ndarray:
         items = data.get("data")
         if not items:
             raise RuntimeError(f"Empty embeddings from Qwen: {data}")
@@ -286,6 +593,8 @@ class BGEEmbedding(EmbeddingBase):
     2) 自建/单模型服务：直接 POST {api_url}，不需要 model_name（与 Jina 类似）
        body: {"inputs": ["...","..."]}
     """
+    default_max_batch_size = 32
+
     def __init__(
         self,
         api_url: str = "https://api-inference.huggingface.co/pipeline/feature-extraction",
@@ -311,7 +620,12 @@ class BGEEmbedding(EmbeddingBase):
 
     def _embed(self, texts: List[str]) -> np.ndarray:
         """调用 BGE API 获取嵌入向量"""
-        # 构造 URL
+        return self._parse(self._request_json("POST", self._url(), json={"inputs": texts}))
+
+    async def _aembed(self, texts: List[str]) -> np.ndarray:
+        return self._parse(await self._arequest_json("POST", self._url(), json={"inputs": texts}))
+
+    def _url(self) -> str:
         if self.hf_task_style:
             # HF 风格：必须在路径中拼上模型
             if not self.model_name:
@@ -322,34 +636,9 @@ class BGEEmbedding(EmbeddingBase):
         else:
             # 自建服务风格：api_url 就是单模型端点
             url = self.api_url
+        return url
 
-        # HF Inference API 的授权头
-        headers = dict(self.extra_headers)
-        if self.api_key:
-            headers.setdefault("Authorization", f"Bearer {self.api_key}")
-        headers.setdefault("Content-Type", "application/json")
-
-        resp = requests.post(
-            url,
-            headers=headers,
-            json={"inputs": texts},
-            timeout=self.timeout
-        )
-        
-        try:
-            resp.raise_for_status()
-        except requests.HTTPError as e:
-            raise RuntimeError(f"HTTP {resp.status_code}: {resp.text[:400]}") from e
-
-        try:
-            data = resp.json()
-        except Exception:
-            # HF 可能直接返回矩阵，不是标准 JSON 对象
-            try:
-                data = json.loads(resp.text)
-            except Exception as e:
-                raise RuntimeError(f"Invalid response: {resp.text[:400]}") from e
-
+    def _parse(self, data: Any) -> np.ndarray:
         # HF 可能返回单条向量或多条矩阵
         if isinstance(data, list) and data and isinstance(data[0], list) and isinstance(data[0][0], (int, float)):
             embs = data  # 多条
@@ -375,6 +664,11 @@ def create_embedding_client(
     api_url: Optional[str] = None,
     api_key: Optional[str] = None,
     model_name: Optional[str] = None,
+    query_cache_size: int = 1024,
+    query_cache_ttl: float = 3600,
+    max_batch_size: Optional[int] = None,
+    max_concurrency: int = 4,
+    document_store_path: Optional[str] = None,
     **kwargs
 ) -> EmbeddingBase:
     """
@@ -385,6 +679,11 @@ def create_embedding_client(
         api_url: API 服务地址（可选，使用默认值）
         api_key: API 密钥（可选）
         model_name: 模型名称（可选，不传则不在请求中携带）
+        query_cache_size: 查询向量缓存的最大条目数（<= 0 表示禁用）
+        query_cache_ttl: 查询向量缓存的存活时间（秒）
+        max_batch_size: 单次请求的最大文本数（默认使用提供商的上限）
+        max_concurrency: 批量向量化时同时进行的最大请求数
+        document_store_path: 文档向量存储的 SQLite 文件路径（不传则不持久化文档向量）
         **kwargs: 其他参数传递给具体客户端
     
     Returns:
@@ -411,21 +710,21 @@ def create_embedding_client(
     provider = provider.lower()
     
     if provider == "jina":
-        return JinaEmbedding(
+        client = JinaEmbedding(
             api_url=api_url or "http://127.0.0.1:8603/v1/embeddings",
             api_key=api_key,
             model_name=model_name,
             **kwargs
         )
     elif provider == "qwen":
-        return QwenEmbedding(
+        client = QwenEmbedding(
             api_url=api_url or "https://dashscope.aliyuncs.com/compatible-mode/v1",
             api_key=api_key or os.getenv("DASHSCOPE_API_KEY"),
             model_name=model_name,
             **kwargs
         )
     elif provider == "bge":
-        return BGEEmbedding(
+        client = BGEEmbedding(
             api_url=api_url or "https://api-inference.huggingface.co/pipeline/feature-extraction",
             api_key=api_key or os.getenv("HUGGINGFACE_API_KEY"),
             model_name=model_name,
@@ -436,3 +735,9 @@ def create_embedding_client(
             f"Unsupported provider: {provider}. "
             f"Supported: jina, qwen, bge"
         )
+
+    client.configure_query_cache(max_size=query_cache_size, ttl=query_cache_ttl)
+    client.configure_batching(max_batch_size=max_batch_size, max_concurrency=max_concurrency)
+    if document_store_path:
+        client.configure_document_store(EmbeddingStore(document_store_path))
+    return client
@@ -0,0 +1,133 @@
+"""
+文档向量持久化存储
+训练数据清空后重新导入、重建集合时，同样的文本会再次请求向量服务。
+按 provider + model + 文本哈希把 encode_documents 的结果写入本地 SQLite，
+向量化前先查这里，只有新文本才会请求向量服务
+
+- 内容寻址：键与 EmbeddingCache 相同（provider:model:sha256(text)），文本不变即可复用
+- 进程重启后仍然有效
+- 读写失败只记录警告，不影响向量化本身
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable
+
+import numpy as np
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    key TEXT PRIMARY KEY,
+    dim INTEGER NOT NULL,
+    vector BLOB NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+# SQLite 单条语句的参数个数上限较低，批量读取时按块查询
+_LOOKUP_CHUNK = 500
+
+
+class EmbeddingStore:
+    """
+    基于 SQLite 的文档向量存储（线程安全）
+
+    使用示例:
+        store = EmbeddingStore("embedding_store.db")
+        key = EmbeddingCache.make_key("JinaEmbedding", "jina-v2", "CREATE TABLE ...")
+        found = store.get_many([key])
+        if key not in found:
+            store.put_many({key: embed(...)})
+    """
+
+    def __init__(self, db_path: str):
+        """
+        Args:
+            db_path: SQLite 文件路径
+        """
+        self.db_path = db_path
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._writes = 0
+
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, np.ndarray]:
+        """
+        批量读取向量
+
+        Returns:
+            键 -> 向量（只包含已存储的键）；读取失败时返回空字典
+        """
+        keys = list(dict.fromkeys(keys))
+        found: Dict[str, np.ndarray] = {}
+        try:
+            with self._lock:
+                for i in range(0, len(keys), _LOOKUP_CHUNK):
+                    chunk = keys[i:i + _LOOKUP_CHUNK]
+                    rows = self._conn.execute(
+                        f"SELECT key, dim, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})",
+                        chunk,
+                    ).fetchall()
+                    for key, dim, blob in rows:
+                        vec = np.frombuffer(blob, dtype=np.float32)
+                        if vec.shape[0] == dim:
+                            found[key] = vec
+                self._hits += len(found)
+                self._misses += len(keys) - len(found)
+        except sqlite3.Error as e:
+            logger.warning(f"[EmbeddingStore] Lookup failed: {e}")
+            return {}
+        return found
+
+    def put_many(self, vectors: Dict[str, np.ndarray]):
+        """批量写入向量（已存在的键覆盖）"""
+        if not vectors:
+            return
+        now = time.time()
+        rows = []
+        for key, vec in vectors.items():
+            vec = np.asarray(vec, dtype=np.float32).ravel()
+            rows.append((key, vec.shape[0], vec.tobytes(), now))
+        try:
+            with self._lock, self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, dim, vector, created_at) VALUES (?, ?, ?, ?)",
+                    rows,
+                )
+                self._writes += len(rows)
+        except sqlite3.Error as e:
+            logger.warning(f"[EmbeddingStore] Write failed: {e}")
+
+    def clear(self):
+        """删除所有已存储的向量"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM embeddings")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """存储状态"""
+        with self._lock:
+            try:
+                size = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            except sqlite3.Error:
+                size = None
+            total = self._hits + self._misses
+            return {
+                "path": self.db_path,
+                "size": size,
+                "hits": self._hits,
+                "misses": self._misses,
+                "writes": self._writes,
+                "hit_rate": round(self._hits / total, 4) if total else 0.0,
+            }
@@ -0,0 +1,493 @@
+"""
+MySQL 连接池
+按 db_name 维护独立的 pymysql 连接池，支持并发执行 SQL
+
+- 池大小 / 最小空闲连接数 / 连接最大存活时间
+- 借出时健康检查（ping），失效连接自动丢弃重建
+- 连接丢失类错误（2006/2013 等）在新连接上自动重试一次：仅限语句尚未发出，或只读语句
+  （2013 可能发生在服务端已收到语句之后，autocommit 下重试写语句会重复执行）
+- query_limited 用服务端游标（SSCursor）分块读取，达到行数 / 字节数上限即停止，不把整个结果集读入内存
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+import pymysql
+import pymysql.cursors
+
+
+# 连接丢失相关的 MySQL 客户端错误码
+_CONNECTION_LOST_CODES = {0, 2006, 2013, 2014, 2055}
+
+# 只读语句（连接丢失后可在新连接上重新执行）
+_READ_ONLY_RE = re.compile(r"^\s*(\(\s*)*(SELECT|SHOW|DESCRIBE|DESC|EXPLAIN|WITH)\b", re.IGNORECASE)
+_WRITE_RE = re.compile(r"\b(INSERT|UPDATE|DELETE|REPLACE|INTO)\b", re.IGNORECASE)
+
+
+class PoolTimeoutError(RuntimeError):
+    """等待空闲连接超时"""
+
+
+def estimate_bytes(rows: List[Any]) -> int:
+    """估算一批行占用的内存（按抽样行的字符串 / 字节长度计算，其他类型按 8 字节）"""
+    if not rows:
+        return 0
+    sample = rows[::max(1, len(rows) // 32)]
+    total = 0
+    for row in sample:
+        for value in row:
+            total += len(value) if isinstance(value, (str, bytes, bytearray)) else 8
+    return total * len(rows) // len(sample)
+
+
+def _is_connection_lost(e: Exception) -> bool:
+    """判断异常是否为连接丢失（而非 SQL 本身的错误）"""
+    if isinstance(e, pymysql.err.InterfaceError):
+        return True
+    if isinstance(e, pymysql.err.OperationalError):
+        code = e.args[0] if e.args else None
+        return code in _CONNECTION_LOST_CODES
+    return False
+
+
+def _is_read_only(sql: str) -> bool:
+    """判断语句是否只读（重复执行没有副作用）"""
+    return bool(_READ_ONLY_RE.match(sql or "")) and not _WRITE_RE.search(sql)
+
+
+def _can_retry(e: Exception, sql: str, sent: bool) -> bool:
+    """
+    连接丢失后能否在新连接上重试
+
+    语句已发给 cs.execute 时，服务端可能已经执行（如 2013 Lost connection during query），
+    这时只重试只读语句
+    """
+    return _is_connection_lost(e) and (not sent or _is_read_only(sql))
+
+
+class MySQLConnectionPool:
+    """
+    单个数据库的连接池（线程安全）
+
+    使用示例:
+        pool = MySQLConnectionPool(host="localhost", user="root", password="", database="sales")
+        columns, rows = pool.query("SELECT 1")
+    """
+
+    def __init__(
+        self,
+        host: str,
+        user: str,
+        password: str,
+        database: str,
+        port: int = 3306,
+        pool_size: int = 8,
+        min_idle: int = 1,
+        max_lifetime: float = 1800,
+        checkout_timeout: float = 30,
+        **connect_kwargs,
+    ):
+        """
+        初始化连接池（预建 min_idle 个连接，配置错误时立即失败）
+
+        Args:
+            host: 数据库主机
+            user: 用户名
+            password: 密码
+            database: 数据库名
+            port: 端口
+            pool_size: 最大连接数
+            min_idle: 最小空闲连接数（启动时预建）
+            max_lifetime: 连接最大存活时间（秒），超时的连接在归还/借出时关闭
+            checkout_timeout: 等待空闲连接的超时时间（秒）
+            **connect_kwargs: 透传给 pymysql.connect 的其他参数
+        """
+        if pool_size < 1:
+            raise ValueError("pool_size must be >= 1")
+
+        self.host = host
+        self.port = int(port) if port else 3306
+        self.user = user
+        self.password = password
+        self.database = database
+        self.pool_size = pool_size
+        self.min_idle = max(0, min(min_idle, pool_size))
+        self.max_lifetime = max_lifetime
+        self.checkout_timeout = checkout_timeout
+        self.connect_kwargs = connect_kwargs
+
+        self._idle: deque = deque()  # (conn, created_at)
+        self._created_at: Dict[int, float] = {}  # id(conn) -> 创建时间
+        self._total = 0  # 已创建且未关闭的连接数
+        self._cond = threading.Condition()
+        self._closed = False
+
+        for _ in range(self.min_idle):
+            conn = self._connect()
+            with self._cond:
+                self._total += 1
+                self._idle.append((conn, self._created_at[id(conn)]))
+
+    @property
+    def identity(self) -> Tuple:
+        """连接参数标识（用于判断配置是否变化）"""
+        return (self.host, self.port, self.user, self.password, self.database)
+
+    # ==================== 连接生命周期 ====================
+
+    def _connect(self):
+        """新建一个物理连接"""
+        conn = pymysql.connect(
+            host=self.host,
+            user=self.user,
+            password=self.password,
+            database=self.database,
+            port=self.port,
+            autocommit=True,  # 每条查询读取最新数据，避免复用连接时读到旧快照
+            **self.connect_kwargs,
+        )
+        self._created_at[id(conn)] = time.time()
+        return conn
+
+    def _expired(self, created_at: float) -> bool:
+        return self.max_lifetime > 0 and time.time() - created_at > self.max_lifetime
+
+    def _close_conn(self, conn):
+        """关闭物理连接（调用方负责更新计数）"""
+        self._created_at.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def acquire(self, timeout: Optional[float] = None):
+        """
+        借出连接（带健康检查）
+
+        Args:
+            timeout: 等待超时时间（秒），默认使用 checkout_timeout
+
+        Returns:
+            pymysql 连接
+
+        Raises:
+            PoolTimeoutError: 超时仍无可用连接
+        """
+        timeout = self.checkout_timeout if timeout is None else timeout
+        deadline = time.time() + timeout
+
+        while True:
+            conn = None
+            with self._cond:
+                if self._closed:
+                    raise RuntimeError(f"Connection pool for {self.database} is closed")
+                while not self._idle and self._total >= self.pool_size:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise PoolTimeoutError(
+                            f"Timed out after {timeout}s waiting for a MySQL connection ({self.database})"
+                        )
+                    self._cond.wait(remaining)
+                if self._idle:
+                    conn, created_at = self._idle.pop()
+                else:
+                    # 预占名额，在锁外建立连接
+                    self._total += 1
+
+            if conn is None:
+                try:
+                    return self._connect()
+                except Exception:
+                    with self._cond:
+                        self._total -= 1
+                        self._cond.notify()
+                    raise
+
+            # 空闲连接：检查存活时间和健康状态
+            if not self._expired(created_at):
+                try:
+                    conn.ping(reconnect=False)
+                    return conn
+                except Exception:
+                    logger.info(f"[MySQLPool] Discarding broken connection ({self.database})")
+            self._discard(conn)
+
+    def release(self, conn, discard: bool = False):
+        """
+        归还连接
+
+        Args:
+            conn: 借出的连接
+            discard: 是否直接关闭（连接出错时）
+        """
+        created_at = self._created_at.get(id(conn), 0)
+        if discard or self._closed or not getattr(conn, "open", False) or self._expired(created_at):
+            self._discard(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, created_at))
+            self._cond.notify()
+
+    def _discard(self, conn):
+        self._close_conn(conn)
+        with self._cond:
+            self._total -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout: Optional[float] = None):
+        """
+        上下文管理器形式借出连接，出现连接级错误时丢弃该连接
+
+        Yields:
+            pymysql 连接
+        """
+        conn = self.acquire(timeout)
+        discard = False
+        try:
+            yield conn
+        except Exception as e:
+            discard = _is_connection_lost(e)
+            raise
+        finally:
+            self.release(conn, discard=discard)
+
+    # ==================== 查询 ====================
+
+    def query(self, sql: str) -> Tuple[Optional[List[str]], List[Any]]:
+        """
+        执行 SQL 并取回全部结果（连接丢失时在新连接上重试一次，已发出的写语句不重试）
+
+        Args:
+            sql: SQL 语句
+
+        Returns:
+            (列名列表, 行列表)；语句无结果集时列名为 None
+        """
+        for attempt in range(2):
+            sent = False
+            try:
+                with self.connection() as conn:
+                    with conn.cursor() as cs:
+                        sent = True
+                        cs.execute(sql)
+                        if cs.description is None:
+                            return None, []
+                        columns = [desc[0] for desc in cs.description]
+                        return columns, cs.fetchall()
+            except Exception as e:
+                if attempt == 0 and _can_retry(e, sql, sent):
+                    logger.warning(f"[MySQLPool] Connection lost ({e}), retrying on a fresh connection")
+                    continue
+                raise
+
+    def query_limited(
+        self,
+        sql: str,
+        max_rows: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        chunk_size: int = 1000,
+    ) -> Tuple[Optional[List[str]], List[Any], Optional[str]]:
+        """
+        用服务端游标分块读取结果，超过上限时停止读取（连接丢失时在新连接上重试一次，已发出的写语句不重试）
+
+        Args:
+            sql: SQL 语句
+            max_rows: 最多读取的行数（None 或 <= 0 表示不限制）
+            max_bytes: 已读取行的估算字节数上限（None 或 <= 0 表示不限制）
+            chunk_size: 每次从服务端读取的行数
+
+        Returns:
+            (列名列表, 行列表, 截断原因)；截断原因为 None（完整读取）、"max_rows" 或 "max_bytes"，
+            语句无结果集时列名为 None
+        """
+        for attempt in range(2):
+            sent = False
+            try:
+                with self.connection() as conn:
+                    cs = conn.cursor(pymysql.cursors.SSCursor)
+                    drained = False
+                    try:
+                        sent = True
+                        cs.execute(sql)
+                        if cs.description is None:
+                            drained = True
+                            return None, [], None
+                        columns = [desc[0] for desc in cs.description]
+                        rows: List[Any] = []
+                        size = 0
+                        truncated = None
+                        while True:
+                            chunk = cs.fetchmany(chunk_size)
+                            if not chunk:
+                                drained = True
+                                break
+                            rows.extend(chunk)
+                            size += estimate_bytes(chunk)
+                            if max_rows and 0 < max_rows < len(rows):
+                                del rows[max_rows:]
+                                truncated = "max_rows"
+                                break
+                            if max_bytes and 0 < max_bytes < size:
+                                truncated = "max_bytes"
+                                break
+                        return columns, rows, truncated
+                    finally:
+                        if drained:
+                            cs.close()
+                        else:
+                            # 截断或出错时结果集未读完：SSCursor.close() 会读完剩余的全部行（出错时还可能
+                            # 再抛异常掩盖原始错误），直接关闭连接（归还时丢弃），放弃未读取的结果
+                            try:
+                                conn.close()
+                            except Exception:
+                                pass
+                            cs.connection = None
+            except Exception as e:
+                if attempt == 0 and _can_retry(e, sql, sent):
+                    logger.warning(f"[MySQLPool] Connection lost ({e}), retrying on a fresh connection")
+                    continue
+                raise
+
+    # ==================== 管理 ====================
+
+    def stats(self) -> Dict[str, Any]:
+        """连接池状态"""
+        with self._cond:
+            idle = len(self._idle)
+            return {
+                "database": self.database,
+                "host": self.host,
+                "pool_size": self.pool_size,
+                "total": self._total,
+                "idle": idle,
+                "in_use": self._total - idle,
+            }
+
+    def close(self):
+        """关闭连接池（借出中的连接在归还时关闭）"""
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._total -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._close_conn(conn)
+
+
+class MySQLPoolRegistry:
+    """
+    按 db_name 管理连接池
+
+    - register(): 只登记连接配置，首次使用时才建池
+    - get(): 获取（必要时创建）连接池；配置变化时重建
+    """
+
+    def __init__(self, **pool_options):
+        """
+        Args:
+            **pool_options: 所有池共享的参数（pool_size, min_idle, max_lifetime, checkout_timeout）
+        """
+        self.pool_options = pool_options
+        self._configs: Dict[str, Dict[str, Any]] = {}
+        self._pools: Dict[str, MySQLConnectionPool] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(db_name: str, config: Dict[str, Any]) -> Dict[str, Any]:
+        """统一 db_connection_configs 风格的配置（dbname/user/...），connect_kwargs 中的参数透传给 pymysql.connect"""
+        return {
+            "host": config.get("host", "localhost"),
+            "port": int(config.get("port") or 3306),
+            "user": config.get("user", "root"),
+            "password": config.get("password", ""),
+            "database": config.get("dbname") or config.get("database") or db_name,
+            **dict(config.get("connect_kwargs") or {}),
+        }
+
+    def register(self, db_name: str, config: Dict[str, Any]):
+        """
+        登记数据库连接配置（不立即建立连接）
+
+        Args:
+            db_name: 数据库名称（路由键）
+            config: 连接配置（host, port, user, password, dbname，可选 connect_kwargs：charset / ssl 等 pymysql 参数）
+        """
+        normalized = self._normalize(db_name, config)
+        stale = None
+        with self._lock:
+            if self._configs.get(db_name) != normalized:
+                self._configs[db_name] = normalized
+                stale = self._pools.pop(db_name, None)
+        if stale:
+            logger.info(f"[MySQLPool] Connection config changed for {db_name}, rebuilding pool")
+            stale.close()
+
+    def has(self, db_name: str) -> bool:
+        with self._lock:
+            return db_name in self._configs
+
+    def config(self, db_name: str) -> Dict[str, Any]:
+        """
+        已登记的连接配置（副本，不建立连接）
+
+        Raises:
+            KeyError: db_name 未登记
+        """
+        with self._lock:
+            config = self._configs.get(db_name)
+            if config is None:
+                raise KeyError(f"Database {db_name} is not registered")
+            return dict(config)
+
+    def get(self, db_name: str) -> MySQLConnectionPool:
+        """
+        获取数据库连接池（首次调用时创建）
+
+        Raises:
+            KeyError: db_name 未登记
+        """
+        with self._lock:
+            pool = self._pools.get(db_name)
+            if pool is not None:
+                return pool
+            config = self._configs.get(db_name)
+            if config is None:
+                raise KeyError(f"Database {db_name} is not registered")
+
+        # 在锁外建池（预建连接可能很慢，不阻塞其他数据库的 get()），再检查一次后发布
+        pool = MySQLConnectionPool(**config, **self.pool_options)
+        with self._lock:
+            existing = self._pools.get(db_name)
+            current = self._configs.get(db_name) == config
+            if existing is None and current:
+                self._pools[db_name] = pool
+        if existing is not None or not current:
+            # 其他线程已建好连接池，或建池期间配置发生了变化
+            pool.close()
+            if existing is not None:
+                return existing
+            return self.get(db_name)
+        logger.info(f"[MySQLPool] Created pool for {db_name} ({config['host']}:{config['port']})")
+        return pool
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """所有已创建连接池的状态"""
+        with self._lock:
+            pools = list(self._pools.values())
+        return [p.stats() for p in pools]
+
+    def close_all(self):
+        """关闭所有连接池"""
+        with self._lock:
+            pools = list(self._pools.values())
+            self._pools.clear()
+        for p in pools:
+            p.close()
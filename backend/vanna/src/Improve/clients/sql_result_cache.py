@@ -0,0 +1,356 @@
+"""
+SQL 查询结果缓存
+execute_sql 工具和 /api/query 每次都调用 run_sql：看板上的同一条 SQL 每分钟执行多次，
+Agent 重试时也会重新执行完全相同的查询。这里按 (db_name, 规范化后的 SQL) 缓存查询结果：
+
+- SQL 用 sqlparse 规范化（去注释、保留字大写、合并空白），写法不同的同一查询命中同一条目
+- 只缓存单条只读 SELECT（不含 RAND()/NOW() 之外的非确定函数，不访问系统库）
+- 结果序列化为 Arrow IPC 字节（安装了 pyarrow 时），否则为 zlib 压缩的 pickle，按字节数 LRU 淘汰
+- TTL 过期；可按数据库或表使缓存失效，同一数据库执行写语句时自动失效
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+import pickle
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, FrozenSet, Iterable, Optional, Tuple
+
+import pandas as pd
+import sqlparse
+
+try:
+    import pyarrow as pa
+except ImportError:  # 未安装 pyarrow 时退回 pickle
+    pa = None
+
+
+# 结果随执行时刻变化的函数（NOW() 等由 TTL 兜底，不在此列）
+_NONDETERMINISTIC = re.compile(
+    r"\b(RAND|UUID|UUID_SHORT|SLEEP|CONNECTION_ID|LAST_INSERT_ID|FOUND_ROWS|ROW_COUNT|GET_LOCK)\s*\(",
+    re.IGNORECASE,
+)
+_LOCKING_READ = re.compile(r"\bFOR\s+UPDATE\b|\bLOCK\s+IN\s+SHARE\s+MODE\b|\bFOR\s+SHARE\b", re.IGNORECASE)
+_WRITE_STATEMENT = re.compile(
+    r"^\s*(INSERT|UPDATE|DELETE|REPLACE|CREATE|DROP|ALTER|TRUNCATE|RENAME|LOAD)\b", re.IGNORECASE
+)
+_SYSTEM_SCHEMAS = {"information_schema", "performance_schema", "mysql", "sys"}
+
+_IDENT = r"`[^`]+`|[A-Za-z_][\w$]*"
+_TABLE_REF = re.compile(rf"\s*({_IDENT})(?:\s*\.\s*({_IDENT}))?")
+_ALIAS = re.compile(rf"\s*(?:AS\s+)?({_IDENT})", re.IGNORECASE)
+_COMMA = re.compile(r"\s*,")
+_TABLE_CLAUSE = re.compile(r"\b(?:FROM|JOIN|UPDATE|INTO)\b", re.IGNORECASE)
+_STRING_LITERAL = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"")
+# FROM 不表示表引用的函数：EXTRACT(YEAR FROM col)、TRIM(BOTH 'x' FROM col)、SUBSTRING(s FROM 2)
+_FROM_FUNCTIONS = {"EXTRACT", "TRIM", "SUBSTRING", "SUBSTR"}
+_PRECEDING_NAME = re.compile(r"(\w+)\s*$")
+# 规范化时统一为大写的 MySQL 保留字（保留字不能作为未加引号的标识符，大写不会改变语义；
+# user、status 等非保留字可能是表名或列名，在区分大小写的文件系统上大小写不同即是不同的表，保持原样）
+_RESERVED_KEYWORDS = {
+    "SELECT", "DISTINCT", "FROM", "WHERE", "GROUP", "BY", "ORDER", "HAVING", "LIMIT", "JOIN",
+    "INNER", "LEFT", "RIGHT", "OUTER", "CROSS", "NATURAL", "ON", "USING", "AS", "AND", "OR",
+    "NOT", "IN", "IS", "NULL", "LIKE", "BETWEEN", "CASE", "WHEN", "THEN", "ELSE", "ASC", "DESC",
+    "UNION", "ALL", "EXISTS", "WITH", "INTERVAL", "DIV", "MOD", "XOR", "REGEXP", "TRUE", "FALSE",
+}
+# 表名之后不是别名的关键字
+_CLAUSE_KEYWORDS = {
+    "WHERE", "GROUP", "ORDER", "LIMIT", "HAVING", "JOIN", "LEFT", "RIGHT", "INNER", "OUTER",
+    "CROSS", "NATURAL", "STRAIGHT_JOIN", "FULL", "ON", "USING", "UNION", "WINDOW", "FOR",
+    "LOCK", "SET", "VALUES", "SELECT", "PARTITION", "USE", "FORCE", "IGNORE",
+}
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    规范化 SQL（去注释、保留字大写、空白合并为单个空格、去掉末尾分号）
+
+    字符串字面量、标识符和非保留关键字（可能是表名 / 列名）保持原样
+    """
+    formatted = sqlparse.format(sql, strip_comments=True)
+    parts = []
+    for statement in sqlparse.parse(formatted):
+        for token in statement.flatten():
+            if token.is_whitespace:
+                if parts and parts[-1] != " ":
+                    parts.append(" ")
+            elif token.is_keyword:
+                # sqlparse 把 "GROUP BY"、"LEFT JOIN" 等识别为一个 token
+                words = token.value.split()
+                if all(w.upper() in _RESERVED_KEYWORDS for w in words):
+                    parts.append(" ".join(w.upper() for w in words))
+                else:
+                    parts.append(token.value)
+            else:
+                parts.append(token.value)
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+def referenced_tables(sql: str) -> FrozenSet[str]:
+    """
+    SQL 中 FROM / JOIN / UPDATE / INTO 之后出现的表名（小写，带库名前缀时为 "库.表"）
+
+    基于正则的近似解析，用于按表失效缓存；子查询中的表同样会被识别
+    """
+    # 字符串字面量中的 "from x" 不是表引用
+    sql = _STRING_LITERAL.sub("''", sql)
+    tables = set()
+    for match in _TABLE_CLAUSE.finditer(sql):
+        if _in_from_function(sql, match.start()):
+            continue
+        pos = match.end()
+        while True:
+            ref = _TABLE_REF.match(sql, pos)
+            if ref is None:
+                break
+            first, second = (_unquote(p) if p else None for p in ref.groups())
+            if first.upper() in _CLAUSE_KEYWORDS:
+                break
+            tables.add(f"{first}.{second}" if second else first)
+            pos = ref.end()
+            alias = _ALIAS.match(sql, pos)
+            if alias and _unquote(alias.group(1)).upper() not in _CLAUSE_KEYWORDS:
+                pos = alias.end()
+            # 逗号分隔的多个表（FROM a, b）
+            comma = _COMMA.match(sql, pos)
+            if comma is None:
+                break
+            pos = comma.end()
+    return frozenset(tables)
+
+
+def _in_from_function(sql: str, pos: int) -> bool:
+    """pos 处的关键字是否位于 EXTRACT(... FROM ...) 等函数的括号内"""
+    depth = 0
+    for i in range(pos - 1, -1, -1):
+        ch = sql[i]
+        if ch == ")":
+            depth += 1
+        elif ch == "(":
+            if depth == 0:
+                name = _PRECEDING_NAME.search(sql, 0, i)
+                return name is not None and name.group(1).upper() in _FROM_FUNCTIONS
+            depth -= 1
+    return False
+
+
+@lru_cache(maxsize=1024)
+def _analyze(sql: str) -> Optional[Tuple[str, FrozenSet[str]]]:
+    """SQLResultCache.cache_key 的实现（按原始 SQL 文本缓存解析结果，get / put 不会重复解析）"""
+    try:
+        normalized = normalize_sql(sql)
+        statements = sqlparse.parse(normalized)
+    except Exception:
+        return None
+    if len(statements) != 1 or statements[0].get_type() != "SELECT":
+        return None
+    if _NONDETERMINISTIC.search(normalized) or _LOCKING_READ.search(normalized) or "@@" in normalized:
+        return None
+    tables = referenced_tables(normalized)
+    if not tables or any("." in t and t.split(".", 1)[0] in _SYSTEM_SCHEMAS for t in tables):
+        return None
+    return normalized, tables
+
+
+def _unquote(ident: str) -> str:
+    return ident.strip("`").lower()
+
+
+def _bare_table(table: str) -> str:
+    return table.rsplit(".", 1)[-1]
+
+
+@dataclass
+class _Entry:
+    payload: bytes
+    fmt: str  # "arrow" | "pickle"
+    tables: FrozenSet[str]
+    rows: int
+    created_at: float
+
+    @property
+    def size(self) -> int:
+        return len(self.payload)
+
+
+class SQLResultCache:
+    """
+    线程安全的 SQL 查询结果缓存（TTL + 按字节数 LRU）
+
+    使用示例:
+        cache = SQLResultCache(ttl=60, max_bytes=64 * 1024 * 1024)
+        df = cache.get("sales", sql)
+        if df is None:
+            df = run(sql)
+            cache.put("sales", sql, df)
+    """
+
+    def __init__(self, ttl: float = 60, max_bytes: int = 64 * 1024 * 1024, max_entry_bytes: Optional[int] = None):
+        """
+        Args:
+            ttl: 结果有效期（秒，<= 0 表示禁用缓存）
+            max_bytes: 所有条目序列化后的总字节数上限
+            max_entry_bytes: 单个结果的字节数上限（默认 max_bytes 的 1/4），超过时不缓存
+        """
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes or max_bytes // 4
+        self._data: "OrderedDict[Tuple[str, str], _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_bytes > 0
+
+    # ==================== 公开接口 ====================
+
+    def cache_key(self, sql: str) -> Optional[Tuple[str, FrozenSet[str]]]:
+        """
+        SQL 可缓存时返回 (规范化 SQL, 引用的表)，否则返回 None
+
+        可缓存：单条 SELECT，引用了用户表（不访问系统库），不含非确定函数和加锁读
+        """
+        return _analyze(sql)
+
+    def get(self, db_name: str, sql: str) -> Optional[pd.DataFrame]:
+        """读取缓存结果（未命中、已过期或不可缓存时返回 None）"""
+        if not self.enabled:
+            return None
+        key = self.cache_key(sql)
+        if key is None:
+            return None
+        cache_key = (db_name, key[0])
+        with self._lock:
+            entry = self._data.get(cache_key)
+            if entry is not None and time.time() - entry.created_at > self.ttl:
+                self._remove(cache_key)
+                entry = None
+            if entry is None:
+                self._misses += 1
+                return None
+            self._data.move_to_end(cache_key)
+            self._hits += 1
+        return self._deserialize(entry)
+
+    def put(self, db_name: str, sql: str, df: Optional[pd.DataFrame]):
+        """写入查询结果（不可缓存的 SQL、None 结果和过大的结果会被忽略）"""
+        if not self.enabled or df is None:
+            return
+        key = self.cache_key(sql)
+        if key is None:
+            return
+        try:
+            payload, fmt = self._serialize(df)
+        except Exception as e:
+            logger.debug(f"[SQLResultCache] Result not serializable: {e}")
+            return
+        if len(payload) > self.max_entry_bytes:
+            return
+
+        entry = _Entry(payload=payload, fmt=fmt, tables=key[1], rows=len(df), created_at=time.time())
+        cache_key = (db_name, key[0])
+        with self._lock:
+            if cache_key in self._data:
+                self._remove(cache_key)
+            self._data[cache_key] = entry
+            self._bytes += entry.size
+            while self._bytes > self.max_bytes and self._data:
+                self._remove(next(iter(self._data)))
+                self._evictions += 1
+
+    def invalidate_for(self, db_name: str, sql: str):
+        """执行了写语句时，使该数据库中相关表（无法识别时为全部）的缓存失效"""
+        if not _WRITE_STATEMENT.match(sql or ""):
+            return
+        try:
+            tables = referenced_tables(normalize_sql(sql))
+        except Exception:
+            tables = frozenset()
+        self.invalidate(db_name, tables or None)
+
+    def invalidate(self, db_name: Optional[str] = None, tables: Optional[Iterable[str]] = None) -> int:
+        """
+        使缓存失效
+
+        Args:
+            db_name: 数据库名称（None 表示全部）
+            tables: 表名（不区分大小写，可带库名前缀；None 表示该数据库的全部条目）
+
+        Returns:
+            删除的条目数
+        """
+        wanted = {_bare_table(_unquote(t)) for t in tables} if tables else None
+        with self._lock:
+            keys = [
+                key for key, entry in self._data.items()
+                if (db_name is None or key[0] == db_name)
+                and (wanted is None or any(_bare_table(t) in wanted for t in entry.tables))
+            ]
+            for key in keys:
+                self._remove(key)
+            if keys:
+                self._invalidations += 1
+        if keys:
+            logger.info(f"[SQLResultCache] Invalidated {len(keys)} results (db_name={db_name!r}, tables={tables})")
+        return len(keys)
+
+    def clear(self):
+        """清空缓存（计数保留）"""
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存状态"""
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "format": "arrow" if pa is not None else "pickle",
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "invalidations": self._invalidations,
+                "hit_rate": round(self._hits / total, 4) if total else 0.0,
+            }
+
+    # ==================== 内部实现 ====================
+
+    def _remove(self, key: Tuple[str, str]):
+        """删除条目（调用方需持有锁）"""
+        entry = self._data.pop(key)
+        self._bytes -= entry.size
+
+    @staticmethod
+    def _serialize(df: pd.DataFrame) -> Tuple[bytes, str]:
+        if pa is not None:
+            try:
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                sink = pa.BufferOutputStream()
+                with pa.ipc.new_stream(sink, table.schema) as writer:
+                    writer.write_table(table)
+                return sink.getvalue().to_pybytes(), "arrow"
+            except (pa.ArrowException, TypeError, ValueError):
+                # 混合类型的 object 列无法转换为 Arrow，退回 pickle
+                pass
+        return zlib.compress(pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL), 1), "pickle"
+
+    @staticmethod
+    def _deserialize(entry: _Entry) -> pd.DataFrame:
+        if entry.fmt == "arrow":
+            return pa.ipc.open_stream(entry.payload).read_all().to_pandas()
+        # 只反序列化本进程写入的数据
+        return pickle.loads(zlib.decompress(entry.payload))
@@ -8,7 +8,9 @@ logger = logging.getLogger(__name__)
 import os
 import sys
 import hashlib
-from typing import List, Union, Literal
+import time
+import contextvars
+from typing import Callable, Dict, List, Optional, Union, Literal
 from pathlib import Path
 
 # 动态获取项目根目录（vanna/）
@@ -19,7 +21,7 @@ VANNA_SRC = PROJECT_ROOT / "src"
 sys.path.insert(0, str(VANNA_SRC))
 os.chdir(str(PROJECT_ROOT))
 
-from vanna.milvus.milvus_vector import Milvus_VectorStore
+from vanna.milvus.milvus_vector import Milvus_VectorStore, TRAINING_COLLECTIONS
 from vanna.openai import OpenAI_Chat
 from vanna.exceptions import ValidationError
 from vanna.types import TrainingPlan, TrainingPlanItem
@@ -28,6 +30,11 @@ from openai import OpenAI
 
 # 导入统一的嵌入向量接口
 from .embedding_providers import EmbeddingBase, create_embedding_client
+from .mysql_pool import MySQLPoolRegistry, estimate_bytes
+from .sql_result_cache import SQLResultCache
+from ..shared import get_current_db_name
+from ..shared.tracing import get_tracer, set_span_attributes
+from ..shared.metrics import MILVUS_SEARCH_DURATION, SQL_DURATION, SQL_ROWS
 
 # 禁用遥测
 os.environ['ANONYMIZED_TELEMETRY'] = 'False'
@@ -42,7 +49,10 @@ class MyVanna(Milvus_VectorStore, OpenAI_Chat):
     - 使用哈希 ID 自动去重
     - 批量向量化，提升 10-100 倍性能
     - 支持自定义向量相似度度量方式（cosine, L2, IP）
-    - 修复数据库连接切换问题
+    - 按 db_name 维护 MySQL 连接池，run_sql 可并发执行
+    - 只读查询结果按 (数据库, 规范化 SQL) 缓存，写语句执行后相关表的缓存失效
+    - 查询结果用服务端游标分块读取，超过行数 / 字节数上限时截断（df.attrs["truncated"]）
+    - 训练数据变化时通知监听者（如问答缓存），并清空检索结果复用
     """
 
     def __init__(self, config=None):
@@ -63,17 +73,29 @@ class MyVanna(Milvus_VectorStore, OpenAI_Chat):
         self.metric_type = self.metric_type.upper()  # 统一转大写
         logger.info(f"Vector similarity metric type: {self.metric_type}")
 
-        # 修复数据库连接切换问题：保存连接和 run_sql 函数
-        self._mysql_conn = None
-        self._run_sql_func = None
+        # MySQL 连接池（按 db_name 路由）
+        self._mysql_pools = MySQLPoolRegistry(
+            pool_size=int(config.get("mysql_pool_size", 8)),
+            min_idle=int(config.get("mysql_pool_min_idle", 1)),
+            max_lifetime=float(config.get("mysql_pool_max_lifetime", 1800)),
+            checkout_timeout=float(config.get("mysql_pool_timeout", 30)),
+        )
+        self._default_db_name = None
+        self.sql_max_rows = int(config.get("sql_max_rows", 100_000))
+        self.sql_max_bytes = int(config.get("sql_max_bytes", 256 * 1024 * 1024))
+        self.sql_result_cache = SQLResultCache(
+            ttl=float(config.get("sql_result_cache_ttl", 60)),
+            max_bytes=int(config.get("sql_result_cache_max_bytes", 64 * 1024 * 1024)),
+        )
+        self._training_listeners: List[Callable[[Optional[str]], None]] = []
 
     def connect_to_mysql(self, host=None, dbname=None, user=None, password=None, port=None, **kwargs):
         """
-        修复版的 connect_to_mysql 方法
-        保存数据库连接以便后续使用
-        """
-        import pymysql
+        连接 MySQL（基于连接池）
 
+        为 dbname 登记并创建连接池（配置未变时复用已有连接池），
+        并设为 run_sql 的默认数据库；其他参数（charset、ssl 等）透传给 pymysql.connect
+        """
         if not host:
             host = os.getenv("HOST")
         if not dbname:
@@ -85,35 +107,244 @@ class MyVanna(Milvus_VectorStore, OpenAI_Chat):
         if not port:
             port = os.getenv("PORT")
 
-        # 创建新连接
-        self._mysql_conn = pymysql.connect(
-            host=host,
-            user=user,
-            password=password,
-            database=dbname,
-            port=int(port) if port else 3306,
-            **kwargs
+        self.register_mysql_database(dbname, {
+            "host": host,
+            "dbname": dbname,
+            "user": user,
+            "password": password,
+            "port": int(port) if port else 3306,
+            "connect_kwargs": kwargs,
+        })
+        # 立即建池（预建连接），配置错误时在此处抛出
+        self._mysql_pools.get(dbname)
+        self._default_db_name = dbname
+
+        self.run_sql = self._run_sql_mysql
+        self.run_sql_is_set = True
+        logger.info(f"Connected to MySQL database: {dbname}")
+
+    def register_mysql_database(self, db_name: str, config: dict):
+        """
+        登记数据库连接配置（首次使用时才建立连接池）
+
+        Args:
+            db_name: 数据库名称
+            config: 连接配置（host, port, user, password, dbname），与 db_connection_configs 格式一致
+        """
+        self._mysql_pools.register(db_name, config)
+
+    def has_mysql_database(self, db_name: str) -> bool:
+        """数据库是否已登记（可用于 run_sql 的 db_name 路由）"""
+        return self._mysql_pools.has(db_name)
+
+    def _resolve_db_name(self, db_name: str = None) -> str:
+        """确定目标数据库：显式指定 > 当前 run 的目标数据库 > 默认数据库"""
+        db_name = db_name or get_current_db_name() or self._default_db_name
+        if not db_name:
+            raise Exception("You need to connect to a database first by running vn.connect_to_mysql()")
+        return db_name
+
+    def mysql_target(self, db_name: str = None) -> dict:
+        """
+        当前路由到的 MySQL 目标（不建立连接，可作为缓存键）
+
+        Args:
+            db_name: 目标数据库（默认按 run_sql 的规则确定）
+
+        Returns:
+            dict: db_name（路由名）, host, port, user, database（实际库名）
+        """
+        db_name = self._resolve_db_name(db_name)
+        config = self._mysql_pools.config(db_name)
+        target = {key: config[key] for key in ("host", "port", "user", "database")}
+        target["db_name"] = db_name
+        return target
+
+    def _run_sql_mysql(
+        self,
+        sql: str,
+        db_name: str = None,
+        use_cache: bool = True,
+        max_rows: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        **kwargs,
+    ):
+        """
+        在连接池上执行 SQL（只读查询的结果在 sql_result_cache 的 TTL 内复用）
+
+        结果用服务端游标分块读取，超过 max_rows / max_bytes 时停止读取并截断，
+        df.attrs["truncated"] 为 True，df.attrs["truncated_by"] 为 "max_rows" 或 "max_bytes"
+
+        Args:
+            sql: SQL 语句
+            db_name: 目标数据库；未指定时依次使用当前 run 的目标数据库、
+                     最近一次 connect_to_mysql 的数据库
+            use_cache: 是否读取结果缓存（False 时总是访问数据库，结果仍会写入缓存）
+            max_rows: 最多读取的行数（默认 sql_max_rows，<= 0 表示不限制）
+            max_bytes: 读取结果的估算字节数上限（默认 sql_max_bytes，<= 0 表示不限制）
+
+        Returns:
+            pd.DataFrame；语句无结果集时返回 None
+        """
+        import pandas as pd
+
+        max_rows = self.sql_max_rows if max_rows is None else max_rows
+        max_bytes = self.sql_max_bytes if max_bytes is None else max_bytes
+        db_name = self._resolve_db_name(db_name)
+        scope = self._sql_cache_scope(db_name)
+        t0 = time.perf_counter()
+        cache = "error"
+        try:
+            with get_tracer().span("sql", kind="sql", db_name=db_name, sql=sql[:500]) as span:
+                if use_cache:
+                    df = self.sql_result_cache.get(scope, sql)
+                    if df is not None:
+                        logger.info(f"[SQLResultCache] Hit ({db_name}): {sql[:80]}")
+                        if 0 < max_rows < len(df):
+                            df = df.head(max_rows)
+                            df.attrs.update(truncated=True, truncated_by="max_rows")
+                        cache = "hit"
+                        self._record_sql_result(span, db_name, df, cache_hit=True)
+                        return df
+
+                columns, rows, truncated_by = self._mysql_pools.get(db_name).query_limited(
+                    sql, max_rows=max_rows, max_bytes=max_bytes
+                )
+                cache = "miss"
+                if columns is None:
+                    # 写语句：相关表的缓存结果已过时
+                    self.sql_result_cache.invalidate_for(scope, sql)
+                    set_span_attributes(span, cache_hit=False, rows=0)
+                    return None
+                df = pd.DataFrame(rows, columns=columns)
+                # 与 query_limited 判断 max_bytes 相同的抽样估算（不对整个 DataFrame 做 memory_usage(deep=True)）
+                df.attrs.update(truncated=truncated_by is not None, truncated_by=truncated_by,
+                                estimated_bytes=estimate_bytes(rows))
+                if truncated_by:
+                    logger.warning(f"[run_sql] Result truncated at {len(df)} rows ({truncated_by}): {sql[:80]}")
+                else:
+                    # 截断的结果不完整，不写入缓存
+                    self.sql_result_cache.put(scope, sql, df)
+                self._record_sql_result(span, db_name, df, cache_hit=False)
+                return df
+        finally:
+            SQL_DURATION.observe(time.perf_counter() - t0, db_name=db_name, cache=cache)
+
+    @staticmethod
+    def _record_sql_result(span, db_name: str, df, cache_hit: bool):
+        """SQL span 属性和行数指标"""
+        SQL_ROWS.observe(len(df), db_name=db_name)
+        set_span_attributes(span,
+            cache_hit=cache_hit,
+            rows=len(df),
+            columns=len(df.columns),
+            bytes=df.attrs.get("estimated_bytes"),
+            truncated=df.attrs.get("truncated_by"),
         )
 
-        # 保存 run_sql 函数
-        def run_sql_mysql(sql: str):
-            if self._mysql_conn:
-                try:
-                    self._mysql_conn.ping(reconnect=True)
-                    cs = self._mysql_conn.cursor()
-                    cs.execute(sql)
-                    results = cs.fetchall()
-                    import pandas as pd
-                    df = pd.DataFrame(results, columns=[desc[0] for desc in cs.description])
-                    return df
-                except Exception as e:
-                    self._mysql_conn.rollback()
-                    raise e
-            return None
+    # ==================== RAG 检索（链路追踪） ====================
+
+    def retrieve_context(self, question: str, **kwargs):
+        """同 Milvus_VectorStore.retrieve_context，记录 retrieval span"""
+        with get_tracer().span("retrieval", kind="retrieval", db_name=kwargs.get("db_name")) as span:
+            context = super().retrieve_context(question, **kwargs)
+            self._set_retrieval_span(span, context)
+            return context
+
+    async def aretrieve_context(self, question: str, **kwargs):
+        """同 Milvus_VectorStore.aretrieve_context，记录 retrieval span"""
+        with get_tracer().span("retrieval", kind="retrieval", db_name=kwargs.get("db_name")) as span:
+            context = await super().aretrieve_context(question, **kwargs)
+            self._set_retrieval_span(span, context)
+            return context
+
+    def _retrieval_searches(self, memo_key: tuple, embeddings) -> dict:
+        """每个集合的检索记录一个 milvus span 和检索耗时（检索在线程池中执行，需传递当前上下文）"""
+        tracer = get_tracer()
+        top_k = memo_key[2]
+
+        def traced(name: str, fn: Callable):
+            ctx = contextvars.copy_context()
+
+            def run():
+                with tracer.span(f"milvus.{name}", kind="milvus", search=name, top_k=top_k) as span, \
+                        MILVUS_SEARCH_DURATION.time(collection=name):
+                    result = fn()
+                    set_span_attributes(span, hits=len(result))
+                    return result
+
+            return lambda: ctx.run(run)
+
+        return {name: traced(name, fn) for name, fn in super()._retrieval_searches(memo_key, embeddings).items()}
+
+    @staticmethod
+    def _set_retrieval_span(span, context):
+        set_span_attributes(span,
+            sql_examples=len(context.question_sql_list),
+            ddl=len(context.ddl_list),
+            docs=len(context.doc_list),
+            plan_tables=len(context.plan_tables),
+            errors=len(context.errors) or None,
+        )
 
-        self._run_sql_func = run_sql_mysql
-        self.run_sql = run_sql_mysql
-        logger.info(f"Connected to MySQL database: {dbname}")
+    def _sql_cache_scope(self, db_name: str) -> str:
+        """结果缓存的分组键：实际连接的 host:port/database（同一个库的不同路由名共用缓存，配置变化后不会读到旧库的结果）"""
+        target = self._mysql_pools.config(db_name)
+        return f"{target['host']}:{target['port']}/{target['database']}"
+
+    def invalidate_sql_cache(self, db_name: str = None, tables: Optional[List[str]] = None) -> int:
+        """
+        使查询结果缓存失效（数据在本服务之外被修改后调用）
+
+        Args:
+            db_name: 数据库名称（None 表示全部数据库）
+            tables: 表名列表（None 表示该数据库的全部缓存结果）
+
+        Returns:
+            int: 删除的缓存条目数
+        """
+        scope = self._sql_cache_scope(db_name) if db_name else None
+        return self.sql_result_cache.invalidate(scope, tables)
+
+    def sql_cache_stats(self) -> dict:
+        """查询结果缓存状态"""
+        return self.sql_result_cache.stats()
+
+    def mysql_pool_stats(self) -> list:
+        """各数据库连接池状态"""
+        return self._mysql_pools.stats()
+
+    def embedding_cache_stats(self) -> dict:
+        """查询向量缓存状态（嵌入客户端不支持缓存时返回 None）"""
+        cache = getattr(self.embedding_function, "query_cache", None)
+        return cache.stats() if cache is not None else None
+
+    def embedding_store_stats(self) -> dict:
+        """文档向量存储状态（未启用时返回 None）"""
+        store = getattr(self.embedding_function, "document_store", None)
+        return store.stats() if store is not None else None
+
+    def close_mysql_pools(self):
+        """关闭所有 MySQL 连接池"""
+        self._mysql_pools.close_all()
+
+    def add_training_listener(self, listener: Callable[[Optional[str]], None]):
+        """
+        注册训练数据变化的监听者
+
+        Args:
+            listener: 回调函数，参数为发生变化的 db_name（None 表示无法确定，视为全部）
+        """
+        self._training_listeners.append(listener)
+
+    def notify_training_changed(self, db_name: Optional[str] = None):
+        """训练数据已变化：清空检索结果复用并通知监听者（绕过本类直接写入 Milvus 后调用）"""
+        self.clear_retrieval_memo()
+        for listener in self._training_listeners:
+            try:
+                listener(db_name or None)
+            except Exception as e:
+                logger.warning(f"Training change listener failed: {e}")
 
     def _get_content_hash(self, text: str) -> str:
         """计算文本的 MD5 哈希值作为 ID"""
@@ -220,6 +451,8 @@ class MyVanna(Milvus_VectorStore, OpenAI_Chat):
             ]
 
             self.milvus_client.insert(collection_name="vannadoc", data=insert_data)
+            self._invalidate_counts("vannadoc")
+            self.notify_training_changed(db_name)
             logger.info(f"Successfully inserted {len(insert_data)} new documents in batch")
 
         # 返回类型与输入一致
@@ -271,6 +504,8 @@ class MyVanna(Milvus_VectorStore, OpenAI_Chat):
             ]
 
             self.milvus_client.insert(collection_name="vannaddl", data=insert_data)
+            self._invalidate_counts("vannaddl")
+            self.notify_training_changed(db_name)
             logger.info(f"Successfully inserted {len(insert_data)} new DDLs in batch")
 
         return ddl_ids[0] if is_single else ddl_ids
@@ -321,10 +556,18 @@ class MyVanna(Milvus_VectorStore, OpenAI_Chat):
             ]
 
             self.milvus_client.insert(collection_name="vannaplan", data=insert_data)
+            self._invalidate_counts("vannaplan")
+            self.notify_training_changed(db_name)
             logger.info(f"Successfully inserted {len(insert_data)} new plans in batch")
 
         return plan_ids[0] if is_single else plan_ids
     
+    def add_question_sql(self, question: str, sql: str, **kwargs) -> str:
+        """添加问答对（写入后通知训练数据变化）"""
+        sql_id = super().add_question_sql(question, sql, **kwargs)
+        self.notify_training_changed(kwargs.get("db_name"))
+        return sql_id
+
     # ==================== 重写 train 方法 ====================
     def train(
         self,
@@ -451,6 +694,8 @@ class MyVanna(Milvus_VectorStore, OpenAI_Chat):
                                 collection_name=collection_name,
                                 ids=[id]
                             )
+                            self._invalidate_counts(collection_name)
+                            self.notify_training_changed()
                             logger.info(f"Successfully deleted ID from {collection_name}: {id}")
                             return True
                     except Exception as e:
@@ -463,18 +708,26 @@ class MyVanna(Milvus_VectorStore, OpenAI_Chat):
             # 兼容原版后缀
             elif id.endswith("-sql"):
                 self.milvus_client.delete(collection_name="vannasql", ids=[id])
+                self._invalidate_counts("vannasql")
+                self.notify_training_changed()
                 logger.info(f"Successfully deleted ID from vannasql: {id}")
                 return True
             elif id.endswith("-ddl"):
                 self.milvus_client.delete(collection_name="vannaddl", ids=[id])
+                self._invalidate_counts("vannaddl")
+                self.notify_training_changed()
                 logger.info(f"Successfully deleted ID from vannaddl: {id}")
                 return True
             elif id.endswith("-doc"):
                 self.milvus_client.delete(collection_name="vannadoc", ids=[id])
+                self._invalidate_counts("vannadoc")
+                self.notify_training_changed()
                 logger.info(f"Successfully deleted ID from vannadoc: {id}")
                 return True
             elif id.endswith("-plan"):
                 self.milvus_client.delete(collection_name="vannaplan", ids=[id])
+                self._invalidate_counts("vannaplan")
+                self.notify_training_changed()
                 logger.info(f"Successfully deleted ID from vannaplan: {id}")
                 return True
             else:
@@ -486,6 +739,39 @@ class MyVanna(Milvus_VectorStore, OpenAI_Chat):
             return False
 
 
+    def delete_by_db_name(self, db_name: str, collections: Optional[List[str]] = None) -> Dict[str, int]:
+        """
+        删除某个数据库的全部训练数据（每个集合一次过滤表达式删除，由 Milvus 服务端完成）
+
+        Args:
+            db_name: 数据库名称
+            collections: 要清理的集合（默认 vannasql / vannaddl / vannadoc / vannaplan）
+
+        Returns:
+            Dict[str, int]: 每个集合删除的记录数
+
+        Raises:
+            ValueError: db_name 为空或集合名称无效
+        """
+        if not db_name:
+            raise ValueError("db_name can not be empty")
+        collections = collections or list(TRAINING_COLLECTIONS)
+        invalid = [name for name in collections if name not in TRAINING_COLLECTIONS]
+        if invalid:
+            raise ValueError(f"Invalid collections: {invalid}")
+
+        filter_expr = self._db_name_filter(db_name)
+        deleted = {}
+        for collection_name in collections:
+            result = self.milvus_client.delete(collection_name=collection_name, filter=filter_expr)
+            # pymilvus 返回被删除的主键列表，或 {"delete_count": n}
+            deleted[collection_name] = len(result) if isinstance(result, list) else int(result.get("delete_count", 0))
+            self._invalidate_counts(collection_name)
+        self.notify_training_changed(db_name)
+
+        logger.info(f"Deleted training data of db_name={db_name}: {deleted}")
+        return deleted
+
 # ==================== 客户端工厂函数 ====================
 def create_vanna_client(
     # 必填参数：LLM 配置
@@ -500,8 +786,27 @@ def create_vanna_client(
     embedding_provider: Literal["jina", "qwen", "bge"] = "jina",
     embedding_api_key: str = None,
     embedding_model_name: str = None,
+    # 可选参数：查询向量缓存
+    embedding_query_cache_size: int = 1024,
+    embedding_query_cache_ttl: float = 3600,
+    # 可选参数：批量向量化
+    embedding_max_batch_size: int = None,
+    embedding_max_concurrency: int = 4,
+    # 可选参数：文档向量持久化存储
+    embedding_store_path: str = None,
+    # 可选参数：查询结果上限
+    sql_max_rows: int = 100_000,
+    sql_max_bytes: int = 256 * 1024 * 1024,
+    # 可选参数：查询结果缓存
+    sql_result_cache_ttl: float = 60,
+    sql_result_cache_max_bytes: int = 64 * 1024 * 1024,
     # 可选参数：Milvus 度量方式
     metric_type: str = "COSINE",
+    # 可选参数：MySQL 连接池
+    mysql_pool_size: int = 8,
+    mysql_pool_min_idle: int = 1,
+    mysql_pool_max_lifetime: float = 1800,
+    mysql_pool_timeout: float = 30,
     # 可选参数：LLM 生成参数（有合理默认值）
     temperature: float = 0.2,
     max_tokens: int = 14000,
@@ -525,7 +830,20 @@ def create_vanna_client(
         embedding_provider: 嵌入模型提供商 ("jina" | "qwen" | "bge")，默认 "jina"
         embedding_api_key: 嵌入模型 API 密钥（本地部署可不填）
         embedding_model_name: 嵌入模型名称（不传则使用默认）
+        embedding_query_cache_size: 查询向量缓存的最大条目数（<= 0 表示禁用），默认 1024
+        embedding_query_cache_ttl: 查询向量缓存的存活时间（秒），默认 3600
+        embedding_max_batch_size: 单次向量化请求的最大文本数，默认使用提供商的上限
+        embedding_max_concurrency: 批量向量化时的最大并发请求数，默认 4
+        embedding_store_path: 文档向量存储的 SQLite 文件路径（重新导入时复用已有向量），默认不启用
+        sql_max_rows: run_sql 最多读取的行数（<= 0 表示不限制），默认 100000
+        sql_max_bytes: run_sql 读取结果的估算字节数上限（<= 0 表示不限制），默认 256MB
+        sql_result_cache_ttl: 只读查询结果的缓存时间（秒，<= 0 表示禁用），默认 60
+        sql_result_cache_max_bytes: 查询结果缓存的总字节数上限，默认 64MB
         metric_type: 向量相似度度量方式 ('COSINE' | 'L2' | 'IP')，默认 'COSINE'
+        mysql_pool_size: 每个数据库的最大连接数，默认 8
+        mysql_pool_min_idle: 每个数据库的最小空闲连接数，默认 1
+        mysql_pool_max_lifetime: 连接最大存活时间（秒），默认 1800
+        mysql_pool_timeout: 等待空闲连接超时（秒），默认 30
         temperature: LLM 温度参数，默认 0.2
         max_tokens: LLM 最大 token 数，默认 14000
         dialect: SQL 方言，默认 "MySQL"
@@ -561,6 +879,11 @@ def create_vanna_client(
         api_url=embedding_api_url,
         api_key=embedding_api_key,
         model_name=embedding_model_name,
+        query_cache_size=embedding_query_cache_size,
+        query_cache_ttl=embedding_query_cache_ttl,
+        max_batch_size=embedding_max_batch_size,
+        max_concurrency=embedding_max_concurrency,
+        document_store_path=embedding_store_path,
     )
     
     logger.info(f"Apply Embedding: {embedding_provider.upper()} ({embedding_api_url})")
@@ -586,6 +909,14 @@ def create_vanna_client(
         'dialect': dialect,
         'language': language,
         'metric_type': metric_type,
+        'mysql_pool_size': mysql_pool_size,
+        'mysql_pool_min_idle': mysql_pool_min_idle,
+        'mysql_pool_max_lifetime': mysql_pool_max_lifetime,
+        'mysql_pool_timeout': mysql_pool_timeout,
+        'sql_max_rows': sql_max_rows,
+        'sql_max_bytes': sql_max_bytes,
+        'sql_result_cache_ttl': sql_result_cache_ttl,
+        'sql_result_cache_max_bytes': sql_result_cache_max_bytes,
     })
     
     vn.client = openai_client
@@ -1,6 +1,6 @@
 """
 中间件模块
-包含 LLM 调用追踪、工具调用追踪和 UI 事件注入
+包含 LLM 调用追踪、工具调用追踪、UI 事件注入和上下文预取
 """
 
 import logging
@@ -15,8 +15,12 @@ from .ui_events_middleware import (
     ui_tool_trace,
     RUN_UI_EVENTS,
     CURRENT_QUESTION,
+    configure_tool_descriptions,
 )
 
+from .prompt_middleware import mysql_capabilities_prompt
+from .prefetch_middleware import context_prefetch
+
 __all__ = [
     'trace_model_call',
     'trace_tool_call',
@@ -24,4 +28,7 @@ __all__ = [
     'ui_tool_trace',
     'RUN_UI_EVENTS',
     'CURRENT_QUESTION',
+    'configure_tool_descriptions',
+    'mysql_capabilities_prompt',
+    'context_prefetch',
 ]
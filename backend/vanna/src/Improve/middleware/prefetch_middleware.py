@@ -0,0 +1,130 @@
+"""
+上下文预取中间件
+每个问题开始时，Agent 都要依次调用 check_mysql_version、get_all_tables_info、get_table_schema，
+每个工具调用都是一次完整的 LLM 往返，而这些工具的输入（用户问题）在开始前就已确定。
+
+这里在第一次 LLM 调用之前并发执行这三个工具，把结果作为已完成的工具调用
+（一条带 tool_calls 的 AIMessage + 对应的 ToolMessage）写入消息列表，
+第一轮 LLM 即可直接生成 SQL
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+import contextvars
+import json
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain.agents.middleware import before_agent, AgentState  # type: ignore
+from langchain_core.messages import AIMessage, ToolMessage  # type: ignore
+from langgraph.runtime import Runtime  # type: ignore
+
+from ..tools.database_tools import check_mysql_version, get_all_tables_info
+from ..tools.rag_tools import get_table_schema
+from ..shared.tracing import get_tracer, set_span_attributes
+from ..shared.metrics import TOOL_DURATION
+from .ui_events_middleware import _brief, _get_fallback_description
+
+
+# 预取的工具（工具, 是否以用户问题为参数）
+_PREFETCH_TOOLS = [
+    (check_mysql_version, False),
+    (get_all_tables_info, True),
+    (get_table_schema, True),
+]
+
+
+def _last_question(messages: List[Any]) -> Optional[str]:
+    """本次 run 的用户问题（最后一条消息是用户消息时）"""
+    if not messages or getattr(messages[-1], "type", "") != "human":
+        return None
+    content = getattr(messages[-1], "content", "")
+    return content if isinstance(content, str) and content.strip() else None
+
+
+def _run_tool(tool, args: Dict[str, Any]) -> Tuple[str, float]:
+    """执行工具，返回 (输出文本, 耗时 ms)；工具异常时输出错误信息，由模型决定是否重试"""
+    t0 = time.time()
+    status = "ok"
+    with get_tracer().span(f"tool.{tool.name}", kind="tool", tool=tool.name, prefetched=True) as span:
+        try:
+            output = str(tool.invoke(args))
+        except Exception as e:
+            logger.warning(f"[Prefetch] {tool.name} failed: {e}")
+            output = f"{tool.name} 执行失败: {e}"
+            status = "error"
+        set_span_attributes(span, output_chars=len(output))
+    TOOL_DURATION.observe(time.time() - t0, tool=tool.name, status=status)
+    return output, (time.time() - t0) * 1000
+
+
+def prefetch_messages(question: str) -> List[Any]:
+    """
+    并发执行预取工具，构造对应的工具调用消息
+
+    Args:
+        question: 用户问题
+
+    Returns:
+        [AIMessage(tool_calls), ToolMessage, ...]
+    """
+    calls = []
+    for tool, takes_question in _PREFETCH_TOOLS:
+        args = {"question": question} if takes_question else {}
+        calls.append({
+            "name": tool.name,
+            "args": args,
+            "id": f"prefetch_{tool.name}_{uuid.uuid4().hex[:8]}",
+            "type": "tool_call",
+        })
+
+    t0 = time.time()
+    with get_tracer().span("prefetch", kind="internal", tools=len(calls)):
+        with ThreadPoolExecutor(max_workers=len(calls), thread_name_prefix="agent-prefetch") as pool:
+            # 每个任务使用独立的上下文副本（工具依赖 run ID / 目标数据库 / 当前 span 等 contextvars）
+            futures = [
+                pool.submit(contextvars.copy_context().run, _run_tool, tool, call["args"])
+                for (tool, _), call in zip(_PREFETCH_TOOLS, calls)
+            ]
+            results = [f.result() for f in futures]
+    logger.info(f"[Prefetch] {len(calls)} tools finished in {(time.time() - t0) * 1000:.1f} ms")
+
+    messages: List[Any] = [AIMessage(content="", tool_calls=calls, additional_kwargs={"prefetched": True})]
+    for call, (output, duration_ms) in zip(calls, results):
+        title = _get_fallback_description(call["name"], call["args"])
+        now = time.time()
+        ui_events = [
+            {
+                "kind": "tool_start",
+                "name": call["name"],
+                "title": title,
+                "args_brief": _brief(json.dumps(call["args"], ensure_ascii=False)),
+                "ts": now - duration_ms / 1000,
+            },
+            {
+                "kind": "tool_end",
+                "name": call["name"],
+                "title": f"{title}完成",
+                "duration_ms": round(duration_ms, 1),
+                "output_brief": _brief(output),
+                "ts": now,
+            },
+        ]
+        messages.append(ToolMessage(
+            content=output,
+            name=call["name"],
+            tool_call_id=call["id"],
+            additional_kwargs={"prefetched": True, "ui_events": ui_events},
+        ))
+    return messages
+
+
+@before_agent
+def context_prefetch(state: AgentState, runtime: Runtime) -> Optional[Dict[str, Any]]:
+    """在第一次 LLM 调用前预取数据库版本、表信息和 RAG 上下文"""
+    question = _last_question(state.get("messages", []))
+    if question is None:
+        return None
+    return {"messages": prefetch_messages(question)}
@@ -0,0 +1,25 @@
+"""
+系统提示词中间件
+把已探测的数据库环境（版本、CTE/窗口函数支持、ONLY_FULL_GROUP_BY）追加到系统提示词，
+Agent 无需再调用 check_mysql_version 工具
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+from langchain.agents.middleware import dynamic_prompt  # type: ignore
+from langchain.agents.middleware import ModelRequest  # type: ignore
+
+from ..shared import get_vanna_client, get_capability_registry
+
+
+@dynamic_prompt
+def mysql_capabilities_prompt(request: ModelRequest) -> str:
+    """在系统提示词末尾追加当前数据库环境（按主机缓存，首次使用时探测一次）"""
+    base_prompt = request.system_prompt or ""
+    try:
+        caps = get_capability_registry().get(get_vanna_client())
+    except Exception as e:
+        # 探测失败时保持原提示词，Agent 仍可调用 check_mysql_version
+        logger.debug(f"[CapabilityPrompt] MySQL capabilities unavailable: {e}")
+        return base_prompt
+    return f"{base_prompt}\n\n{caps.prompt_section()}"
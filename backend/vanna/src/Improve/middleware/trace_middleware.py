@@ -1,6 +1,6 @@
 """
 追踪中间件
-用于调试和监控 Agent 的执行过程
+用于调试和监控 Agent 的执行过程（日志 + 链路追踪的 llm / tool span + LLM / 工具耗时指标）
 """
 
 import logging
@@ -12,6 +12,9 @@ from langchain.agents.middleware import wrap_model_call, wrap_tool_call  # type:
 from langchain.agents.middleware import ModelRequest, ModelResponse  # type: ignore
 from langchain_core.messages import AIMessage  # type: ignore
 
+from ..shared.tracing import get_tracer, set_span_attributes
+from ..shared.metrics import LLM_DURATION, LLM_TOKENS, TOOL_DURATION
+
 
 def _print_message(i, msg):
     """打印单条消息的辅助函数"""
@@ -64,13 +67,22 @@ def trace_model_call(
         _print_message(len(messages) - 1, messages[-1])
     
     # 执行真正的模型调用
-    resp = handler(request)
+    status = "error"
+    try:
+        with get_tracer().span("llm", kind="llm", messages=len(messages)) as span:
+            resp = handler(request)
+            ai_message = getattr(resp, "message", resp)
+            if isinstance(resp, ModelResponse):
+                ai_message = next((m for m in resp.result if isinstance(m, AIMessage)), ai_message)
+            _set_llm_span(span, ai_message)
+        status = "ok"
+    finally:
+        LLM_DURATION.observe(time.time() - t0, status=status)
     
     dt = (time.time() - t0) * 1000
     logger.info(f"\n [LLM END] {dt:.1f} ms")
     
     # 打印 AI 响应
-    ai_message = getattr(resp, "message", resp)
     if isinstance(ai_message, AIMessage):
         content = ai_message.content or ""
         logger.info(f"AIMessage content:\n{content[:100]}{'...' if len(content) > 100 else ''}")
@@ -87,6 +99,23 @@ def trace_model_call(
     return resp
 
 
+def _set_llm_span(span, ai_message):
+    """LLM span 属性：token 数（模型返回 usage 时）、工具调用数、输出字符数；同时记录 token 数指标"""
+    if not isinstance(ai_message, AIMessage):
+        return
+    usage = getattr(ai_message, "usage_metadata", None) or {}
+    for kind in ("input", "output"):
+        if usage.get(f"{kind}_tokens") is not None:
+            LLM_TOKENS.observe(usage[f"{kind}_tokens"], type=kind)
+    set_span_attributes(span,
+        input_tokens=usage.get("input_tokens"),
+        output_tokens=usage.get("output_tokens"),
+        total_tokens=usage.get("total_tokens"),
+        tool_calls=len(ai_message.tool_calls or []),
+        output_chars=len(ai_message.content or "") if isinstance(ai_message.content, str) else None,
+    )
+
+
 @wrap_tool_call
 def trace_tool_call(
     request,
@@ -117,17 +146,23 @@ def trace_tool_call(
     logger.info(f"Args:\n{args_str[:600]}{'...' if len(args_str) > 600 else ''}")
     
     t0 = time.time()
-    result = handler(request)
+    status = "error"
+    try:
+        with get_tracer().span(f"tool.{tool_name}", kind="tool", tool=tool_name) as span:
+            result = handler(request)
+            # 打印工具输出
+            if hasattr(result, "content"):
+                preview = str(result.content)
+            else:
+                preview = str(result)
+            set_span_attributes(span, output_chars=len(preview))
+        status = "ok"
+    finally:
+        TOOL_DURATION.observe(time.time() - t0, tool=tool_name, status=status)
     dt = (time.time() - t0) * 1000
     
     logger.info(f"\n[TOOL END] {dt:.1f} ms")
     
-    # 打印工具输出
-    if hasattr(result, "content"):
-        preview = str(result.content)
-    else:
-        preview = str(result)
-    
     if is_compact:
         # 精简打印：显示摘要
         _print_compact_output(tool_name, preview)
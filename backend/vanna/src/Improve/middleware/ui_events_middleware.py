@@ -1,18 +1,28 @@
 """
 UI 事件中间件
 在 LLM 返回时自动注入工具调用的简略描述到 AIMessage.additional_kwargs["ui_events"]
-使用 LLM 自动生成工具调用的简洁描述（包含调用原因）
+
+工具描述先使用模板（不阻塞工具执行）；启用 LLM 描述时，在后台线程中生成
+更具体的描述（包含调用原因），通过 LangGraph 的 custom 流推送（{"kind": "tool_label", ...}），
+按 (工具名, 参数形态, 用户问题) 缓存，同一问题下相同形态的调用不再请求 LLM
+（描述中的调用原因来自用户问题，不能在不同问题之间共用）
 """
 
 import logging
 logger = logging.getLogger(__name__)
+import hashlib
 import json
+import re
+import threading
 import time
 import contextvars
-from typing import Callable, Any, List, Dict
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Any, List, Dict, Optional, Tuple
 from langchain.agents.middleware import wrap_model_call, wrap_tool_call # type: ignore
 from langchain.agents.middleware import ModelRequest, ModelResponse # type: ignore
 from langchain_core.messages import AIMessage # type: ignore
+from langgraph.config import get_stream_writer # type: ignore
 
 # 导入共享的 LLM 实例
 from ..shared import get_llm_instance
@@ -29,6 +39,102 @@ CURRENT_QUESTION: contextvars.ContextVar[str] = contextvars.ContextVar(
 )
 
 
+# LLM 描述：后台线程池 + (工具名, 参数形态, 问题哈希) -> 描述 的 LRU 缓存
+_DESCRIPTION_LLM_ENABLED = True
+_DESCRIPTION_CACHE_SIZE = 256
+_description_cache: "OrderedDict[Tuple[str, str, str], str]" = OrderedDict()
+_description_pending: Dict[Tuple[str, str, str], Future] = {}
+_description_lock = threading.Lock()
+_description_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="tool-description")
+
+# 参数形态：字符串 / 数字字面量替换为 ?，空白合并，小写
+_QUOTED = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_SPACES = re.compile(r"\s+")
+
+
+def configure_tool_descriptions(llm_enabled: bool = True, cache_size: int = 256):
+    """
+    配置工具描述的生成方式
+
+    Args:
+        llm_enabled: 是否在后台用 LLM 生成更具体的描述（False 时只使用模板描述）
+        cache_size: LLM 描述缓存的条目数
+    """
+    global _DESCRIPTION_LLM_ENABLED, _DESCRIPTION_CACHE_SIZE
+    _DESCRIPTION_LLM_ENABLED = llm_enabled
+    _DESCRIPTION_CACHE_SIZE = cache_size
+    with _description_lock:
+        while len(_description_cache) > cache_size:
+            _description_cache.popitem(last=False)
+
+
+def _args_shape(args: dict) -> str:
+    """参数形态（去掉字面量的规范化参数），作为描述缓存键的一部分"""
+    shape = {}
+    for key in sorted(args or {}):
+        value = str(args[key])
+        value = _NUMBER.sub("?", _QUOTED.sub("?", value))
+        shape[key] = _SPACES.sub(" ", value).strip().lower()[:200]
+    return json.dumps(shape, ensure_ascii=False, sort_keys=True)
+
+
+def _question_hash(question: str) -> str:
+    """用户问题的哈希（规范化空白），作为描述缓存键的一部分"""
+    normalized = _SPACES.sub(" ", question or "").strip().lower()
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:16]
+
+
+def _cached_description(key: Tuple[str, str, str]) -> Optional[str]:
+    with _description_lock:
+        description = _description_cache.get(key)
+        if description is not None:
+            _description_cache.move_to_end(key)
+        return description
+
+
+def _describe_in_background(key: Tuple[str, str, str], tool_name: str, args: dict, user_question: str) -> Future:
+    """提交后台 LLM 描述任务（同一缓存键只请求一次）"""
+    with _description_lock:
+        future = _description_pending.get(key)
+        if future is not None:
+            return future
+        future = _description_executor.submit(_generate_tool_description_by_llm, tool_name, args, user_question)
+        _description_pending[key] = future
+
+    def remember(f: Future):
+        with _description_lock:
+            _description_pending.pop(key, None)
+            description = None if f.cancelled() or f.exception() else f.result()
+            # 降级为模板描述时不缓存，下次仍可尝试 LLM
+            if description and description != _get_fallback_description(tool_name, args):
+                _description_cache[key] = description
+                while len(_description_cache) > _DESCRIPTION_CACHE_SIZE:
+                    _description_cache.popitem(last=False)
+
+    future.add_done_callback(remember)
+    return future
+
+
+def _push_label(future: Future, writer: Callable, tool_name: str, tool_call_id: Optional[str], template: str):
+    """LLM 描述生成后推送 tool_label 事件（run 已结束时写入会被忽略）"""
+    # writer 需要在 Agent run 的上下文中调用（读取当前 run 的配置）
+    ctx = contextvars.copy_context()
+
+    def push(f: Future):
+        if f.cancelled() or f.exception():
+            return
+        description = f.result()
+        if not description or description == template:
+            return
+        try:
+            ctx.run(writer, {"kind": "tool_label", "name": tool_name, "tool_call_id": tool_call_id, "title": description})
+        except Exception as e:
+            logger.debug(f"推送工具描述失败: {e}")
+
+    future.add_done_callback(push)
+
+
 def _brief(txt: Any, limit=160) -> str:
     """截断文本用于简略显示"""
     s = str(txt or "").replace("\n", " ")
@@ -109,37 +215,63 @@ def _get_fallback_description(tool_name: str, args: dict) -> str:
     return tool_map.get(tool_name, f'执行{tool_name}')
 
 
-# 1) 工具调用中间件：使用 LLM 生成简述
+def _tool_description(tool_name: str, tool_args: dict, tool_call_id: Optional[str]) -> str:
+    """
+    工具调用的 UI 描述（不阻塞工具执行）
+
+    返回缓存的 LLM 描述或模板描述；启用 LLM 描述且未命中缓存时，
+    后台生成的描述通过 custom 流以 tool_label 事件推送
+    """
+    template = _get_fallback_description(tool_name, tool_args)
+    if not _DESCRIPTION_LLM_ENABLED:
+        return template
+
+    user_question = CURRENT_QUESTION.get() or "未知问题"
+    key = (tool_name, _args_shape(tool_args), _question_hash(user_question))
+    cached = _cached_description(key)
+    if cached is not None:
+        return cached
+
+    try:
+        writer = get_stream_writer()
+    except Exception:
+        # 不在 Agent run 中（无法推送更新），只使用模板描述
+        return template
+    future = _describe_in_background(key, tool_name, tool_args, user_question)
+    _push_label(future, writer, tool_name, tool_call_id, template)
+    return template
+
+
+# 1) 工具调用中间件：模板描述 + 后台 LLM 描述
 @wrap_tool_call
 def ui_tool_trace(
     request,
     handler: Callable,
 ) -> Any:
-    """拦截工具调用，使用 LLM 生成 UI 事件描述"""
+    """拦截工具调用，记录 UI 事件（描述生成不在工具执行的关键路径上）"""
     
     # 从 request 中提取工具名和参数
     tool_call = getattr(request, "tool_call", None)
     if tool_call:
         tool_name = tool_call.get("name", "unknown")
         tool_args = tool_call.get("args", {})
+        tool_call_id = tool_call.get("id")
     else:
         tool_name = getattr(request, "tool_name", "unknown")
         tool_args = getattr(request, "tool_input", {})
-    
-    # 获取用户问题
-    user_question = CURRENT_QUESTION.get() or "未知问题"
+        tool_call_id = None
     
     t0 = time.time()
     
-    # 使用 LLM 生成友好描述（包含原因）
-    description = _generate_tool_description_by_llm(tool_name, tool_args, user_question)
+    # 模板描述（或缓存的 LLM 描述）；LLM 描述在后台生成后单独推送
+    description = _tool_description(tool_name, tool_args, tool_call_id)
     
     # 记录开始事件
     events = RUN_UI_EVENTS.get()
     events.append({
         "kind": "tool_start",
         "name": tool_name,
-        "title": description,  # LLM 生成的描述
+        "title": description,
         "args_brief": _brief(json.dumps(tool_args, ensure_ascii=False)),
         "ts": time.time()
     })
@@ -280,4 +412,4 @@ def ui_model_trace(
 
 
 # 导出中间件
-__all__ = ['ui_tool_trace', 'ui_model_trace', 'RUN_UI_EVENTS', 'CURRENT_QUESTION']
+__all__ = ['ui_tool_trace', 'ui_model_trace', 'RUN_UI_EVENTS', 'CURRENT_QUESTION', 'configure_tool_descriptions']
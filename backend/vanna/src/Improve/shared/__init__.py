@@ -12,11 +12,43 @@ from .context import (
     set_llm_instance,
     get_llm_instance,
     get_mysql_version_cache,
-    set_mysql_version_cache,
     clear_mysql_version_cache,
     set_last_query_result,
     get_last_query_result,
     clear_last_query_result,
+    set_current_run_id,
+    get_current_run_id,
+    set_current_db_name,
+    get_current_db_name,
+)
+from .schema_catalog import (
+    SchemaCatalog,
+    SchemaSnapshot,
+    get_schema_catalog,
+    set_schema_catalog,
+    get_current_database,
+)
+from .mysql_capabilities import (
+    MySQLCapabilities,
+    CapabilityRegistry,
+    get_capability_registry,
+)
+from .tracing import (
+    Tracer,
+    RunTraceStore,
+    create_jsonl_exporter,
+    create_otlp_exporter,
+    set_span_attributes,
+    get_tracer,
+    set_tracer,
+)
+from .metrics import (
+    Counter,
+    Gauge,
+    Histogram,
+    MetricsRegistry,
+    render_metrics,
+    update_runtime_gauges,
 )
 
 __all__ = [
@@ -27,9 +59,33 @@ __all__ = [
     'set_llm_instance',
     'get_llm_instance',
     'get_mysql_version_cache',
-    'set_mysql_version_cache',
     'clear_mysql_version_cache',
     'set_last_query_result',
     'get_last_query_result',
     'clear_last_query_result',
+    'set_current_run_id',
+    'get_current_run_id',
+    'set_current_db_name',
+    'get_current_db_name',
+    'SchemaCatalog',
+    'SchemaSnapshot',
+    'get_schema_catalog',
+    'set_schema_catalog',
+    'get_current_database',
+    'MySQLCapabilities',
+    'CapabilityRegistry',
+    'get_capability_registry',
+    'Tracer',
+    'RunTraceStore',
+    'create_jsonl_exporter',
+    'create_otlp_exporter',
+    'set_span_attributes',
+    'get_tracer',
+    'set_tracer',
+    'Counter',
+    'Gauge',
+    'Histogram',
+    'MetricsRegistry',
+    'render_metrics',
+    'update_runtime_gauges',
 ]
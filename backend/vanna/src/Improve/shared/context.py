@@ -4,14 +4,34 @@
 """
 import logging
 logger = logging.getLogger(__name__)
-from typing import Optional
+import os
+import time
+import threading
+import contextvars
+from typing import Optional, Dict, Tuple
+
+from .mysql_capabilities import get_capability_registry
 
 # ==================== 全局单例变量 ====================
 _vanna_client: Optional[any] = None
 _api_key: Optional[str] = None
-_mysql_version_cache: Optional[str] = None  # 缓存 MySQL 版本信息
 _llm_instance: Optional[any] = None  # 全局 LLM 实例（避免重复创建）
-_last_query_result: Optional[any] = None  # 缓存最后一次查询结果（DataFrame）
+_last_query_result: Optional[any] = None  # 无 run 上下文时的查询结果（CLI 等单用户场景）
+
+# ==================== Run 级上下文 ====================
+# 当前 agent run 的 ID（由 AgentRunner 在工作线程中设置，LangGraph 会把上下文复制到工具线程）
+_CURRENT_RUN_ID: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "CURRENT_RUN_ID", default=None
+)
+# 当前 agent run 的目标数据库（None 表示使用 Vanna 客户端的默认数据库）
+_CURRENT_DB_NAME: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "CURRENT_DB_NAME", default=None
+)
+
+# run_id -> (DataFrame, 写入时间)，按 TTL 淘汰未被取走的结果
+_run_query_results: Dict[str, Tuple[any, float]] = {}
+_run_query_results_lock = threading.Lock()
+QUERY_RESULT_TTL = float(os.getenv("QUERY_RESULT_TTL", "600"))
 
 
 # ==================== Vanna 客户端管理 ====================
@@ -85,46 +105,109 @@ def get_llm_instance():
 # ==================== MySQL 版本缓存管理 ====================
 
 def get_mysql_version_cache() -> Optional[str]:
-    """获取缓存的 MySQL 版本信息"""
-    return _mysql_version_cache
+    """获取当前数据库已缓存的版本信息（按主机缓存，未探测过时返回 None）"""
+    if _vanna_client is None:
+        return None
+    caps = get_capability_registry().peek(_vanna_client)
+    return caps.describe() if caps else None
 
 
-def set_mysql_version_cache(version_info: str):
-    """设置 MySQL 版本缓存"""
-    global _mysql_version_cache
-    _mysql_version_cache = version_info
+def clear_mysql_version_cache():
+    """清除 MySQL 版本缓存（下次使用时重新探测）"""
+    get_capability_registry().clear()
 
 
-def clear_mysql_version_cache():
-    """清除 MySQL 版本缓存"""
-    global _mysql_version_cache
-    _mysql_version_cache = None
+# ==================== Run 上下文管理 ====================
+
+def set_current_run_id(run_id: Optional[str]):
+    """设置当前上下文的 run ID
+
+    Args:
+        run_id: agent run 的唯一 ID（None 表示退出 run 上下文）
+    """
+    _CURRENT_RUN_ID.set(run_id)
+
+
+def get_current_run_id() -> Optional[str]:
+    """获取当前上下文的 run ID，不在 run 中时返回 None"""
+    return _CURRENT_RUN_ID.get()
+
+
+def set_current_db_name(db_name: Optional[str]):
+    """设置当前上下文的目标数据库（run_sql 据此选择连接池）
+
+    Args:
+        db_name: 数据库名称（None 表示使用默认数据库）
+    """
+    _CURRENT_DB_NAME.set(db_name)
+
+
+def get_current_db_name() -> Optional[str]:
+    """获取当前上下文的目标数据库，未指定时返回 None"""
+    return _CURRENT_DB_NAME.get()
 
 
 # ==================== 查询结果缓存管理 ====================
 
-def set_last_query_result(df):
+def _evict_expired_query_results(now: float):
+    """淘汰过期的 run 查询结果（调用方需持有锁）"""
+    expired = [k for k, (_, ts) in _run_query_results.items() if now - ts > QUERY_RESULT_TTL]
+    for k in expired:
+        del _run_query_results[k]
+    if expired:
+        logger.info(f"[查询缓存] 已淘汰 {len(expired)} 个过期 run 结果")
+
+
+def set_last_query_result(df, run_id: Optional[str] = None):
     """缓存最后一次查询结果
 
+    在 agent run 中（或显式传入 run_id）时按 run 隔离存储，
+    否则退化为进程级全局变量。
+
     Args:
         df: pandas DataFrame 查询结果
+        run_id: run ID（可选，默认取当前上下文）
     """
     global _last_query_result
-    _last_query_result = df
-    logger.info(f"[查询缓存] 已缓存查询结果，行数: {len(df) if df is not None else 0}")
-
-
-def get_last_query_result():
+    run_id = run_id or get_current_run_id()
+    if run_id is None:
+        _last_query_result = df
+    else:
+        now = time.time()
+        with _run_query_results_lock:
+            _evict_expired_query_results(now)
+            _run_query_results[run_id] = (df, now)
+    logger.info(f"[查询缓存] 已缓存查询结果 (run: {run_id})，行数: {len(df) if df is not None else 0}")
+
+
+def get_last_query_result(run_id: Optional[str] = None):
     """获取最后一次查询结果
 
+    Args:
+        run_id: run ID（可选，默认取当前上下文）
+
     Returns:
         pandas DataFrame 或 None
     """
-    return _last_query_result
+    run_id = run_id or get_current_run_id()
+    if run_id is None:
+        return _last_query_result
+    with _run_query_results_lock:
+        entry = _run_query_results.get(run_id)
+    return entry[0] if entry else None
 
 
-def clear_last_query_result():
-    """清除查询结果缓存"""
+def clear_last_query_result(run_id: Optional[str] = None):
+    """清除查询结果缓存
+
+    Args:
+        run_id: run ID（可选，默认取当前上下文）
+    """
     global _last_query_result
-    _last_query_result = None
-    logger.info("[查询缓存] 已清除查询结果缓存")
+    run_id = run_id or get_current_run_id()
+    if run_id is None:
+        _last_query_result = None
+    else:
+        with _run_query_results_lock:
+            _run_query_results.pop(run_id, None)
+    logger.info(f"[查询缓存] 已清除查询结果缓存 (run: {run_id})")
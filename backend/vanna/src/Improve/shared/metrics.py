@@ -0,0 +1,242 @@
+"""
+Prometheus 指标
+/health 只能看到各组件是否初始化，看不出延迟分布。这里维护进程内的计数器、仪表和直方图，
+由中间件和 MyVanna 中的埋点更新，/metrics 接口按 Prometheus 文本格式（0.0.4）输出：
+
+- 直方图：对话端到端延迟、工具耗时、LLM 调用耗时和 token 数、嵌入耗时、Milvus 检索耗时、SQL 耗时和行数
+- 仪表：运行中 / 排队的 Agent run、连接池连接数（抓取时从各组件的 stats() 读取）
+
+不依赖 prometheus_client；埋点只做加锁的计数，不在 trace 中时同样记录
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+
+# 延迟直方图的默认分桶（秒）：覆盖毫秒级的缓存命中到分钟级的 Agent run
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# 数量类直方图（token 数、行数）
+COUNT_BUCKETS = (1, 10, 100, 1_000, 10_000, 100_000, 1_000_000)
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[Any], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    """指标基类：按标签值分组保存数据"""
+
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple("" if labels[n] is None else str(labels[n]) for n in self.labelnames)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {_escape(self.documentation)}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key: Tuple[str, ...], value: Any) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    """单调递增的计数"""
+
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """可增可减的当前值"""
+
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """
+    分桶计数的观测值分布（输出 _bucket / _sum / _count）
+
+    使用示例:
+        SQL_DURATION.observe(0.12, db_name="sales", cache="miss")
+        with TOOL_DURATION.time(tool="execute_sql"):
+            ...
+    """
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [各桶计数（非累计，最后一个为 +Inf）, 总和, 次数]
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """记录代码块耗时（秒，异常时同样记录）"""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def _render_sample(self, key: Tuple[str, ...], value: Any) -> List[str]:
+        counts, total, count = value
+        lines = []
+        cumulative = 0
+        for bound, n in zip(self.buckets + (math.inf,), counts):
+            cumulative += n
+            le = f'le="{_format_value(bound)}"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """指标集合，按注册顺序输出"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """Prometheus 文本格式"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# ==================== 全局指标 ====================
+
+REGISTRY = MetricsRegistry()
+
+CHAT_DURATION = REGISTRY.histogram(
+    "nl2sql_chat_duration_seconds", "End-to-end chat request latency", ["endpoint", "outcome"])
+TOOL_DURATION = REGISTRY.histogram(
+    "nl2sql_tool_duration_seconds", "Agent tool call latency", ["tool", "status"])
+LLM_DURATION = REGISTRY.histogram(
+    "nl2sql_llm_duration_seconds", "Agent LLM call latency", ["status"])
+LLM_TOKENS = REGISTRY.histogram(
+    "nl2sql_llm_tokens", "Tokens per agent LLM call", ["type"], buckets=COUNT_BUCKETS)
+EMBEDDING_DURATION = REGISTRY.histogram(
+    "nl2sql_embedding_duration_seconds", "Embedding request latency (all batches of one call)", ["provider"])
+MILVUS_SEARCH_DURATION = REGISTRY.histogram(
+    "nl2sql_milvus_search_duration_seconds", "Milvus retrieval search latency", ["collection"])
+SQL_DURATION = REGISTRY.histogram(
+    "nl2sql_sql_duration_seconds", "SQL execution latency", ["db_name", "cache"])
+SQL_ROWS = REGISTRY.histogram(
+    "nl2sql_sql_rows", "Rows returned per SQL execution", ["db_name"], buckets=COUNT_BUCKETS)
+
+AGENT_RUNS = REGISTRY.gauge(
+    "nl2sql_agent_runs", "Agent runs by state (running / queued)", ["state"])
+MYSQL_POOL_CONNECTIONS = REGISTRY.gauge(
+    "nl2sql_mysql_pool_connections", "MySQL pool connections by state (idle / in_use)", ["database", "state"])
+MYSQL_POOL_SIZE = REGISTRY.gauge(
+    "nl2sql_mysql_pool_size", "Configured MySQL pool size", ["database"])
+
+
+def update_runtime_gauges(agent_stats: Optional[Dict[str, Any]] = None,
+                          pool_stats: Optional[List[Dict[str, Any]]] = None):
+    """
+    根据各组件的 stats() 刷新仪表（抓取 /metrics 时调用）
+
+    Args:
+        agent_stats: AgentRunner.stats()
+        pool_stats: MyVanna.mysql_pool_stats()
+    """
+    if agent_stats is not None:
+        AGENT_RUNS.set(agent_stats.get("running", 0), state="running")
+        AGENT_RUNS.set(agent_stats.get("queue_depth", 0), state="queued")
+    if pool_stats is not None:
+        # 连接池关闭后不再输出
+        MYSQL_POOL_CONNECTIONS.clear()
+        MYSQL_POOL_SIZE.clear()
+        for pool in pool_stats:
+            database = pool.get("database") or ""
+            MYSQL_POOL_CONNECTIONS.set(pool.get("idle", 0), database=database, state="idle")
+            MYSQL_POOL_CONNECTIONS.set(pool.get("in_use", 0), database=database, state="in_use")
+            MYSQL_POOL_SIZE.set(pool.get("pool_size", 0), database=database)
+
+
+def render_metrics() -> str:
+    """全局指标的 Prometheus 文本"""
+    return REGISTRY.render()
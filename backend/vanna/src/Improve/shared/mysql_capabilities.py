@@ -0,0 +1,192 @@
+"""
+MySQL 能力探测缓存
+按数据库主机（host:port）缓存版本、sql_mode 和语法支持情况，每个连接目标只探测一次，
+供 check_mysql_version 工具和系统提示词（让 Agent 无需再调用该工具）共同使用
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, Tuple
+
+
+@dataclass
+class MySQLCapabilities:
+    """一个 MySQL 服务的版本和语法能力"""
+    version: str
+    sql_mode: str = ""
+    is_mariadb: bool = False
+    supports_cte: bool = False
+    supports_window_functions: bool = False
+    probed_at: float = field(default_factory=time.time)
+
+    @property
+    def only_full_group_by(self) -> bool:
+        return "ONLY_FULL_GROUP_BY" in self.sql_mode.upper()
+
+    @classmethod
+    def from_probe(cls, version: str, sql_mode: Optional[str]) -> "MySQLCapabilities":
+        """根据 VERSION() 和 @@sql_mode 推断能力（MySQL 8.0+ / MariaDB 10.2+ 支持 CTE 和窗口函数）"""
+        version = str(version)
+        is_mariadb = "mariadb" in version.lower()
+        try:
+            major, minor = (int(p) for p in version.split("-")[0].split(".")[:2])
+        except ValueError:
+            major, minor = 5, 7
+        modern = (major, minor) >= ((10, 2) if is_mariadb else (8, 0))
+        return cls(
+            version=version,
+            sql_mode=sql_mode or "",
+            is_mariadb=is_mariadb,
+            supports_cte=modern,
+            supports_window_functions=modern,
+        )
+
+    def describe(self) -> str:
+        """check_mysql_version 工具的返回文本"""
+        if self.supports_cte:
+            lines = [
+                f"MySQL {self.version}",
+                "Supports: CTE (WITH), window functions (RANK, ROW_NUMBER)",
+            ]
+        else:
+            lines = [
+                f"MySQL {self.version}",
+                "Does not support: CTE (WITH), window functions",
+                "Suggest using: subqueries, GROUP BY + LIMIT",
+            ]
+        if self.only_full_group_by:
+            lines.append("GROUP BY strict mode ON (ONLY_FULL_GROUP_BY): non-aggregated columns in SELECT must be in GROUP BY")
+        else:
+            lines.append("GROUP BY strict mode OFF (ONLY_FULL_GROUP_BY not set)")
+        return "\n".join(lines)
+
+    def prompt_section(self) -> str:
+        """注入系统提示词的数据库环境说明"""
+        syntax = (
+            "可以使用 WITH (CTE) 和窗口函数（ROW_NUMBER/RANK/LEAD/LAG ... OVER）"
+            if self.supports_cte else
+            "禁止使用 WITH (CTE) 和窗口函数，改用子查询"
+        )
+        group_by = (
+            "已开启 ONLY_FULL_GROUP_BY：SELECT 中的非聚合列必须全部出现在 GROUP BY 中"
+            if self.only_full_group_by else
+            "未开启 ONLY_FULL_GROUP_BY"
+        )
+        return (
+            "【当前数据库环境（已自动检测，无需再调用 check_mysql_version）】\n"
+            f"- 版本: {self.version}\n"
+            f"- 语法: {syntax}\n"
+            f"- GROUP BY: {group_by}"
+        )
+
+
+class CapabilityRegistry:
+    """
+    按主机缓存 MySQLCapabilities（线程安全）
+
+    - 成功的探测结果在 ttl 内复用（默认不过期，同一主机版本不会在进程生命周期内变化）
+    - 探测失败时在 failure_backoff 秒内不再重试，避免每次模型调用都访问数据库
+    """
+
+    def __init__(self, ttl: float = 0, failure_backoff: float = 60):
+        """
+        Args:
+            ttl: 探测结果的有效期（秒），<= 0 表示不过期
+            failure_backoff: 探测失败后的重试间隔（秒）
+        """
+        self.ttl = ttl
+        self.failure_backoff = failure_backoff
+        self._entries: Dict[Tuple, MySQLCapabilities] = {}
+        self._failures: Dict[Tuple, Tuple[float, str]] = {}
+        self._locks: Dict[Tuple, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(vn) -> Tuple:
+        target = getattr(vn, "mysql_target", None)
+        if target is not None:
+            t = target()
+            return (t["host"], t["port"])
+        return ("default",)
+
+    def peek(self, vn) -> Optional[MySQLCapabilities]:
+        """读取已缓存的能力（不访问数据库）"""
+        with self._lock:
+            caps = self._entries.get(self._key(vn))
+        if caps is not None and self.ttl > 0 and time.time() - caps.probed_at > self.ttl:
+            return None
+        return caps
+
+    def get(self, vn) -> MySQLCapabilities:
+        """
+        获取当前路由目标的能力（未缓存时探测一次）
+
+        Raises:
+            RuntimeError: 探测失败（或仍处于失败退避期）
+        """
+        key = self._key(vn)
+        caps = self.peek(vn)
+        if caps is not None:
+            return caps
+
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            caps = self.peek(vn)
+            if caps is not None:
+                return caps
+
+            with self._lock:
+                failure = self._failures.get(key)
+            if failure and time.time() - failure[0] < self.failure_backoff:
+                raise RuntimeError(failure[1])
+
+            try:
+                caps = self._probe(vn)
+            except Exception as e:
+                with self._lock:
+                    self._failures[key] = (time.time(), str(e))
+                raise RuntimeError(str(e)) from e
+
+            with self._lock:
+                self._entries[key] = caps
+                self._failures.pop(key, None)
+            logger.info(
+                f"[MySQLCapabilities] {key}: {caps.version}, CTE={caps.supports_cte}, "
+                f"ONLY_FULL_GROUP_BY={caps.only_full_group_by}"
+            )
+            return caps
+
+    @staticmethod
+    def _probe(vn) -> MySQLCapabilities:
+        # 一次查询同时取版本和 sql_mode
+        result = vn.run_sql("SELECT VERSION() AS version, @@SESSION.sql_mode AS sql_mode")
+        if result is None or len(result) == 0:
+            raise RuntimeError("query returned empty result")
+        return MySQLCapabilities.from_probe(result.iloc[0, 0], result.iloc[0, 1])
+
+    def clear(self):
+        """清空所有缓存"""
+        with self._lock:
+            self._entries.clear()
+            self._failures.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                ":".join(str(p) for p in key): caps.version
+                for key, caps in self._entries.items()
+            }
+
+
+# ==================== 全局实例 ====================
+
+_capability_registry = CapabilityRegistry()
+
+
+def get_capability_registry() -> CapabilityRegistry:
+    """获取全局 MySQL 能力缓存"""
+    return _capability_registry
@@ -0,0 +1,273 @@
+"""
+数据库表结构缓存（schema catalog）
+get_all_tables_info 每次调用都要逐表查询 information_schema.COLUMNS（N+1 查询），
+这里按数据库缓存格式化后的表结构：
+
+- 两次批量查询（TABLES + COLUMNS）加载整个库
+- TTL 到期强制重新加载
+- 每隔 check_interval 秒用一次轻量查询比较 information_schema.TABLES 的
+  表数量 / UPDATE_TIME / CREATE_TIME，有变化时重新加载
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+
+@dataclass
+class SchemaSnapshot:
+    """某个数据库的表结构快照"""
+    database: str
+    tables_df: pd.DataFrame  # TABLE_NAME, TABLE_COMMENT（按表名排序）
+    blocks: Dict[str, str]  # 表名 -> 格式化后的表结构文本
+    fingerprint: Tuple
+    loaded_at: float = field(default_factory=time.time)
+    checked_at: float = field(default_factory=time.time)
+
+    @property
+    def table_names(self) -> List[str]:
+        return self.tables_df['TABLE_NAME'].tolist()
+
+
+def get_current_database(vn) -> str:
+    """
+    当前路由到的数据库名
+
+    优先从客户端的连接配置读取（不访问数据库），否则执行 SELECT DATABASE()
+    """
+    target = getattr(vn, "mysql_target", None)
+    if target is not None:
+        return target()["database"]
+    return vn.run_sql("SELECT DATABASE()").iloc[0, 0]
+
+
+def _format_table_block(table_name: str, table_comment: str, columns_df: pd.DataFrame) -> str:
+    """格式化单个表的结构信息"""
+    lines = [
+        f"\n{'='*60}",
+        f"表名: {table_name}",
+        f"说明: {table_comment or '无描述'}",
+        f"列数: {len(columns_df)}",
+        "-" * 60,
+    ]
+
+    for _, col in columns_df.iterrows():
+        col_info = f"  • {col['COLUMN_NAME']}"
+        col_info += f" ({col['COLUMN_TYPE']})"
+
+        if col['COLUMN_KEY'] == 'PRI':
+            col_info += " [主键]"
+        elif col['COLUMN_KEY'] == 'UNI':
+            col_info += " [唯一]"
+        elif col['COLUMN_KEY'] == 'MUL':
+            col_info += " [索引]"
+
+        if col['IS_NULLABLE'] == 'NO':
+            col_info += " [NOT NULL]"
+
+        if pd.notna(col['COLUMN_DEFAULT']):
+            col_info += f" [默认: {col['COLUMN_DEFAULT']}]"
+
+        if col['COLUMN_COMMENT']:
+            col_info += f"\n    说明: {col['COLUMN_COMMENT']}"
+
+        lines.append(col_info)
+
+    return "\n".join(lines)
+
+
+class SchemaCatalog:
+    """
+    按数据库缓存表结构（线程安全）
+
+    使用示例:
+        catalog = get_schema_catalog()
+        snapshot = catalog.get(vn)
+        text = "\\n".join(snapshot.blocks[t] for t in snapshot.table_names)
+    """
+
+    def __init__(self, ttl: float = 300, check_interval: float = 30):
+        """
+        Args:
+            ttl: 快照最长使用时间（秒），到期后重新加载
+            check_interval: 检查表结构是否变化的间隔（秒），0 表示每次都检查
+        """
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self._snapshots: Dict[Tuple, SchemaSnapshot] = {}
+        self._locks: Dict[Tuple, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._loads = 0
+        self._hits = 0
+
+    # ==================== 公开接口 ====================
+
+    def get(self, vn) -> SchemaSnapshot:
+        """
+        获取当前路由数据库的表结构快照（必要时重新加载）
+
+        Args:
+            vn: Vanna 客户端
+
+        Returns:
+            SchemaSnapshot
+        """
+        key, database = self._target(vn)
+        with self._key_lock(key):
+            snapshot = self._snapshots.get(key)
+            now = time.time()
+
+            if snapshot is not None and now - snapshot.loaded_at <= self.ttl:
+                if now - snapshot.checked_at < self.check_interval:
+                    self._count_hit()
+                    return snapshot
+                # 轻量检查：表数量 / 最近更新时间未变化则继续使用
+                if self._fingerprint(vn, database) == snapshot.fingerprint:
+                    snapshot.checked_at = now
+                    self._count_hit()
+                    return snapshot
+                logger.info(f"[SchemaCatalog] Schema of {database} changed, reloading")
+
+            snapshot = self._load(vn, database)
+            self._snapshots[key] = snapshot
+            return snapshot
+
+    def invalidate(self, database: Optional[str] = None):
+        """
+        使缓存失效
+
+        Args:
+            database: 数据库名（None 表示全部）
+        """
+        with self._lock:
+            for key in list(self._snapshots):
+                if database is None or key[-1] == database:
+                    del self._snapshots[key]
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存状态"""
+        with self._lock:
+            return {
+                "databases": len(self._snapshots),
+                "loads": self._loads,
+                "hits": self._hits,
+                "ttl": self.ttl,
+                "check_interval": self.check_interval,
+            }
+
+    # ==================== 内部实现 ====================
+
+    @staticmethod
+    def _target(vn) -> Tuple[Tuple, str]:
+        """缓存键（host, port, database）和数据库名"""
+        target = getattr(vn, "mysql_target", None)
+        if target is not None:
+            t = target()
+            return (t["host"], t["port"], t["database"]), t["database"]
+        database = get_current_database(vn)
+        return (database,), database
+
+    def _key_lock(self, key: Tuple) -> threading.Lock:
+        # 每个数据库一把锁：同一个库并发请求时只加载一次
+        with self._lock:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = threading.Lock()
+            return lock
+
+    def _count_hit(self):
+        with self._lock:
+            self._hits += 1
+
+    @staticmethod
+    def _fingerprint(vn, database: str) -> Tuple:
+        df = vn.run_sql(f"""
+        SELECT
+            COUNT(*) AS TABLE_COUNT,
+            MAX(UPDATE_TIME) AS LAST_UPDATE,
+            MAX(CREATE_TIME) AS LAST_CREATE
+        FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = '{database}'
+        """)
+        if df is None or df.empty:
+            return ()
+        return tuple(str(v) for v in df.iloc[0].tolist())
+
+    def _load(self, vn, database: str) -> SchemaSnapshot:
+        """两次批量查询加载整个库的表和列"""
+        start = time.time()
+        fingerprint = self._fingerprint(vn, database)
+
+        tables_df = vn.run_sql(f"""
+        SELECT
+            TABLE_NAME,
+            TABLE_COMMENT
+        FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = '{database}'
+        ORDER BY TABLE_NAME
+        """)
+        if tables_df is None:
+            tables_df = pd.DataFrame(columns=['TABLE_NAME', 'TABLE_COMMENT'])
+
+        columns_df = vn.run_sql(f"""
+        SELECT
+            TABLE_NAME,
+            COLUMN_NAME,
+            COLUMN_TYPE,
+            IS_NULLABLE,
+            COLUMN_KEY,
+            COLUMN_DEFAULT,
+            COLUMN_COMMENT
+        FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = '{database}'
+        ORDER BY TABLE_NAME, ORDINAL_POSITION
+        """)
+        columns_by_table = {}
+        if columns_df is not None and not columns_df.empty:
+            columns_by_table = {name: group for name, group in columns_df.groupby('TABLE_NAME', sort=False)}
+        empty_columns = pd.DataFrame(columns=['COLUMN_NAME'])
+
+        blocks = {
+            row['TABLE_NAME']: _format_table_block(
+                row['TABLE_NAME'],
+                row['TABLE_COMMENT'],
+                columns_by_table.get(row['TABLE_NAME'], empty_columns),
+            )
+            for _, row in tables_df.iterrows()
+        }
+
+        with self._lock:
+            self._loads += 1
+        logger.info(
+            f"[SchemaCatalog] Loaded {len(blocks)} tables of {database} in {time.time() - start:.3f}s"
+        )
+        return SchemaSnapshot(
+            database=database,
+            tables_df=tables_df.reset_index(drop=True),
+            blocks=blocks,
+            fingerprint=fingerprint,
+        )
+
+
+# ==================== 全局实例 ====================
+
+_schema_catalog: Optional[SchemaCatalog] = None
+
+
+def set_schema_catalog(catalog: SchemaCatalog):
+    """设置全局表结构缓存（用于配置 TTL 等参数）"""
+    global _schema_catalog
+    _schema_catalog = catalog
+
+
+def get_schema_catalog() -> SchemaCatalog:
+    """获取全局表结构缓存（未设置时使用默认参数创建）"""
+    global _schema_catalog
+    if _schema_catalog is None:
+        _schema_catalog = SchemaCatalog()
+    return _schema_catalog
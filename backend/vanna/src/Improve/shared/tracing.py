@@ -0,0 +1,297 @@
+"""
+链路追踪（基于 OpenTelemetry SDK）
+一次问答耗时 15-40s，但日志里只有截断的文本和单次耗时，看不出时间花在哪里。
+这里按 run 记录嵌套的 span（run → LLM 轮次 → 工具 → 嵌入 / Milvus 检索 / SQL），
+带耗时、token 数、行数、字节数等属性：
+
+- span 由 OpenTelemetry SDK 创建，当前 span 保存在 OTel 的 contextvars 上下文中；LangGraph 会把上下文
+  复制到工具线程，自建线程池提交任务时需用 contextvars.copy_context().run 传递
+- 只在 run 的 trace 内记录 span，run 之外的调用（训练导入等）不创建 span
+- 最近的 trace 由内存导出器 RunTraceStore 按 run_id 保存（供 /api/v1/traces/{run_id} 查询）；
+  另可通过 BatchSpanProcessor 导出为 JSON Lines 文件，或以 OTLP/gRPC 发送到 collector
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from opentelemetry import context as otel_context
+from opentelemetry import trace
+from opentelemetry.sdk.resources import SERVICE_NAME, Resource
+from opentelemetry.sdk.trace import ReadableSpan, TracerProvider
+from opentelemetry.sdk.trace.export import (
+    BatchSpanProcessor,
+    ConsoleSpanExporter,
+    SimpleSpanProcessor,
+    SpanExporter,
+    SpanExportResult,
+)
+from opentelemetry.trace import INVALID_SPAN, StatusCode, format_span_id, format_trace_id
+
+
+def set_span_attributes(span, **attributes):
+    """设置 span 属性（值为 None 的属性忽略，OTel 不支持的类型转为字符串）"""
+    if not span.is_recording():
+        return
+    span.set_attributes(_otel_attributes(attributes))
+
+
+def _otel_attributes(attributes: Dict[str, Any]) -> Dict[str, Any]:
+    result = {}
+    for key, value in attributes.items():
+        if value is None:
+            continue
+        result[key] = value if isinstance(value, (str, bool, int, float)) else str(value)
+    return result
+
+
+# ==================== 导出 ====================
+
+class RunTraceStore(SpanExporter):
+    """
+    内存中的 span 导出器：按 run_id 保存最近 max_traces 个 trace
+
+    run 开始时由 Tracer.trace() 登记 run_id 对应的 trace ID，未登记的 trace 的 span 直接丢弃
+    """
+
+    def __init__(self, max_traces: int = 200):
+        self.max_traces = max_traces
+        # trace ID -> (run_id, 已结束的 span)
+        self._traces: "OrderedDict[int, Tuple[str, List[ReadableSpan]]]" = OrderedDict()
+        self._runs: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._finished = 0
+
+    def register(self, run_id: str, trace_id: int):
+        """登记 run 的 trace ID（超出容量时淘汰最早的 trace）"""
+        with self._lock:
+            old = self._runs.pop(run_id, None)
+            if old is not None:
+                self._traces.pop(old, None)
+            self._runs[run_id] = trace_id
+            self._traces[trace_id] = (run_id, [])
+            while len(self._traces) > self.max_traces:
+                _, (evicted, _) = self._traces.popitem(last=False)
+                self._runs.pop(evicted, None)
+
+    def contains(self, trace_id: int) -> bool:
+        with self._lock:
+            return trace_id in self._traces
+
+    def export(self, spans: Sequence[ReadableSpan]) -> SpanExportResult:
+        with self._lock:
+            for span in spans:
+                entry = self._traces.get(span.context.trace_id)
+                if entry is None:
+                    continue
+                entry[1].append(span)
+                if span.parent is None:
+                    self._finished += 1
+        return SpanExportResult.SUCCESS
+
+    def get(self, run_id: str) -> Optional[List[ReadableSpan]]:
+        """run 已结束的 span（按开始时间排序）；run 不存在时返回 None"""
+        with self._lock:
+            trace_id = self._runs.get(run_id)
+            if trace_id is None:
+                return None
+            spans = list(self._traces[trace_id][1])
+        return sorted(spans, key=lambda s: s.start_time or 0)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"traces": len(self._traces), "finished": self._finished}
+
+    def shutdown(self):
+        pass
+
+
+def create_jsonl_exporter(path: str) -> SpanExporter:
+    """每个 span 一行 JSON（OTel 的 span JSON 格式），追加写入文件"""
+    out = open(path, "a", encoding="utf-8")
+    return ConsoleSpanExporter(out=out, formatter=lambda span: span.to_json(indent=None) + "\n")
+
+
+def create_otlp_exporter(endpoint: str) -> SpanExporter:
+    """
+    OTLP/gRPC 导出器
+
+    使用示例:
+        create_otlp_exporter("http://localhost:4317")
+    """
+    from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+    return OTLPSpanExporter(endpoint=endpoint, insecure=endpoint.startswith("http://"))
+
+
+# ==================== Tracer ====================
+
+class Tracer:
+    """
+    按 run 记录 span 的 OpenTelemetry Tracer
+
+    使用示例:
+        tracer = get_tracer()
+        with tracer.trace(run_id, "agent.run", question=question):
+            with tracer.span("sql", kind="sql", db_name="sales") as span:
+                df = run(sql)
+                set_span_attributes(span, rows=len(df))
+        tracer.get_trace(run_id)
+    """
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        max_traces: int = 200,
+        exporters: Optional[List[SpanExporter]] = None,
+        service_name: str = "sqlagent-vanna",
+    ):
+        """
+        Args:
+            enabled: 是否记录 span
+            max_traces: 内存中保留的 trace 数（按开始时间淘汰最早的）
+            exporters: 额外的 OTel 导出器（通过 BatchSpanProcessor 在后台线程中导出）
+            service_name: OTel resource 的 service.name
+        """
+        self.enabled = enabled
+        self.max_traces = max_traces
+        self.exporters = list(exporters or [])
+        self.store = RunTraceStore(max_traces)
+        self._provider = TracerProvider(resource=Resource.create({SERVICE_NAME: service_name}))
+        # 内存导出器同步写入：run 结束后立即可以按 run_id 查询
+        self._provider.add_span_processor(SimpleSpanProcessor(self.store))
+        for exporter in self.exporters:
+            self._provider.add_span_processor(BatchSpanProcessor(exporter))
+        self._tracer = self._provider.get_tracer(__name__)
+
+    @contextmanager
+    def trace(self, trace_id: Optional[str], name: str = "agent.run", kind: str = "run", **attributes) -> Iterator[Any]:
+        """
+        开始一个 run 的 trace（根 span）；已在 trace 中时等同于 span()
+
+        Args:
+            trace_id: run ID（None 表示不记录）
+            name: 根 span 名称
+            kind: 根 span 类型
+            attributes: 根 span 属性
+        """
+        if not self.enabled or trace_id is None:
+            yield INVALID_SPAN
+            return
+        if self._in_trace():
+            with self.span(name, kind=kind, **attributes) as span:
+                yield span
+            return
+
+        with self._tracer.start_as_current_span(
+            name,
+            context=otel_context.Context(),
+            attributes=_otel_attributes({"kind": kind, "run.id": trace_id, **attributes}),
+        ) as root:
+            self.store.register(trace_id, root.get_span_context().trace_id)
+            yield root
+
+    @contextmanager
+    def span(self, name: str, kind: str = "internal", **attributes) -> Iterator[Any]:
+        """
+        在当前 span 下记录子 span（不在 trace 中时不记录）
+
+        Yields:
+            OTel Span（用 set_span_attributes() 补充属性）
+        """
+        if not self.enabled or not self._in_trace():
+            yield INVALID_SPAN
+            return
+        with self._tracer.start_as_current_span(
+            name, attributes=_otel_attributes({"kind": kind, **attributes})
+        ) as span:
+            yield span
+
+    def current_span(self) -> Any:
+        """当前 span（不在 trace 中时返回非记录的空 span）"""
+        return trace.get_current_span()
+
+    def get_trace(self, trace_id: str) -> Optional[Dict[str, Any]]:
+        """
+        查询 run 的 trace（进行中的 run 只包含已结束的 span）
+
+        Returns:
+            {"trace_id", "duration_ms", "spans", "summary"}；不存在时返回 None
+        """
+        spans = self.store.get(trace_id)
+        if spans is None:
+            return None
+        items = [_span_dict(s) for s in spans]
+        root = next((s for s in items if s["parent_id"] is None), None)
+        summary: Dict[str, Dict[str, Any]] = {}
+        for span in items:
+            if span is root:
+                continue
+            item = summary.setdefault(span["kind"], {"count": 0, "total_ms": 0.0, "errors": 0})
+            item["count"] += 1
+            item["total_ms"] = round(item["total_ms"] + span["duration_ms"], 2)
+            item["errors"] += span["status"] == "error"
+        return {
+            "trace_id": trace_id,
+            "duration_ms": root["duration_ms"] if root else None,
+            "spans": items,
+            "summary": summary,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        """追踪状态"""
+        return {
+            "enabled": self.enabled,
+            "max_traces": self.max_traces,
+            **self.store.stats(),
+            "exporters": [type(e).__name__ for e in self.exporters],
+        }
+
+    def shutdown(self):
+        """关闭 span 处理器（等待 BatchSpanProcessor 导出剩余的 span）"""
+        try:
+            self._provider.shutdown()
+        except Exception as e:
+            logger.warning(f"[Tracing] Shutdown failed: {e}")
+
+    def _in_trace(self) -> bool:
+        """当前 span 是否属于本 Tracer 登记的 run"""
+        current = trace.get_current_span()
+        return current.is_recording() and self.store.contains(current.get_span_context().trace_id)
+
+
+def _span_dict(span: ReadableSpan) -> Dict[str, Any]:
+    attributes = dict(span.attributes or {})
+    kind = attributes.pop("kind", "internal")
+    error = span.status.status_code is StatusCode.ERROR
+    return {
+        "trace_id": format_trace_id(span.context.trace_id),
+        "span_id": format_span_id(span.context.span_id),
+        "parent_id": format_span_id(span.parent.span_id) if span.parent else None,
+        "name": span.name,
+        "kind": kind,
+        "start_time": span.start_time / 1e9,
+        "end_time": span.end_time / 1e9,
+        "duration_ms": round((span.end_time - span.start_time) / 1e6, 2),
+        "attributes": attributes,
+        "status": "error" if error else "ok",
+        "error": span.status.description if error else None,
+    }
+
+
+# ==================== 全局实例 ====================
+
+_tracer = Tracer()
+
+
+def set_tracer(tracer: Tracer):
+    """设置全局 Tracer（用于配置导出器等参数）"""
+    global _tracer
+    _tracer = tracer
+
+
+def get_tracer() -> Tracer:
+    """获取全局 Tracer"""
+    return _tracer
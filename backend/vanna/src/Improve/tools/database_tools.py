@@ -5,17 +5,15 @@
 
 import logging
 logger = logging.getLogger(__name__)
-import threading
 import time
 import pandas as pd
 import re
+import sqlparse
+from sqlparse import tokens as T
 from langchain.tools import tool  # type: ignore
 
 # 导入共享上下文（统一管理）
-from ..shared import get_vanna_client, set_last_query_result
-
-
-_sql_execution_lock = threading.Lock()
+from ..shared import get_vanna_client, set_last_query_result, get_schema_catalog, get_capability_registry
 
 
 def _extract_keywords(question: str) -> list:
@@ -103,13 +101,12 @@ def _filter_tables_by_plan(vn, db_name: str, question: str, all_tables: list) ->
         return []
 
     try:
-        # 调用 vannaplan 检索方法，获取相似度 >= 0.75 的 top5 相关表
-        related_tables = vn.get_related_plan_tables(
-            question=question,
-            db_name=db_name,
-            threshold=0.75,
-            top_k=5
-        )
+        # 统一检索（vannaplan 相似度 >= 0.75 的 top5 相关表），
+        # 结果会被随后的 get_table_schema 复用，同一问题不再重复检索
+        retrieval = vn.retrieve_context(question, db_name=db_name, threshold=0.5, top_k=5, plan_threshold=0.75)
+        if "plan_tables" in retrieval.errors:
+            raise RuntimeError(retrieval.errors["plan_tables"])
+        related_tables = retrieval.plan_tables
 
         if not related_tables:
             logger.info("Plan 过滤未返回相关表，将使用关键字过滤")
@@ -151,34 +148,16 @@ def get_all_tables_info(question: str = "") -> str:
     # 调用 ：backend/vanna/src/Improve/clients/vanna_client.py
     vn = get_vanna_client()
     try:
-        # 获取当前数据库名
-        db_query = "SELECT DATABASE()"
-        db_result = vn.run_sql(db_query)
-        db_name = db_result.iloc[0, 0]
-
-        # 查询所有表的详细信息
-        tables_query = f"""
-        SELECT
-            TABLE_NAME,
-            TABLE_COMMENT
-        FROM information_schema.TABLES
-        WHERE TABLE_SCHEMA = '{db_name}'
-        ORDER BY TABLE_NAME
-        """
-
-        # run_sql 方法是 Vanna 库安装后自带的方法： backend/vanna/src/vanna/base/base.py
-        # class VannaBase(ABC):
-        #     def run_sql(self, sql: str, **kwargs) -> pd.DataFrame:
-        #         """Run a SQL query on the connected database."""
-        #         raise Exception("You need to connect to a database first...")
-
-        tables_df = vn.run_sql(tables_query)
+        # 表结构来自缓存（整库两次批量查询加载，表结构变化或 TTL 到期时自动重新加载）
+        snapshot = get_schema_catalog().get(vn)
+        db_name = snapshot.database
+        tables_df = snapshot.tables_df
 
         if tables_df.empty:
             return f"Database {db_name} has no tables"
 
         # 保存所有表名列表（用于过滤）
-        all_table_names = tables_df['TABLE_NAME'].tolist()
+        all_table_names = snapshot.table_names
 
         # 如果提供了问题，进行表过滤
         filtered_table_names = None
@@ -206,7 +185,7 @@ def get_all_tables_info(question: str = "") -> str:
             tables_df = tables_df[tables_df['TABLE_NAME'].isin(filtered_table_names)]
             if tables_df.empty:
                 # 过滤后为空，回退到所有表
-                tables_df = vn.run_sql(tables_query)
+                tables_df = snapshot.tables_df
                 filter_method = None
         else:
             filter_method = None
@@ -218,55 +197,9 @@ def get_all_tables_info(question: str = "") -> str:
         else:
             result_parts.append("")
 
-        # 遍历每个表，获取列信息
-        for _, table_row in tables_df.iterrows():
-            table_name = table_row['TABLE_NAME']
-            table_comment = table_row['TABLE_COMMENT'] or '无描述'
-
-            # 获取表的列信息
-            columns_query = f"""
-            SELECT
-                COLUMN_NAME,
-                COLUMN_TYPE,
-                IS_NULLABLE,
-                COLUMN_KEY,
-                COLUMN_DEFAULT,
-                COLUMN_COMMENT
-            FROM information_schema.COLUMNS
-            WHERE TABLE_SCHEMA = '{db_name}' 
-              AND TABLE_NAME = '{table_name}'
-            ORDER BY ORDINAL_POSITION
-            """
-            columns_df = vn.run_sql(columns_query)
-            
-            result_parts.append(f"\n{'='*60}")
-            result_parts.append(f"表名: {table_name}")
-            result_parts.append(f"说明: {table_comment}")
-            result_parts.append(f"列数: {len(columns_df)}")
-            result_parts.append("-" * 60)
-            
-            # 格式化列信息
-            for _, col in columns_df.iterrows():
-                col_info = f"  • {col['COLUMN_NAME']}"
-                col_info += f" ({col['COLUMN_TYPE']})"
-                
-                if col['COLUMN_KEY'] == 'PRI':
-                    col_info += " [主键]"
-                elif col['COLUMN_KEY'] == 'UNI':
-                    col_info += " [唯一]"
-                elif col['COLUMN_KEY'] == 'MUL':
-                    col_info += " [索引]"
-                
-                if col['IS_NULLABLE'] == 'NO':
-                    col_info += " [NOT NULL]"
-                
-                if pd.notna(col['COLUMN_DEFAULT']):
-                    col_info += f" [默认: {col['COLUMN_DEFAULT']}]"
-                
-                if col['COLUMN_COMMENT']:
-                    col_info += f"\n    说明: {col['COLUMN_COMMENT']}"
-                
-                result_parts.append(col_info)
+        # 从缓存中取出每个表格式化好的列信息
+        for table_name in tables_df['TABLE_NAME']:
+            result_parts.append(snapshot.blocks[table_name])
         
         return "\n".join(result_parts)
         
@@ -282,49 +215,54 @@ def check_mysql_version() -> str:
         MySQL 版本信息和支持的语法特性
     """
     vn = get_vanna_client()
-    
-    # 重试机制（避免连接状态问题）
-    max_retries = 3
-    for attempt in range(max_retries):
-        try:
-            result = vn.run_sql("SELECT VERSION()")
-            
-            # 检查结果是否为空
-            if result is None or len(result) == 0:
-                if attempt < max_retries - 1:
-                    time.sleep(0.5)
-                    continue
-                return "Version detection failed: query returned empty result\n Assuming MySQL 5.7 (no CTE support), avoid using WITH clauses"
-            
-            version = result.iloc[0, 0]
-            major_version = int(version.split('.')[0])
-            
-            # 版本检查，如果 major_version >= 8，则支持 CTE (WITH), 窗口函数 (RANK, ROW_NUMBER)
-            if major_version >= 8:
-                return f"MySQL {version}\nSupports: CTE (WITH), window functions (RANK, ROW_NUMBER)\nSupports GROUP BY strict mode: ONLY_FULL_GROUP_BY"
+
+    # 按数据库主机缓存：每个主机只探测一次（版本 + sql_mode）
+    try:
+        return get_capability_registry().get(vn).describe()
+    except Exception as e:
+        # 探测失败，返回默认假设
+        return f"Version detection failed: {str(e)}\nAssuming MySQL 5.7 (no CTE support), avoid using WITH clauses\nNote GROUP BY rules"
+
+
+# 写操作 / 权限操作关键字（execute_sql 和 validate_sql_syntax 共用）
+_DANGEROUS_KEYWORDS = ['INSERT', 'UPDATE', 'DELETE', 'DROP', 'ALTER',
+                       'TRUNCATE', 'CREATE', 'GRANT', 'REVOKE']
+
+
+def _sql_code(sql: str) -> str:
+    """
+    去掉字符串字面量、注释和反引号标识符后的 SQL（只检查 SQL 代码本身）
+
+    MySQL 会执行 /*! ... */ 中的内容，这类注释保留
+    """
+    parts = []
+    for statement in sqlparse.parse(sql):
+        for token in statement.flatten():
+            if token.ttype in T.String or (token.ttype in T.Name and token.value.startswith('`')):
+                parts.append(' ')
+            elif token.ttype in T.Comment and not token.value.startswith('/*!'):
+                parts.append(' ')
             else:
-                return f"MySQL {version}\nDoes not support: CTE (WITH), window functions\nSuggest using: subqueries, GROUP BY + LIMIT\nPossible GROUP BY strict mode, columns in SELECT must be in GROUP BY"
-        except Exception as e:
-            if attempt < max_retries - 1:
-                time.sleep(0.5)
-                continue
-            # 最后一次尝试失败，返回默认假设
-            return f"Version detection failed: {str(e)}\nAssuming MySQL 5.7 (no CTE support), avoid using WITH clauses\nNote GROUP BY rules"
-    
-    return "Version detection failed (unknown error)"
+                parts.append(token.value)
+    return ''.join(parts)
 
 
-# ==================== SQL 执行工具（核心）====================
+def _dangerous_keyword(sql: str):
+    """SQL 中出现的第一个危险关键字（没有时返回 None；字符串和注释中的不算）"""
+    sql_upper = _sql_code(sql).upper()
+    for keyword in _DANGEROUS_KEYWORDS:
+        if re.search(rf'\b{keyword}\b', sql_upper):
+            return keyword
+    return None
 
-# 全局互斥锁，防止并发执行 SQL
-_sql_execution_lock = threading.Lock()
+
+# ==================== SQL 执行工具（核心）====================
 
 @tool
 def execute_sql(sql: str) -> str:
     """执行 SQL 查询并返回结果
     
-    重要: 一次只能执行一个SQL，不要并发调用此工具！
-    技术保障: 内部使用互斥锁强制串行执行
+    每次执行从连接池借出独立连接，可与其他请求并发执行
     自动分割: 如果传入多条SQL（用分号分隔），会自动逐条执行
     
     Args:
@@ -333,16 +271,17 @@ def execute_sql(sql: str) -> str:
     Returns:
         查询结果摘要
     """
-    # 使用互斥锁强制串行执行，防止并发破坏 MySQL 连接
-    with _sql_execution_lock:
-        vn = get_vanna_client()
-        
-        # ==================== SQL 语法检查 ====================
-        import re
-        
-        # 检查是否包含 SET 语句（用户变量）
-        if re.search(r'\bSET\s+@', sql, re.IGNORECASE):
-            return f"""SQL 语法错误: 禁止使用 SET 语句（MySQL 5.7 限制）
+    vn = get_vanna_client()
+    
+    # ==================== SQL 语法检查 ====================
+    # 安全性检查（与 validate_sql_syntax 相同；连接为 autocommit，不能只依赖模型先调用验证工具）
+    keyword = _dangerous_keyword(sql)
+    if keyword:
+        return f"安全风险: SQL包含危险操作 {keyword}，已拒绝执行（只允许只读查询）"
+    
+    # 检查是否包含 SET 语句（用户变量）
+    if re.search(r'\bSET\s+@', sql, re.IGNORECASE):
+        return f"""SQL 语法错误: 禁止使用 SET 语句（MySQL 5.7 限制）
 
 检测到的 SQL:
 {sql[:500]}...
@@ -355,36 +294,36 @@ def execute_sql(sql: str) -> str:
 2. 用户变量可能导致字符集冲突错误
 
 请修改 SQL，直接在 WHERE 子句中使用字面量。"""
+    
+    # ==================== 智能分割多条 SQL ====================
+    # 移除注释并按分号分割
+    
+    # 移除单行注释（-- 开头）
+    sql_no_comments = re.sub(r'--[^\n]*', '', sql)
+    
+    # 按分号分割（忽略空白语句）
+    sql_statements = [
+        stmt.strip() 
+        for stmt in sql_no_comments.split(';') 
+        if stmt.strip()
+    ]
+    
+    # 如果检测到多条 SQL，给出警告并逐条执行
+    if len(sql_statements) > 1:
+        logger.warning(f"Detected {len(sql_statements)} SQL statements, will execute one by one...")
         
-        # ==================== 智能分割多条 SQL ====================
-        # 移除注释并按分号分割
-        
-        # 移除单行注释（-- 开头）
-        sql_no_comments = re.sub(r'--[^\n]*', '', sql)
-        
-        # 按分号分割（忽略空白语句）
-        sql_statements = [
-            stmt.strip() 
-            for stmt in sql_no_comments.split(';') 
-            if stmt.strip()
-        ]
-        
-        # 如果检测到多条 SQL，给出警告并逐条执行
-        if len(sql_statements) > 1:
-            logger.warning(f"Detected {len(sql_statements)} SQL statements, will execute one by one...")
-            
-            all_results = []
-            for i, stmt in enumerate(sql_statements, 1):
-                logger.info(f"\nExecuting {i}/{len(sql_statements)} SQL...")
-                result = _execute_single_sql(vn, stmt, max_retries=3)
+        all_results = []
+        for i, stmt in enumerate(sql_statements, 1):
+            logger.info(f"\nExecuting {i}/{len(sql_statements)} SQL...")
+            result = _execute_single_sql(vn, stmt, max_retries=3)
 
-                # 用中文记录输出
-                all_results.append(f"=== 查询 {i} ===\n{result}")
-            
-            return "\n\n".join(all_results)
-        else:
-            # 单条 SQL，直接执行
-            return _execute_single_sql(vn, sql_statements[0] if sql_statements else sql, max_retries=3)
+            # 用中文记录输出
+            all_results.append(f"=== 查询 {i} ===\n{result}")
+        
+        return "\n\n".join(all_results)
+    else:
+        # 单条 SQL，直接执行
+        return _execute_single_sql(vn, sql_statements[0] if sql_statements else sql, max_retries=3)
 
 
 def _execute_single_sql(vn, sql: str, max_retries: int = 3) -> str:
@@ -411,13 +350,20 @@ def _execute_single_sql(vn, sql: str, max_retries: int = 3) -> str:
             
             row_count = len(df)
 
-            # 🔥 缓存 DataFrame 到全局变量（供 api_server 提取）
+            # 🔥 按当前 run 缓存 DataFrame（供 api_server 按 run_id 提取），并记录对应的 SQL
+            df.attrs["sql"] = sql
             set_last_query_result(df)
             logger.info(f"[execute_sql] 已缓存查询结果 DataFrame，行数: {row_count}")
 
             # 使用中文记录结果摘要
             result_summary = f"查询成功\n"
-            result_summary += f"返回行数: {row_count}\n"
+            if df.attrs.get("truncated"):
+                # 结果过大时只读取了前 row_count 行，提醒模型缩小查询范围
+                limit_desc = "行数上限" if df.attrs.get("truncated_by") == "max_rows" else "大小上限"
+                result_summary += f"返回行数: 至少 {row_count}（结果超过{limit_desc}，已截断，只读取了前 {row_count} 行）\n"
+                result_summary += "提示: 如需完整结果，请添加 WHERE 条件、聚合（GROUP BY）或 LIMIT 缩小结果集\n"
+            else:
+                result_summary += f"返回行数: {row_count}\n"
             result_summary += f"列名: {', '.join(df.columns.tolist())}\n\n"
 
             if row_count > 0:
@@ -453,53 +399,9 @@ def _execute_single_sql(vn, sql: str, max_retries: int = 3) -> str:
   -- 这是注释 SELECT * FROM table;
   SELECT * FROM table;"""
             
-            # 处理空错误 (0, '') - 通常是连接问题
-            if error_msg == "(0, '')" or error_msg == "(0, b'')":
-                if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
-                    continue  # 重试
-                else:
-                    return f"""SQL执行失败: MySQL连接错误
-
-错误信息: {error_msg} (空错误)
-
-可能原因:
-1. MySQL连接已断开或处于异常状态
-2. 之前的查询导致连接状态异常
-3. 并发查询破坏了连接
-
-已尝试 {max_retries} 次重试，仍然失败。
-
-SQL语句:
-{sql[:200]}...
-
-建议:
-1. 重新启动Agent，重新建立数据库连接
-2. 检查是否有并发执行的SQL
-3. 确保之前的SQL执行完全结束"""
-            
-            # 检查是否是并发错误（Packet sequence number）
-            elif "Packet sequence number wrong" in error_msg or "packet" in error_msg.lower():
-                if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
-                    continue  # 重试
-                else:
-                    return f"""SQL执行失败: 连接并发冲突
-                
-错误信息: {error_msg}
-
-原因: MySQL连接不支持并发查询，请确保：
-1. 一次只执行一个 execute_sql 工具调用
-2. 等待上一个SQL完全执行完成后再执行下一个
-
-已尝试 {max_retries} 次重试,仍然失败。
-
-建议: 
-- 检查是否同时提交了多个 execute_sql 调用
-- 如需执行多个SQL，请按顺序逐个执行"""
-            
             # 检查是否是GROUP BY错误
-            elif "isn't in GROUP BY" in error_msg or "ONLY_FULL_GROUP_BY" in error_msg:
+            # （连接丢失类错误已由连接池在新连接上重试）
+            if "isn't in GROUP BY" in error_msg or "ONLY_FULL_GROUP_BY" in error_msg:
                 return f"""SQL执行失败: GROUP BY语法错误
 
 错误信息: {error_msg}
@@ -538,11 +440,7 @@ MySQL 5.7 替代方案:
 -- 错误: WITH temp AS (SELECT ...) SELECT * FROM temp
 -- 正确: SELECT * FROM (SELECT ...) AS temp
 
-方案2 - 使用临时表:
-CREATE TEMPORARY TABLE temp_table AS SELECT ...;
-SELECT * FROM temp_table;
-
-方案3 - 直接在FROM子句中使用子查询:
+方案2 - 直接在FROM子句中使用子查询（派生表）:
 SELECT t1.*, t2.* 
 FROM (SELECT ... FROM table1) AS t1
 JOIN (SELECT ... FROM table2) AS t2
@@ -582,18 +480,13 @@ def validate_sql_syntax(sql: str) -> str:
     Returns:
         语法验证结果
     """
-    import re
-    
     # 安全性检查
-    dangerous_keywords = ['INSERT', 'UPDATE', 'DELETE', 'DROP', 'ALTER', 
-                         'TRUNCATE', 'CREATE', 'GRANT', 'REVOKE']
-    
-    sql_upper = sql.upper()
-    for keyword in dangerous_keywords:
-        if re.search(rf'\b{keyword}\b', sql_upper):
-            return f"安全风险: SQL包含危险操作 {keyword}"
+    keyword = _dangerous_keyword(sql)
+    if keyword:
+        return f"安全风险: SQL包含危险操作 {keyword}"
     
     # 基础语法检查
+    sql_upper = sql.upper()
     if not sql.strip():
         return "SQL为空"
     
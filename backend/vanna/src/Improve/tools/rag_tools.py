@@ -5,7 +5,7 @@ RAG 检索工具
 import logging
 logger = logging.getLogger(__name__)
 from langchain.tools import tool  # type: ignore
-from ..shared import get_vanna_client
+from ..shared import get_vanna_client, get_current_database
 
 
 # ==================== 辅助函数 ====================
@@ -52,23 +52,19 @@ def get_table_schema(question: str) -> str:
     vn = get_vanna_client()
 
     try:
-        # 获取当前数据库名
-        db_query = "SELECT DATABASE()"
-        db_result = vn.run_sql(db_query)
-        db_name = db_result.iloc[0, 0]
+        # 获取当前数据库名（从连接配置读取，不额外查询数据库）
+        db_name = get_current_database(vn)
 
         # 提取关键词
         keywords = _extract_keywords(question)
 
         result_parts = []
 
-        # 1. 向量检索 DDL（阈值 0.5，topk=5，按 db_name 过滤）
-        ddl_list = vn.get_related_ddl(
-            question,
-            db_name=db_name,
-            threshold=0.5,
-            top_k=5
-        )
+        # 向量检索：问题只向量化一次，DDL / 文档 / 历史 SQL 并发检索（按 db_name 过滤）
+        retrieval = vn.retrieve_context(question, db_name=db_name, threshold=0.5, top_k=5)
+
+        # 1. 向量检索 DDL（阈值 0.5，topk=5）
+        ddl_list = retrieval.ddl_list
 
         # 2. 关键词增强：补充相关 DDL
         if keywords:
@@ -79,12 +75,8 @@ def get_table_schema(question: str) -> str:
             result_parts.append("相关表结构 (DDL):")
             result_parts.append("\n".join(ddl_list[:5]))
 
-        # 3. 向量检索文档（按 db_name 过滤）
-        doc_list = vn.get_related_documentation(
-            question,
-            db_name=db_name,
-            top_k=5
-        )
+        # 3. 向量检索文档
+        doc_list = retrieval.doc_list
 
         # 4. 关键词增强：补充相关文档
         if keywords:
@@ -96,12 +88,8 @@ def get_table_schema(question: str) -> str:
             for i, doc in enumerate(doc_list[:5], 1):
                 result_parts.append(f"\n[文档{i}]\n{doc}")
 
-        # 5. 历史 SQL 检索（按 db_name 过滤）
-        similar_pairs = vn.get_similar_question_sql(
-            question,
-            db_name=db_name,
-            top_k=3
-        )
+        # 5. 历史 SQL 检索（取前 3 条）
+        similar_pairs = retrieval.question_sql_list
         if similar_pairs:
             result_parts.append("\n\n历史相似查询:")
             for i, pair in enumerate(similar_pairs[:3], 1):
@@ -0,0 +1,17 @@
+"""
+训练数据模块
+提供训练数据的批量导入、后台训练决策队列等功能
+"""
+import logging
+logger = logging.getLogger(__name__)
+from .importer import TrainingDataImporter, ImportFileSpec, IMPORT_FILES, iter_json_records
+from .training_queue import TrainingQueue, question_hash
+
+__all__ = [
+    'TrainingDataImporter',
+    'ImportFileSpec',
+    'IMPORT_FILES',
+    'iter_json_records',
+    'TrainingQueue',
+    'question_hash',
+]
@@ -0,0 +1,409 @@
+"""
+训练数据流式导入
+从 ZIP 压缩包导入 ddl.jsonl / sql_parse.jsonl / doc.jsonl / plan.jsonl 到 Milvus：
+
+- 直接读取 ZIP 成员（不解压到磁盘），逐行解析（JSON 数组格式增量解析）
+- 按批次向量化，多个批次在有界线程池中并发执行
+- 同时在途的批次数有上限（背压），按块插入 Milvus，内存占用与文件大小无关
+- 每个批次完成后更新进度（日志 + 回调 + stats()）
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+import io
+import itertools
+import json
+import threading
+import time
+import uuid
+import zipfile
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, Dict, IO, Iterator, List, Optional, Tuple
+
+
+@dataclass(frozen=True)
+class ImportFileSpec:
+    """一个导入文件对应的集合和字段映射"""
+    filename: str
+    collection: str
+    field_map: Dict[str, str]  # 源字段 -> 集合字段
+    text_field: str            # 需要向量化的源字段
+    id_suffix: str
+
+
+IMPORT_FILES: Tuple[ImportFileSpec, ...] = (
+    ImportFileSpec(
+        filename="ddl.jsonl",
+        collection="vannaddl",
+        field_map={"db_name": "db_name", "table_name": "table_name", "ddl_doc": "ddl"},
+        text_field="ddl_doc",
+        id_suffix="-ddl",
+    ),
+    ImportFileSpec(
+        filename="sql_parse.jsonl",
+        collection="vannasql",
+        field_map={"db_name": "db_name", "question": "text", "sql": "sql", "tables": "tables"},
+        text_field="question",
+        id_suffix="-sql",
+    ),
+    ImportFileSpec(
+        filename="doc.jsonl",
+        collection="vannadoc",
+        field_map={"db_name": "db_name", "table_name": "table_name", "document": "doc"},
+        text_field="document",
+        id_suffix="-doc",
+    ),
+    ImportFileSpec(
+        filename="plan.jsonl",
+        collection="vannaplan",
+        field_map={"db_name": "db_name", "topic": "topic", "tables": "tables"},
+        text_field="topic",
+        id_suffix="-plan",
+    ),
+)
+
+
+# ==================== 增量解析 ====================
+
+_SEPARATORS = " \t\r\n,"
+
+
+def _iter_json_array(fp: IO[str], buf: str, chunk_size: int = 1 << 16) -> Iterator[Any]:
+    """
+    增量解析 JSON 数组，逐个返回数组元素
+
+    Args:
+        fp: 文本流（位于 buf 之后）
+        buf: 已读取的、'[' 之后的文本
+        chunk_size: 每次读取的字符数（缓冲区只保留当前元素附近的文本）
+    """
+    decoder = json.JSONDecoder()
+    pos = 0
+    eof = False
+
+    def read_more() -> bool:
+        nonlocal buf, pos, eof
+        chunk = fp.read(chunk_size)
+        if not chunk:
+            eof = True
+            return False
+        buf = buf[pos:] + chunk
+        pos = 0
+        return True
+
+    while True:
+        while pos < len(buf) and buf[pos] in _SEPARATORS:
+            pos += 1
+        if pos < len(buf) and buf[pos] == "]":
+            return
+        # 保证缓冲区中至少有 chunk_size 个待解析字符，解析失败才说明元素被截断或格式错误
+        if not eof and len(buf) - pos < chunk_size:
+            read_more()
+            continue
+        if pos >= len(buf):
+            logger.warning("[TrainingImport] JSON array is not closed")
+            return
+        try:
+            obj, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError as e:
+            if eof or not read_more():
+                logger.warning(f"[TrainingImport] Failed to parse JSON array: {e}")
+                return
+            continue
+        if end == len(buf) and not eof and read_more():
+            continue  # 数字等标量可能被截断，补充数据后重新解析
+        yield obj
+        pos = end
+
+
+def iter_json_records(fp: IO[str]) -> Iterator[Tuple[Optional[Dict[str, Any]], Optional[str]]]:
+    """
+    逐条读取训练数据文件，支持两种格式：
+    1. 标准jsonl格式：每行一个JSON对象
+    2. JSON数组格式：整个文件是一个JSON数组
+
+    Yields:
+        (记录, None)，或无法解析时 (None, 错误信息)
+    """
+    # 根据第一个非空白字符判断文件格式（单行的 JSON 数组也不会整行读入内存）
+    head = ""
+    while not head.strip():
+        chunk = fp.read(4096)
+        if not chunk:
+            return
+        head += chunk
+    head = head.lstrip()
+
+    if head.startswith("["):
+        for item in _iter_json_array(fp, head[1:]):
+            if isinstance(item, dict):
+                yield item, None
+            else:
+                yield None, f"Skipped non-object element: {type(item).__name__}"
+        return
+
+    # 补齐被截断的行后按行读取
+    lines = itertools.chain((head + fp.readline()).splitlines(), fp)
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield None, f"Failed to parse JSON line: {e}"
+            continue
+        if isinstance(record, dict):
+            yield record, None
+        else:
+            yield None, f"Skipped non-object line: {type(record).__name__}"
+
+
+# ==================== 导入器 ====================
+
+class TrainingDataImporter:
+    """
+    训练数据流式导入器（线程安全，可同时执行多个导入）
+
+    使用示例:
+        importer = TrainingDataImporter(vn, batch_size=64, workers=4)
+        summary = importer.import_zip("/tmp/train.zip", db_name="ecommerce")
+        # {"vannaddl": {"parsed": 12, "inserted": 12, "skipped": 0}, ...}
+    """
+
+    def __init__(
+        self,
+        vn,
+        batch_size: int = 64,
+        workers: int = 4,
+        insert_batch_size: int = 512,
+        max_pending_batches: Optional[int] = None,
+    ):
+        """
+        Args:
+            vn: Vanna 客户端（提供 embedding_function 和 milvus_client）
+            batch_size: 每次向量化请求的记录数
+            workers: 并发向量化的线程数
+            insert_batch_size: 每次插入 Milvus 的记录数
+            max_pending_batches: 同时在途（已读取未插入）的最大批次数，默认 workers * 2
+        """
+        if batch_size < 1 or workers < 1 or insert_batch_size < 1:
+            raise ValueError("batch_size, workers and insert_batch_size must be >= 1")
+
+        self.vn = vn
+        self.batch_size = batch_size
+        self.workers = workers
+        self.insert_batch_size = insert_batch_size
+        self.max_pending_batches = max_pending_batches or workers * 2
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="train-import")
+        self._lock = threading.Lock()
+        self._active: Dict[str, Dict[str, Any]] = {}
+        self._completed = 0
+        self._failed = 0
+
+    # ==================== 公开接口 ====================
+
+    def import_zip(
+        self,
+        zip_path: str,
+        db_name: str,
+        clear_before_import: bool = True,
+        progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+    ) -> Dict[str, Dict[str, int]]:
+        """
+        从 ZIP 文件导入训练数据到 Milvus（同步执行，应在工作线程中调用）
+
+        Args:
+            zip_path: ZIP 文件路径
+            db_name: 数据库名称，用于清理该数据库的现有数据
+            clear_before_import: 是否在导入前清理该数据库的现有数据
+            progress_callback: 每个批次插入后调用，参数为当前进度
+
+        Returns:
+            Dict: 每个集合的 parsed / inserted / skipped 数量
+
+        Raises:
+            ValueError: ZIP 文件无效或缺少必需文件
+        """
+        job_id = uuid.uuid4().hex[:12]
+        summary = {spec.collection: {"parsed": 0, "inserted": 0, "skipped": 0} for spec in IMPORT_FILES}
+        progress = {"db_name": db_name, "started_at": time.time(), "current": None, "summary": summary}
+        with self._lock:
+            self._active[job_id] = progress
+
+        try:
+            try:
+                zf = zipfile.ZipFile(zip_path, "r")
+            except zipfile.BadZipFile as e:
+                raise ValueError(f"Invalid ZIP file: {e}")
+
+            with zf:
+                members = self._resolve_members(zf)
+
+                if clear_before_import:
+                    self._clear_db(db_name)
+
+                for spec in IMPORT_FILES:
+                    progress["current"] = spec.filename
+                    with zf.open(members[spec.filename], "r") as raw:
+                        fp = io.TextIOWrapper(raw, encoding="utf-8-sig")
+                        self._import_file(spec, fp, summary[spec.collection], progress, progress_callback)
+                    logger.info(f"[TrainingImport] {spec.filename} -> {spec.collection}: {summary[spec.collection]}")
+
+            logger.info(
+                f"[TrainingImport] Import completed in {time.time() - progress['started_at']:.1f}s. Summary: {summary}"
+            )
+            with self._lock:
+                self._completed += 1
+            return summary
+        except Exception:
+            with self._lock:
+                self._failed += 1
+            raise
+        finally:
+            # 数据直接写入 Milvus，训练数据列表的记录数缓存和依赖训练数据的缓存需要失效
+            # （ZIP 中的记录可能带有其他 db_name，按全部变化通知）
+            self.vn.clear_training_count_cache()
+            self.vn.notify_training_changed()
+            with self._lock:
+                self._active.pop(job_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """导入器状态（进行中的导入及进度）"""
+        with self._lock:
+            active = [
+                {
+                    "db_name": p["db_name"],
+                    "current_file": p["current"],
+                    "elapsed": round(time.time() - p["started_at"], 1),
+                    "inserted": sum(s["inserted"] for s in p["summary"].values()),
+                }
+                for p in self._active.values()
+            ]
+            return {
+                "batch_size": self.batch_size,
+                "workers": self.workers,
+                "active": active,
+                "completed": self._completed,
+                "failed": self._failed,
+            }
+
+    def shutdown(self):
+        """关闭向量化线程池"""
+        self._executor.shutdown(wait=False)
+
+    # ==================== 内部实现 ====================
+
+    @staticmethod
+    def _resolve_members(zf: zipfile.ZipFile) -> Dict[str, str]:
+        """文件名 -> ZIP 成员名（允许文件位于压缩包内的单层目录中）"""
+        names = [n for n in zf.namelist() if not n.endswith("/")]
+        logger.info(f"[TrainingImport] ZIP members: {names}")
+        members: Dict[str, str] = {}
+        for name in names:
+            base = name.rsplit("/", 1)[-1]
+            if base in members and "/" in name:
+                continue  # 根目录的同名文件优先
+            members[base] = name
+
+        missing = {spec.filename for spec in IMPORT_FILES} - set(members)
+        if missing:
+            raise ValueError(f"Missing required files in ZIP: {missing}")
+        return members
+
+    def _clear_db(self, db_name: str):
+        """删除该 db_name 在四个集合中的现有数据"""
+        logger.info(f"[TrainingImport] Clearing existing data for db_name: {db_name}")
+        for spec in IMPORT_FILES:
+            try:
+                self.vn.delete_by_db_name(db_name, collections=[spec.collection])
+            except Exception as e:
+                logger.warning(f"[TrainingImport] Failed to clear {spec.collection}: {e}")
+
+    def _build_rows(self, spec: ImportFileSpec, records: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[str]]:
+        """构建待插入的记录（不含向量）和需要向量化的文本"""
+        rows, texts = [], []
+        for record in records:
+            # 生成唯一ID（使用UUID确保每次导入都是新记录）
+            row = {"id": str(uuid.uuid4()) + spec.id_suffix}
+            for src_field, dst_field in spec.field_map.items():
+                value = record.get(src_field, "")
+                # 处理tables字段：如果是数组则转为逗号分隔字符串
+                if dst_field == "tables" and isinstance(value, list):
+                    value = ",".join(value)
+                row[dst_field] = value
+            rows.append(row)
+            texts.append(record.get(spec.text_field, ""))
+        return rows, texts
+
+    def _embed_batch(self, rows: List[Dict[str, Any]], texts: List[str]) -> List[Dict[str, Any]]:
+        """在工作线程中向量化一个批次"""
+        embeddings = self.vn.embedding_function.encode_documents(texts)
+        for row, embedding in zip(rows, embeddings):
+            row["vector"] = embedding.tolist() if hasattr(embedding, "tolist") else embedding
+        return rows
+
+    def _import_file(
+        self,
+        spec: ImportFileSpec,
+        fp: IO[str],
+        counts: Dict[str, int],
+        progress: Dict[str, Any],
+        progress_callback: Optional[Callable[[Dict[str, Any]], None]],
+    ):
+        """
+        单个文件的导入流水线：读取 -> 批量向量化（并发）-> 分块插入
+
+        在途批次达到 max_pending_batches 时，先等待最早的批次完成并插入，再继续读取
+        """
+        pending: Deque[Future] = deque()
+        insert_buf: List[Dict[str, Any]] = []
+        batch: List[Dict[str, Any]] = []
+
+        def flush_inserts(force: bool = False):
+            while insert_buf and (force or len(insert_buf) >= self.insert_batch_size):
+                chunk = insert_buf[:self.insert_batch_size]
+                del insert_buf[:self.insert_batch_size]
+                self.vn.milvus_client.insert(collection_name=spec.collection, data=chunk)
+                counts["inserted"] += len(chunk)
+                logger.info(
+                    f"[TrainingImport] {spec.collection}: inserted {counts['inserted']}/{counts['parsed']}"
+                )
+                if progress_callback:
+                    try:
+                        progress_callback({"file": spec.filename, "collection": spec.collection, **counts})
+                    except Exception as e:
+                        logger.warning(f"[TrainingImport] Progress callback failed: {e}")
+
+        def collect_oldest():
+            insert_buf.extend(pending.popleft().result())
+            flush_inserts()
+
+        def submit(records: List[Dict[str, Any]]):
+            while len(pending) >= self.max_pending_batches:
+                collect_oldest()
+            rows, texts = self._build_rows(spec, records)
+            pending.append(self._executor.submit(self._embed_batch, rows, texts))
+
+        try:
+            for record, error in iter_json_records(fp):
+                if error:
+                    counts["skipped"] += 1
+                    logger.warning(f"[TrainingImport] {spec.filename}: {error}")
+                    continue
+                counts["parsed"] += 1
+                batch.append(record)
+                if len(batch) >= self.batch_size:
+                    submit(batch)
+                    batch = []
+            if batch:
+                submit(batch)
+            while pending:
+                collect_oldest()
+            flush_inserts(force=True)
+        finally:
+            # 出错时取消尚未开始的批次
+            for future in pending:
+                future.cancel()
@@ -0,0 +1,294 @@
+"""
+后台训练队列
+/api/v1/chat 开启 enable_training 时，训练决策（相似问题检索 + 两次结构化 LLM 调用 + 向量化写入）
+不再阻塞响应，而是把对话摘要写入本地 SQLite 队列，由后台工作线程异步处理：
+
+- 持久化：任务保存在 SQLite 文件中，进程重启后继续处理（中断的任务重新排队）
+- 去重：同一数据库下相同问题（规范化后哈希）已排队或处理中时不再入队（已完成的问题可再次评估，
+  训练数据变化后不会被旧任务挡住）
+- 重试：检索 / LLM / 写入失败时按指数退避重试，超过最大次数标记为 failed
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from ..shared import set_current_db_name
+
+
+# 任务状态
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS training_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    question_hash TEXT NOT NULL,
+    question TEXT NOT NULL,
+    db_name TEXT,
+    summary TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    next_run_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_training_jobs_status ON training_jobs (status, next_run_at);
+CREATE INDEX IF NOT EXISTS idx_training_jobs_hash ON training_jobs (question_hash);
+"""
+
+
+def question_hash(question: str, db_name: Optional[str] = None) -> str:
+    """问题去重键：数据库名 + 规范化（去首尾空白、合并空白、小写）后的问题"""
+    normalized = " ".join(question.split()).lower()
+    return hashlib.sha256(f"{db_name or ''}\n{normalized}".encode("utf-8")).hexdigest()
+
+
+class TrainingQueue:
+    """
+    SQLite 持久化的后台训练队列
+
+    使用示例:
+        queue = TrainingQueue(vn, "training_queue.db", workers=1)
+        queue.start()
+        queue.submit(question, final_event["messages"], db_name="ecommerce")
+        queue.stats()  # {"pending": 1, "running": 0, "done": 10, "failed": 0, ...}
+    """
+
+    def __init__(
+        self,
+        vanna_client,
+        db_path: str,
+        workers: int = 1,
+        max_attempts: int = 3,
+        retry_backoff: float = 30,
+        keep_finished: int = 1000,
+    ):
+        """
+        Args:
+            vanna_client: Vanna 客户端
+            db_path: SQLite 文件路径
+            workers: 后台工作线程数
+            max_attempts: 每个任务的最大尝试次数
+            retry_backoff: 首次重试的等待时间（秒），之后每次翻倍
+            keep_finished: 保留的已结束任务（done / failed）数量，超出时删除最早的
+        """
+        if workers < 1 or max_attempts < 1:
+            raise ValueError("workers and max_attempts must be >= 1")
+
+        self.vanna_client = vanna_client
+        self.db_path = db_path
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.keep_finished = keep_finished
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._stopping = False
+        self._threads: List[threading.Thread] = []
+        self._deduplicated = 0
+
+        with self._lock, self._conn:
+            self._conn.executescript(_SCHEMA)
+            # 上次进程退出时未完成的任务重新排队
+            recovered = self._conn.execute(
+                "UPDATE training_jobs SET status = ?, updated_at = ? WHERE status = ?",
+                (PENDING, time.time(), RUNNING),
+            ).rowcount
+        if recovered:
+            logger.info(f"[TrainingQueue] Re-queued {recovered} interrupted jobs")
+
+    # ==================== 公开接口 ====================
+
+    def start(self):
+        """启动后台工作线程"""
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"training-queue-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"[TrainingQueue] Started {self.workers} workers ({self.db_path})")
+
+    def shutdown(self, timeout: float = 5):
+        """停止工作线程（处理中的任务在下次启动时重新执行）"""
+        with self._wakeup:
+            self._stopping = True
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads.clear()
+        with self._lock:
+            self._conn.close()
+
+    def submit(self, question: str, messages: List[Any], db_name: Optional[str] = None) -> Dict[str, Any]:
+        """
+        提交一次对话的训练决策任务（只提取对话摘要，不访问外部服务）
+
+        Args:
+            question: 用户原始问题
+            messages: Agent 的完整消息历史
+            db_name: 请求路由的数据库名称（None 表示默认数据库）
+
+        Returns:
+            {"job_id": 任务ID, "deduplicated": 是否与已有任务重复}
+        """
+        from ..agent.post_training import extract_conversation_summary
+
+        summary = extract_conversation_summary(messages)
+        key = question_hash(question, db_name)
+        now = time.time()
+
+        with self._lock, self._conn:
+            existing = self._conn.execute(
+                "SELECT id FROM training_jobs WHERE question_hash = ? AND status IN (?, ?) LIMIT 1",
+                (key, PENDING, RUNNING),
+            ).fetchone()
+            if existing:
+                self._deduplicated += 1
+                logger.info(f"[TrainingQueue] Question already queued (job {existing['id']}), skipped")
+                return {"job_id": existing["id"], "deduplicated": True}
+
+            job_id = self._conn.execute(
+                "INSERT INTO training_jobs (question_hash, question, db_name, summary, status, "
+                "created_at, updated_at, next_run_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, question, db_name, json.dumps(summary, ensure_ascii=False, default=str),
+                 PENDING, now, now, now),
+            ).lastrowid
+
+        with self._wakeup:
+            self._wakeup.notify()
+        logger.info(f"[TrainingQueue] Job {job_id} queued")
+        return {"job_id": job_id, "deduplicated": False}
+
+    def stats(self) -> Dict[str, Any]:
+        """队列状态（各状态任务数、队列深度）"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) AS n FROM training_jobs GROUP BY status"
+            ).fetchall()
+        counts = {PENDING: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+        counts.update({row["status"]: row["n"] for row in rows})
+        return {
+            "depth": counts[PENDING] + counts[RUNNING],
+            **counts,
+            "deduplicated": self._deduplicated,
+            "workers": self.workers,
+        }
+
+    def list_jobs(self, status: Optional[str] = None, limit: int = 20) -> List[Dict[str, Any]]:
+        """最近的任务（按 ID 倒序，不含对话摘要）"""
+        sql = (
+            "SELECT id, question, db_name, status, attempts, result, error, created_at, updated_at "
+            "FROM training_jobs"
+        )
+        params: tuple = ()
+        if status:
+            sql += " WHERE status = ?"
+            params = (status,)
+        sql += " ORDER BY id DESC LIMIT ?"
+        with self._lock:
+            rows = self._conn.execute(sql, params + (limit,)).fetchall()
+        return [dict(row) for row in rows]
+
+    # ==================== 内部实现 ====================
+
+    def _claim(self) -> Optional[sqlite3.Row]:
+        """取出一个到期的待处理任务并标记为 running"""
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT * FROM training_jobs WHERE status = ? AND next_run_at <= ? ORDER BY id LIMIT 1",
+                (PENDING, now),
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE training_jobs SET status = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                (RUNNING, now, row["id"]),
+            )
+            return row
+
+    def _next_due_in(self) -> float:
+        """距离最早的待处理任务到期的秒数（没有任务时返回默认轮询间隔）"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MIN(next_run_at) AS t FROM training_jobs WHERE status = ?", (PENDING,)
+            ).fetchone()
+        if row is None or row["t"] is None:
+            return 60.0
+        return max(0.0, min(60.0, row["t"] - time.time()))
+
+    def _finish(self, job_id: int, status: str, result: Optional[str] = None,
+                error: Optional[str] = None, next_run_at: Optional[float] = None):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE training_jobs SET status = ?, result = ?, error = ?, updated_at = ?, "
+                "next_run_at = COALESCE(?, next_run_at) WHERE id = ?",
+                (status, result, error, now, next_run_at, job_id),
+            )
+            if status in (DONE, FAILED) and self.keep_finished > 0:
+                self._conn.execute(
+                    "DELETE FROM training_jobs WHERE status IN (?, ?) AND id NOT IN ("
+                    "SELECT id FROM training_jobs WHERE status IN (?, ?) ORDER BY id DESC LIMIT ?)",
+                    (DONE, FAILED, DONE, FAILED, self.keep_finished),
+                )
+
+    def _process(self, job: sqlite3.Row) -> str:
+        from ..agent.post_training import PostTrainingProcessor
+
+        set_current_db_name(job["db_name"])
+        processor = PostTrainingProcessor()
+        return processor.decide_from_summary(
+            question=job["question"],
+            summary=json.loads(job["summary"]),
+            vanna_client=self.vanna_client,
+        )
+
+    def _worker(self):
+        while True:
+            with self._wakeup:
+                if self._stopping:
+                    return
+            try:
+                self._run_once()
+            except sqlite3.ProgrammingError:
+                return  # 队列已关闭
+
+    def _run_once(self):
+        job = self._claim()
+        if job is None:
+            with self._wakeup:
+                if not self._stopping:
+                    self._wakeup.wait(self._next_due_in())
+            return
+
+        attempts = job["attempts"] + 1
+        try:
+            result = self._process(job)
+        except Exception as e:
+            if attempts < self.max_attempts:
+                delay = self.retry_backoff * (2 ** (attempts - 1))
+                logger.warning(
+                    f"[TrainingQueue] Job {job['id']} failed (attempt {attempts}/{self.max_attempts}), "
+                    f"retrying in {delay:.0f}s: {e}"
+                )
+                self._finish(job["id"], PENDING, error=str(e), next_run_at=time.time() + delay)
+            else:
+                logger.error(f"[TrainingQueue] Job {job['id']} failed after {attempts} attempts: {e}")
+                self._finish(job["id"], FAILED, error=str(e))
+            return
+
+        logger.info(f"[TrainingQueue] Job {job['id']} done: {result}")
+        self._finish(job["id"], DONE, result=result)
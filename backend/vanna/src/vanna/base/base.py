@@ -50,6 +50,7 @@ flowchart
 
 import logging
 logger = logging.getLogger(__name__)
+import asyncio
 import json
 import os
 import re
@@ -67,7 +68,7 @@ import requests
 import sqlparse
 
 from ..exceptions import DependencyError, ImproperlyConfigured, ValidationError
-from ..types import TrainingPlan, TrainingPlanItem
+from ..types import RetrievalContext, TrainingPlan, TrainingPlanItem
 from ..utils import validate_config_path
 
 
@@ -115,6 +116,7 @@ class VannaBase(ABC):
         Args:
             question (str): The question to generate a SQL query for.
             allow_llm_to_see_data (bool): Whether to allow the LLM to see the data (for the purposes of introspecting the data to generate the final SQL).
+            retrieval (RetrievalContext, optional): Precomputed context from `retrieve_context`; retrieved here when omitted.
 
         Returns:
             str: The SQL query that answers the question.
@@ -123,9 +125,10 @@ class VannaBase(ABC):
             initial_prompt = self.config.get("initial_prompt", None)
         else:
             initial_prompt = None
-        question_sql_list = self.get_similar_question_sql(question, **kwargs)
-        ddl_list = self.get_related_ddl(question, **kwargs)
-        doc_list = self.get_related_documentation(question, **kwargs)
+        retrieval = kwargs.pop("retrieval", None) or self.retrieve_context(question, **kwargs)
+        question_sql_list = retrieval.question_sql_list
+        ddl_list = retrieval.ddl_list
+        doc_list = retrieval.doc_list
         prompt = self.get_sql_prompt(
             initial_prompt=initial_prompt,
             question=question,
@@ -414,6 +417,42 @@ class VannaBase(ABC):
         """
         pass
 
+    def retrieve_context(self, question: str, **kwargs) -> RetrievalContext:
+        """
+        Retrieve everything `generate_sql` needs for a question in one call.
+
+        The default implementation runs the individual retrieval methods one after
+        another; vector stores can override it to embed once and search concurrently.
+
+        Args:
+            question (str): The question to retrieve context for.
+
+        Returns:
+            RetrievalContext: Similar question/SQL pairs, related DDL and documentation.
+        """
+        return RetrievalContext(
+            question=question,
+            db_name=kwargs.get("db_name", "") or "",
+            question_sql_list=self.get_similar_question_sql(question, **kwargs),
+            ddl_list=self.get_related_ddl(question, **kwargs),
+            doc_list=self.get_related_documentation(question, **kwargs),
+        )
+
+    async def aretrieve_context(self, question: str, **kwargs) -> RetrievalContext:
+        """
+        Async counterpart of `retrieve_context` for use inside an event loop.
+
+        The default implementation runs `retrieve_context` in a worker thread so the
+        loop is never blocked; vector stores can override it with native async calls.
+
+        Args:
+            question (str): The question to retrieve context for.
+
+        Returns:
+            RetrievalContext: Same as `retrieve_context`.
+        """
+        return await asyncio.to_thread(self.retrieve_context, question, **kwargs)
+
     @abstractmethod
     def get_related_documentation(self, question: str, **kwargs) -> list:
         """
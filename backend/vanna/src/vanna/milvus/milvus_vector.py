@@ -1,10 +1,16 @@
+import asyncio
+import threading
+import time
 import uuid
-from typing import List
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
 
 import pandas as pd
 from pymilvus import DataType, MilvusClient, model
 
 from ..base import VannaBase
+from ..types import RetrievalContext
 import logging
 logger = logging.getLogger(__name__)
 
@@ -20,7 +26,26 @@ logger = logging.getLogger(__name__)
 DEFAULT_MILVUS_URI = "./milvus.db"
 # DEFAULT_MILVUS_URI = "http://localhost:19530"
 
-MAX_LIMIT_SIZE = 10_000
+# Milvus query 的 offset + limit 上限，超出时需要用查询迭代器（scan）读取
+MAX_QUERY_WINDOW = 16_384
+# scan 默认每批读取的记录数
+DEFAULT_SCAN_BATCH_SIZE = 1_000
+
+# 训练数据集合 -> (data_type, {返回列: 集合字段})，顺序即训练数据列表的排列顺序
+TRAINING_COLLECTIONS = {
+    "vannasql": ("sql", {"question": "text", "content": "sql", "db_name": "db_name", "tables": "tables"}),
+    "vannaddl": ("ddl", {"content": "ddl", "db_name": "db_name", "table_name": "table_name"}),
+    "vannadoc": ("documentation", {"content": "doc", "db_name": "db_name", "table_name": "table_name"}),
+    "vannaplan": ("plan", {"content": "topic", "db_name": "db_name", "tables": "tables"}),
+}
+TRAINING_DATA_TYPES = {
+    "sql": "vannasql",
+    "ddl": "vannaddl",
+    "doc": "vannadoc",
+    "documentation": "vannadoc",
+    "plan": "vannaplan",
+}
+TRAINING_DATA_COLUMNS = ["id", "question", "content", "db_name", "tables", "table_name", "data_type"]
 
 
 class Milvus_VectorStore(VannaBase):
@@ -35,6 +60,10 @@ class Milvus_VectorStore(VannaBase):
                 For more models, please refer to:
                 https://milvus.io/docs/embeddings.md
             - metric_type: Vector similarity metric type. Options: 'L2', 'COSINE', 'IP'. Defaults to 'L2'.
+            - retrieval_memo_ttl: Seconds a `retrieve_context` result is reused for the same question (new training
+                data becomes visible after at most this delay). Defaults to 30; 0 disables reuse.
+            - count_cache_ttl: Seconds a training data count used by `list_training_data` is cached. Counts are
+                also invalidated by add/remove through this store. Defaults to 60; 0 disables caching.
     """
     def __init__(self, config=None):
         VannaBase.__init__(self, config=config)
@@ -75,6 +104,17 @@ class Milvus_VectorStore(VannaBase):
         self._create_collections()
         self.n_results = config.get("n_results", 10)
 
+        # retrieve_context: 四个集合的检索并发执行，结果短时间复用（同一问题会被多个工具检索）
+        self._retrieval_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="milvus-retrieve")
+        self._retrieval_memo_ttl = float(config.get("retrieval_memo_ttl", 30))
+        self._retrieval_memo: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._retrieval_memo_lock = threading.Lock()
+
+        # list_training_data: 每个集合（+ db_name 过滤）的记录数缓存
+        self._count_cache_ttl = float(config.get("count_cache_ttl", 60))
+        self._count_cache: Dict[tuple, tuple] = {}
+        self._count_cache_lock = threading.Lock()
+
     def _create_collections(self):
         self._create_sql_collection("vannasql")
         self._create_ddl_collection("vannaddl")
@@ -213,6 +253,7 @@ class Milvus_VectorStore(VannaBase):
                 "vector": embedding
             }
         )
+        self._invalidate_counts("vannasql")
         return _id
 
     def add_ddl(self, ddl: str, **kwargs) -> str:
@@ -232,6 +273,7 @@ class Milvus_VectorStore(VannaBase):
                 "vector": embedding
             }
         )
+        self._invalidate_counts("vannaddl")
         return _id
 
     def add_documentation(self, documentation: str, **kwargs) -> str:
@@ -251,6 +293,7 @@ class Milvus_VectorStore(VannaBase):
                 "vector": embedding
             }
         )
+        self._invalidate_counts("vannadoc")
         return _id
 
     def add_plan(self, topic: str, **kwargs) -> str:
@@ -271,13 +314,14 @@ class Milvus_VectorStore(VannaBase):
                 "vector": embedding
             }
         )
+        self._invalidate_counts("vannaplan")
         return _id
 
     def get_training_data(self, **kwargs) -> pd.DataFrame:
-        sql_data = self.milvus_client.query(
+        # 用查询迭代器读取全部记录（不受 query 的 limit 上限截断）
+        sql_data = self._scan_all(
             collection_name="vannasql",
-            output_fields=["*"],
-            limit=MAX_LIMIT_SIZE,
+            output_fields=["id", "text", "sql", "db_name", "tables"],
         )
         df = pd.DataFrame()
         df_sql = pd.DataFrame(
@@ -291,10 +335,9 @@ class Milvus_VectorStore(VannaBase):
         )
         df = pd.concat([df, df_sql])
 
-        ddl_data = self.milvus_client.query(
+        ddl_data = self._scan_all(
             collection_name="vannaddl",
-            output_fields=["*"],
-            limit=MAX_LIMIT_SIZE,
+            output_fields=["id", "ddl", "db_name", "table_name"],
         )
 
         df_ddl = pd.DataFrame(
@@ -308,10 +351,9 @@ class Milvus_VectorStore(VannaBase):
         )
         df = pd.concat([df, df_ddl])
 
-        doc_data = self.milvus_client.query(
+        doc_data = self._scan_all(
             collection_name="vannadoc",
-            output_fields=["*"],
-            limit=MAX_LIMIT_SIZE,
+            output_fields=["id", "doc", "db_name", "table_name"],
         )
 
         df_doc = pd.DataFrame(
@@ -325,10 +367,9 @@ class Milvus_VectorStore(VannaBase):
         )
         df = pd.concat([df, df_doc])
 
-        plan_data = self.milvus_client.query(
+        plan_data = self._scan_all(
             collection_name="vannaplan",
-            output_fields=["*"],
-            limit=MAX_LIMIT_SIZE,
+            output_fields=["id", "topic", "db_name", "tables"],
         )
 
         df_plan = pd.DataFrame(
@@ -343,6 +384,320 @@ class Milvus_VectorStore(VannaBase):
         df = pd.concat([df, df_plan])
         return df
 
+    def scan(
+        self,
+        collection_name: str,
+        filter: str = "",
+        output_fields: Optional[List[str]] = None,
+        batch_size: int = DEFAULT_SCAN_BATCH_SIZE,
+    ) -> Iterator[List[dict]]:
+        """
+        按主键顺序分批读取集合中的记录（基于 Milvus 查询迭代器，没有 limit 上限和 offset 翻页开销）
+
+        迭代器以主键为游标，遍历过程中删除已读取的记录不会导致漏读
+
+        Args:
+            collection_name: 集合名称
+            filter: 过滤表达式（为空时读取全部）
+            output_fields: 返回字段，默认为训练数据字段（不含向量）
+            batch_size: 每批记录数
+
+        Yields:
+            每批记录（dict 列表）
+        """
+        if output_fields is None:
+            output_fields = ["id"] + list(TRAINING_COLLECTIONS.get(collection_name, ("", {}))[1].values())
+        batch_size = max(1, min(batch_size, MAX_QUERY_WINDOW))
+
+        if hasattr(self.milvus_client, "query_iterator"):
+            iterator = self.milvus_client.query_iterator(
+                collection_name=collection_name,
+                filter=filter,
+                output_fields=output_fields,
+                batch_size=batch_size,
+            )
+        else:
+            # 旧版 pymilvus 的 MilvusClient 没有 query_iterator，使用同一连接上的 ORM Collection
+            from pymilvus import Collection
+
+            iterator = Collection(collection_name, using=self.milvus_client._using).query_iterator(
+                batch_size=batch_size,
+                expr=filter,
+                output_fields=output_fields,
+            )
+        try:
+            while True:
+                batch = iterator.next()
+                if not batch:
+                    return
+                yield batch
+        finally:
+            iterator.close()
+
+    def _scan_all(self, collection_name: str, output_fields: List[str], filter: str = "") -> List[dict]:
+        rows: List[dict] = []
+        for batch in self.scan(collection_name, filter=filter, output_fields=output_fields):
+            rows.extend(batch)
+        return rows
+
+    def list_training_data(
+        self,
+        limit: int = 100,
+        offset: int = 0,
+        data_type: Optional[str] = None,
+        db_name: Optional[str] = None,
+    ) -> Tuple[List[dict], int]:
+        """
+        分页读取训练数据（分页和过滤下推到 Milvus，不返回向量）
+
+        四个集合按 vannasql / vannaddl / vannadoc / vannaplan 的顺序排列，
+        根据各集合的记录数（带缓存）计算出需要读取的集合和集合内偏移
+
+        Args:
+            limit: 返回数量
+            offset: 偏移量
+            data_type: 数据类型过滤（'sql' / 'ddl' / 'doc' / 'documentation' / 'plan'，其他值不过滤）
+            db_name: 数据库名称过滤
+
+        Returns:
+            (记录列表, 过滤后的总数)；记录字段见 TRAINING_DATA_COLUMNS
+        """
+        collection = TRAINING_DATA_TYPES.get((data_type or "").lower())
+        collections = [collection] if collection else list(TRAINING_COLLECTIONS)
+        filter_expr = self._db_name_filter(db_name)
+
+        records: List[dict] = []
+        total = 0
+        for name in collections:
+            count = self.count_training_data(name, db_name=db_name)
+            # 本集合在整体列表中的区间为 [total, total + count)
+            start = max(offset - total, 0)
+            remaining = limit - len(records)
+            total += count
+            if remaining <= 0 or start >= count:
+                continue
+            rows = self._query_page(name, filter_expr, start, min(remaining, count - start))
+            records.extend(self._to_training_record(name, row) for row in rows)
+        return records, total
+
+    def count_training_data(self, collection_name: str, db_name: Optional[str] = None) -> int:
+        """集合中的记录数（可按 db_name 过滤，结果缓存 count_cache_ttl 秒）"""
+        key = (collection_name, db_name or "")
+        if self._count_cache_ttl > 0:
+            with self._count_cache_lock:
+                entry = self._count_cache.get(key)
+            if entry is not None and time.time() - entry[1] <= self._count_cache_ttl:
+                return entry[0]
+
+        res = self.milvus_client.query(
+            collection_name=collection_name,
+            filter=self._db_name_filter(db_name),
+            output_fields=["count(*)"],
+        )
+        count = int(res[0]["count(*)"]) if res else 0
+        if self._count_cache_ttl > 0:
+            with self._count_cache_lock:
+                self._count_cache[key] = (count, time.time())
+        return count
+
+    def clear_training_count_cache(self):
+        """清空训练数据记录数缓存（绕过本类直接写入 Milvus 后调用）"""
+        self._invalidate_counts()
+
+    def _invalidate_counts(self, collection_name: Optional[str] = None):
+        with self._count_cache_lock:
+            for key in list(self._count_cache):
+                if collection_name is None or key[0] == collection_name:
+                    del self._count_cache[key]
+
+    @staticmethod
+    def _db_name_filter(db_name: Optional[str]) -> str:
+        if not db_name:
+            return ""
+        escaped = db_name.replace("\\", "\\\\").replace('"', '\\"')
+        return f'db_name == "{escaped}"'
+
+    def _query_page(self, collection_name: str, filter_expr: str, offset: int, limit: int) -> List[dict]:
+        """读取集合中按主键排序的第 [offset, offset + limit) 条记录"""
+        fields = ["id"] + list(TRAINING_COLLECTIONS[collection_name][1].values())
+        if offset + limit <= MAX_QUERY_WINDOW:
+            return self.milvus_client.query(
+                collection_name=collection_name,
+                filter=filter_expr,
+                output_fields=fields,
+                offset=offset,
+                limit=limit,
+            )
+
+        # 超出 query 窗口时用查询迭代器跳过前面的记录
+        rows: List[dict] = []
+        skipped = 0
+        batches = self.scan(
+            collection_name,
+            filter=filter_expr,
+            output_fields=fields,
+            batch_size=max(limit, DEFAULT_SCAN_BATCH_SIZE),
+        )
+        for batch in batches:
+            if skipped + len(batch) <= offset:
+                skipped += len(batch)
+                continue
+            start = max(offset - skipped, 0)
+            skipped += start
+            rows.extend(batch[start:start + limit - len(rows)])
+            if len(rows) >= limit:
+                batches.close()
+                break
+        return rows
+
+    @staticmethod
+    def _to_training_record(collection_name: str, row: dict) -> dict:
+        data_type, fields = TRAINING_COLLECTIONS[collection_name]
+        record = dict.fromkeys(TRAINING_DATA_COLUMNS)
+        record["id"] = row["id"]
+        for column, field in fields.items():
+            record[column] = row.get(field, "")
+        record["data_type"] = data_type
+        return record
+
+    def _query_embeddings(self, question: str, embeddings=None):
+        """返回查询向量（已提供时直接复用，避免重复向量化）"""
+        if embeddings is not None:
+            return embeddings
+        return self.embedding_function.encode_queries([question])
+
+    def retrieve_context(self, question: str, **kwargs) -> RetrievalContext:
+        """
+        一次调用完成 RAG 检索：问题只向量化一次，四个集合（vannasql / vannaddl /
+        vannadoc / vannaplan）并发检索，耗时约等于最慢的单次检索
+
+        Args:
+            question: 用户问题
+            db_name: 数据库名称（用于过滤；为空时不检索 vannaplan）
+            top_k: 每个集合的返回数量，默认 5
+            threshold: DDL 相似度阈值，默认 0.5
+            plan_threshold: 业务计划相似度阈值，默认 0.75
+
+        Returns:
+            RetrievalContext: 单个集合检索失败时对应字段为空，错误记录在 errors 中
+        """
+        memo_key = self._retrieval_memo_key(question, kwargs)
+        cached = self._get_retrieval_memo(memo_key)
+        if cached is not None:
+            logger.info(f"[retrieve_context] Reusing retrieval for db_name={memo_key[1]!r}")
+            return cached
+
+        embeddings = self.embedding_function.encode_queries([question])
+        searches = self._retrieval_searches(memo_key, embeddings)
+
+        start = time.time()
+        futures = {name: self._retrieval_executor.submit(fn) for name, fn in searches.items()}
+        context = RetrievalContext(question=question, db_name=memo_key[1])
+        for name, future in futures.items():
+            try:
+                setattr(context, name, future.result())
+            except Exception as e:
+                logger.warning(f"[retrieve_context] {name} search failed: {e}")
+                context.errors[name] = str(e)
+        return self._finish_retrieval(memo_key, context, start)
+
+    async def aretrieve_context(self, question: str, **kwargs) -> RetrievalContext:
+        """
+        retrieve_context 的异步版本：问题通过异步嵌入接口向量化，四个集合的检索
+        在检索线程池中执行，事件循环只等待结果，参数与返回值同 retrieve_context
+        """
+        memo_key = self._retrieval_memo_key(question, kwargs)
+        cached = self._get_retrieval_memo(memo_key)
+        if cached is not None:
+            logger.info(f"[retrieve_context] Reusing retrieval for db_name={memo_key[1]!r}")
+            return cached
+
+        aencode_queries = getattr(self.embedding_function, "aencode_queries", None)
+        if aencode_queries is not None:
+            embeddings = await aencode_queries([question])
+        else:
+            embeddings = await asyncio.to_thread(self.embedding_function.encode_queries, [question])
+        searches = self._retrieval_searches(memo_key, embeddings)
+
+        start = time.time()
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(
+            *(loop.run_in_executor(self._retrieval_executor, fn) for fn in searches.values()),
+            return_exceptions=True,
+        )
+        context = RetrievalContext(question=question, db_name=memo_key[1])
+        for name, result in zip(searches, results):
+            if isinstance(result, Exception):
+                logger.warning(f"[retrieve_context] {name} search failed: {result}")
+                context.errors[name] = str(result)
+            else:
+                setattr(context, name, result)
+        return self._finish_retrieval(memo_key, context, start)
+
+    @staticmethod
+    def _retrieval_memo_key(question: str, kwargs: dict) -> tuple:
+        """(question, db_name, top_k, threshold, plan_threshold)"""
+        return (
+            question,
+            kwargs.get("db_name", "") or "",
+            kwargs.get("top_k", 5),
+            kwargs.get("threshold", 0.5),
+            kwargs.get("plan_threshold", 0.75),
+        )
+
+    def _retrieval_searches(self, memo_key: tuple, embeddings) -> dict:
+        """RetrievalContext 字段名 -> 检索函数（共用同一个查询向量）"""
+        question, db_name, top_k, threshold, plan_threshold = memo_key
+        common = {"db_name": db_name, "top_k": top_k, "embeddings": embeddings}
+
+        searches = {
+            "question_sql_list": lambda: self.get_similar_question_sql(question, **common),
+            "ddl_list": lambda: self.get_related_ddl(question, threshold=threshold, **common),
+            "doc_list": lambda: self.get_related_documentation(question, **common),
+        }
+        if db_name:
+            searches["plan_tables"] = lambda: self.get_related_plan_tables(
+                question, db_name=db_name, threshold=plan_threshold, top_k=top_k, embeddings=embeddings
+            )
+        return searches
+
+    def _finish_retrieval(self, memo_key: tuple, context: RetrievalContext, start: float) -> RetrievalContext:
+        searches = 4 if context.db_name else 3
+        logger.info(
+            f"[retrieve_context] {searches} searches in {time.time() - start:.3f}s "
+            f"(sql={len(context.question_sql_list)}, ddl={len(context.ddl_list)}, "
+            f"doc={len(context.doc_list)}, plan={len(context.plan_tables)})"
+        )
+        if not context.errors:
+            self._put_retrieval_memo(memo_key, context)
+        return context
+
+    def _get_retrieval_memo(self, key: tuple):
+        if self._retrieval_memo_ttl <= 0:
+            return None
+        with self._retrieval_memo_lock:
+            entry = self._retrieval_memo.get(key)
+            if entry is None:
+                return None
+            context, ts = entry
+            if time.time() - ts > self._retrieval_memo_ttl:
+                del self._retrieval_memo[key]
+                return None
+            return context
+
+    def _put_retrieval_memo(self, key: tuple, context: RetrievalContext):
+        if self._retrieval_memo_ttl <= 0:
+            return
+        with self._retrieval_memo_lock:
+            self._retrieval_memo[key] = (context, time.time())
+            while len(self._retrieval_memo) > 128:
+                self._retrieval_memo.popitem(last=False)
+
+    def clear_retrieval_memo(self):
+        """清空 retrieve_context 的结果复用（训练数据变化后调用）"""
+        with self._retrieval_memo_lock:
+            self._retrieval_memo.clear()
+
     def get_similar_question_sql(self, question: str, **kwargs) -> list:
         """
         获取与问题相似的历史查询 SQL
@@ -351,6 +706,7 @@ class Milvus_VectorStore(VannaBase):
             question: 用户问题
             db_name: 数据库名称（用于过滤）
             top_k: 返回数量，默认 5
+            embeddings: 预先计算的查询向量（可选）
         """
         db_name = kwargs.get("db_name", "")
         top_k = kwargs.get("top_k", 5)
@@ -359,7 +715,7 @@ class Milvus_VectorStore(VannaBase):
             "metric_type": self.metric_type,
             "params": {"nprobe": 128},
         }
-        embeddings = self.embedding_function.encode_queries([question])
+        embeddings = self._query_embeddings(question, kwargs.get("embeddings"))
 
         # 如果提供了 db_name，添加过滤条件
         filter_expr = f'db_name == "{db_name}"' if db_name else None
@@ -393,6 +749,7 @@ class Milvus_VectorStore(VannaBase):
             db_name: 数据库名称（用于过滤）
             threshold: 相似度阈值，默认 0.5
             top_k: 返回数量，默认 5
+            embeddings: 预先计算的查询向量（可选）
         """
         db_name = kwargs.get("db_name", "")
         threshold = kwargs.get("threshold", 0.5)
@@ -402,7 +759,7 @@ class Milvus_VectorStore(VannaBase):
             "metric_type": self.metric_type,
             "params": {"nprobe": 128},
         }
-        embeddings = self.embedding_function.encode_queries([question])
+        embeddings = self._query_embeddings(question, kwargs.get("embeddings"))
 
         # 如果提供了 db_name，添加过滤条件
         filter_expr = f'db_name == "{db_name}"' if db_name else None
@@ -434,6 +791,7 @@ class Milvus_VectorStore(VannaBase):
             question: 用户问题
             db_name: 数据库名称（用于过滤）
             top_k: 返回数量，默认 5
+            embeddings: 预先计算的查询向量（可选）
         """
         db_name = kwargs.get("db_name", "")
         top_k = kwargs.get("top_k", 5)
@@ -442,7 +800,7 @@ class Milvus_VectorStore(VannaBase):
             "metric_type": self.metric_type,
             "params": {"nprobe": 128},
         }
-        embeddings = self.embedding_function.encode_queries([question])
+        embeddings = self._query_embeddings(question, kwargs.get("embeddings"))
 
         # 如果提供了 db_name，添加过滤条件
         filter_expr = f'db_name == "{db_name}"' if db_name else None
@@ -472,6 +830,7 @@ class Milvus_VectorStore(VannaBase):
             db_name: 数据库名称
             threshold: 相似度阈值，默认 0.75（高于此阈值认为相关）
             top_k: 返回数量，默认 5
+            embeddings: 预先计算的查询向量（可选）
 
         Returns:
             list: 相关的表名列表（去重，按大小写不敏感）
@@ -483,7 +842,7 @@ class Milvus_VectorStore(VannaBase):
             "metric_type": self.metric_type,
             "params": {"nprobe": 128},
         }
-        embeddings = self.embedding_function.encode_queries([question])
+        embeddings = self._query_embeddings(question, kwargs.get("embeddings"))
 
         # 先按 db_name 过滤，再进行向量搜索
         filter_expr = f'db_name == "{db_name}"'
@@ -610,16 +969,15 @@ class Milvus_VectorStore(VannaBase):
 
     def remove_training_data(self, id: str, **kwargs) -> bool:
         if id.endswith("-sql"):
-            self.milvus_client.delete(collection_name="vannasql", ids=[id])
-            return True
+            collection_name = "vannasql"
         elif id.endswith("-ddl"):
-            self.milvus_client.delete(collection_name="vannaddl", ids=[id])
-            return True
+            collection_name = "vannaddl"
         elif id.endswith("-doc"):
-            self.milvus_client.delete(collection_name="vannadoc", ids=[id])
-            return True
+            collection_name = "vannadoc"
         elif id.endswith("-plan"):
-            self.milvus_client.delete(collection_name="vannaplan", ids=[id])
-            return True
+            collection_name = "vannaplan"
         else:
             return False
+        self.milvus_client.delete(collection_name=collection_name, ids=[id])
+        self._invalidate_counts(collection_name)
+        return True
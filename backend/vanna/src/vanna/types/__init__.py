@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Dict, List, Union
 import logging
 logger = logging.getLogger(__name__)
@@ -213,6 +213,18 @@ class TrainingData:
     documentation: List[str]
 
 
+@dataclass
+class RetrievalContext:
+    """RAG context retrieved for one question (see VannaBase.retrieve_context)."""
+    question: str
+    db_name: str = ""
+    question_sql_list: List[dict] = field(default_factory=list)
+    ddl_list: List[str] = field(default_factory=list)
+    doc_list: List[str] = field(default_factory=list)
+    plan_tables: List[str] = field(default_factory=list)
+    errors: Dict[str, str] = field(default_factory=dict)
+
+
 @dataclass
 class TrainingPlanItem:
     item_type: str
@@ -0,0 +1,105 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import asyncio
+import threading
+
+import pytest
+
+from src.Improve.agent.executor import AgentRunner
+
+
+class FakeAgent:
+    def __init__(self):
+        self.started = []
+        self.release = threading.Event()
+
+    def stream(self, inputs, stream_mode=None, config=None):
+        question = inputs["messages"][-1]["content"]
+        self.started.append(question)
+        if question == "slow":
+            self.release.wait(5)
+        if question == "fail":
+            raise RuntimeError("boom")
+        yield {"step": 1, "question": question}
+        yield {"step": 2, "question": question}
+
+
+def inputs(question):
+    return {"messages": [{"role": "user", "content": question}]}
+
+
+async def wait_for(predicate, timeout=5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        assert asyncio.get_running_loop().time() < deadline
+        await asyncio.sleep(0.01)
+
+
+def test_stream_and_stats():
+    async def scenario():
+        runner = AgentRunner(FakeAgent(), max_concurrent_runs=2)
+        events = [e async for e in runner.stream(inputs("q"), run_id="r1")]
+        assert [e["step"] for e in events] == [1, 2]
+        assert (await runner.invoke(inputs("q")))["step"] == 2
+        with pytest.raises(RuntimeError):
+            await runner.invoke(inputs("fail"))
+        stats = runner.stats()
+        assert stats["completed"] == 2 and stats["failed"] == 1
+        assert stats["running"] == 0 and stats["queue_depth"] == 0
+        runner.shutdown(wait=True)
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_queued_run_never_starts():
+    async def scenario():
+        agent = FakeAgent()
+        runner = AgentRunner(agent, max_concurrent_runs=1)
+        slow = asyncio.create_task(runner.invoke(inputs("slow")))
+        await wait_for(lambda: agent.started == ["slow"])
+
+        queued = runner.stream(inputs("queued"))
+        first = asyncio.create_task(queued.__anext__())
+        await wait_for(lambda: runner.stats()["queue_depth"] == 1)
+        assert runner.stats()["running"] == 1
+
+        # 客户端在排队期间断开
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        agent.release.set()
+        await slow
+
+        await wait_for(lambda: runner.stats()["cancelled"] == 1)
+        assert agent.started == ["slow"]
+        assert runner.stats()["queue_depth"] == 0
+        runner.shutdown(wait=True)
+
+    asyncio.run(scenario())
+
+
+def test_shutdown_ends_queued_stream():
+    async def scenario():
+        agent = FakeAgent()
+        runner = AgentRunner(agent, max_concurrent_runs=1)
+        slow = asyncio.create_task(runner.invoke(inputs("slow")))
+        await wait_for(lambda: agent.started == ["slow"])
+
+        queued = asyncio.create_task(runner.invoke(inputs("queued")))
+        await wait_for(lambda: runner.stats()["queue_depth"] == 1)
+
+        runner.shutdown(wait=False)
+        with pytest.raises(RuntimeError):
+            await asyncio.wait_for(queued, timeout=5)
+        assert runner.stats()["queue_depth"] == 0
+        assert runner.stats()["cancelled"] == 1
+
+        agent.release.set()
+        await slow
+        assert agent.started == ["slow"]
+        assert runner.stats()["completed"] == 1
+
+    asyncio.run(scenario())
@@ -0,0 +1,93 @@
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import numpy as np
+
+from src.Improve.agent.answer_cache import SemanticAnswerCache, question_literals
+
+
+class CharEmbedding:
+    """按字符计数的向量，只统计文字（只差字面量或标点的问题向量完全相同）"""
+
+    def encode_queries(self, texts):
+        vecs = []
+        for text in texts:
+            vec = np.zeros(256, dtype=np.float32)
+            for ch in text:
+                if ch.isalpha():
+                    vec[ord(ch) % 256] += 1
+            vecs.append(vec)
+        return vecs
+
+
+def make_cache(**kwargs):
+    return SemanticAnswerCache(CharEmbedding(), threshold=0.95, **kwargs)
+
+
+def test_question_literals():
+    assert question_literals("2023年1月销售额 top 10") == ("1", "10", "2023")
+    assert question_literals("城市为'北京'的客户") == ("q:北京",)
+    assert question_literals("去年的订单") == ("d:去年",)
+    assert question_literals("一共有多少客户") == ()
+
+
+def test_lookup_hits_rephrased_question():
+    cache = make_cache()
+    cache.store("2023年的销售额是多少", "shop", sql="SELECT 1", answer="100 万", records=[{"n": 1}])
+    hit = cache.lookup("2023年的销售额是多少？", "shop")
+    assert hit is not None
+    assert hit[0].answer == "100 万"
+    assert cache.lookup("2023年的销售额是多少", "other") is None
+
+
+def test_lookup_misses_on_literal_differences():
+    cache = make_cache()
+    cache.store("2023年的销售额是多少", "shop", sql="SELECT 2023", answer="a")
+    cache.store("销售额 top 10 的客户", "shop", sql="SELECT 10", answer="b")
+    cache.store("城市为'北京'的客户数", "shop", sql="SELECT 'bj'", answer="c")
+    assert cache.lookup("2024年的销售额是多少", "shop") is None
+    assert cache.lookup("销售额 top 5 的客户", "shop") is None
+    assert cache.lookup("城市为'上海'的客户数", "shop") is None
+    assert cache.lookup("销售额 top 10 的客户", "shop")[0].sql == "SELECT 10"
+
+
+def test_store_keeps_entries_with_different_literals():
+    cache = make_cache()
+    cache.store("2023年的销售额", "shop", sql="SELECT 2023", answer="a")
+    cache.store("2024年的销售额", "shop", sql="SELECT 2024", answer="b")
+    cache.store("2024年的销售额", "shop", sql="SELECT 2024", answer="c")
+    assert cache.stats()["entries"] == 2
+    assert cache.lookup("2023年的销售额", "shop")[0].answer == "a"
+    assert cache.lookup("2024年的销售额", "shop")[0].answer == "c"
+
+
+def test_invalidate():
+    cache = make_cache()
+    cache.store("客户数", "shop", sql="SELECT 1", answer="a")
+    cache.store("客户数", "crm", sql="SELECT 1", answer="b")
+    assert cache.invalidate("shop") == 1
+    assert cache.lookup("客户数", "shop") is None
+    assert cache.lookup("客户数", "crm") is not None
+    assert cache.invalidate() == 1
+    assert cache.stats()["entries"] == 0
+
+
+def test_expired_answers_are_evicted():
+    cache = make_cache(ttl=60)
+    cache.store("客户数", "shop", sql="SELECT 1", answer="a")
+    cache._entries["shop"][0].created_at = time.time() - 120
+    assert cache.lookup("客户数", "shop") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_refresh_keeps_answer_only_for_unchanged_result():
+    cache = make_cache(result_ttl=0)
+    cache.store("客户数", "shop", sql="SELECT 1", answer="a", records=[{"n": 1}])
+    entry, _ = cache.lookup("客户数", "shop")
+    assert not entry.result_fresh(cache.result_ttl)
+    assert cache.refresh(entry, [{"n": 1}])
+    assert not cache.refresh(entry, [{"n": 2}])
+    assert cache.lookup("客户数", "shop") is None
@@ -0,0 +1,76 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+from src.Improve.agent.answer_stream import AnswerStreamer
+
+
+def text_of(events):
+    return "".join(e["content"] for e in events if e["type"] == "answer")
+
+
+def test_final_turn_is_streamed_and_chart_config_extracted():
+    streamer = AnswerStreamer(flush_interval=0, hold_chars=8)
+    events = []
+    for token in ['```chartconfig\n{"type": ', '"bar"}\n```\n', "共有 12 个客户。"]:
+        events.extend(streamer.feed(AIMessageChunk(content=token)))
+    events.extend(streamer.end_turn(AIMessage(content="")))
+    events.extend(streamer.finish())
+    assert {"type": "chart_config", "config": {"type": "bar"}} in events
+    assert text_of(events) == "共有 12 个客户。"
+
+
+def test_short_preamble_before_tool_call_is_dropped():
+    streamer = AnswerStreamer(flush_interval=0, hold_chars=64)
+    assert streamer.feed(AIMessageChunk(content="我先查询一下表结构。")) == []
+    tool_chunk = AIMessageChunk(content="", tool_call_chunks=[{"name": "execute_sql", "args": "", "id": "c1", "index": 0}])
+    assert streamer.feed(tool_chunk) == []
+    assert streamer.end_turn(AIMessage(content="", tool_calls=[{"name": "execute_sql", "args": {}, "id": "c1"}])) == []
+    assert not streamer.streamed
+
+
+def test_long_preamble_is_retracted_on_tool_call():
+    streamer = AnswerStreamer(flush_interval=0, hold_chars=4)
+    events = streamer.feed(AIMessageChunk(content="我先查询一下数据库中的订单表，然后再计算结果。"))
+    assert text_of(events)
+    tool_chunk = AIMessageChunk(content="", tool_call_chunks=[{"name": "execute_sql", "args": "", "id": "c1", "index": 0}])
+    assert streamer.feed(tool_chunk) == [{"type": "answer_reset"}]
+    streamer.end_turn(AIMessage(content="", tool_calls=[{"name": "execute_sql", "args": {}, "id": "c1"}]))
+    assert not streamer.streamed
+
+    events = streamer.feed(AIMessageChunk(content="共有 12 个订单。"))
+    events.extend(streamer.end_turn(AIMessage(content="共有 12 个订单。")))
+    assert text_of(events) == "共有 12 个订单。"
+
+
+def test_retract_when_tool_calls_only_in_final_message():
+    streamer = AnswerStreamer(flush_interval=0, hold_chars=4)
+    assert text_of(streamer.feed(AIMessageChunk(content="我先查询一下订单表。")))
+    events = streamer.end_turn(AIMessage(content="我先查询一下订单表。", tool_calls=[{"name": "execute_sql", "args": {}, "id": "c1"}]))
+    assert events == [{"type": "answer_reset"}]
+
+
+def test_data_is_resent_before_final_answer_after_retraction():
+    results = {"rows": None}
+
+    def before_answer():
+        return [{"type": "data", "data": results["rows"]}] if results["rows"] else []
+
+    streamer = AnswerStreamer(flush_interval=0, hold_chars=4, before_answer=before_answer)
+    events = streamer.feed(AIMessageChunk(content="我先查询一下数据库中的订单表，然后再计算结果。"))
+    tool_chunk = AIMessageChunk(content="", tool_call_chunks=[{"name": "execute_sql", "args": "", "id": "c1", "index": 0}])
+    events.extend(streamer.feed(tool_chunk))
+    events.extend(streamer.end_turn(AIMessage(content="", tool_calls=[{"name": "execute_sql", "args": {}, "id": "c1"}])))
+    assert [e["type"] for e in events] == ["answer", "answer_reset"]
+
+    # 工具执行后才有查询结果
+    results["rows"] = [{"n": 12}]
+    events = streamer.feed(AIMessageChunk(content="共有 12 个订单。"))
+    events.extend(streamer.end_turn(AIMessage(content="共有 12 个订单。")))
+    events.extend(streamer.finish())
+    assert [e["type"] for e in events] == ["data", "answer"]
+    assert events[0]["data"] == [{"n": 12}]
+    assert text_of(events) == "共有 12 个订单。"
@@ -0,0 +1,56 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import pandas as pd
+
+from src.Improve.shared import set_vanna_client
+from src.Improve.tools.database_tools import execute_sql, validate_sql_syntax
+
+
+class RecordingVanna:
+    def __init__(self):
+        self.executed = []
+
+    def run_sql(self, sql, **kwargs):
+        self.executed.append(sql)
+        return pd.DataFrame({"n": [1]})
+
+
+def test_execute_sql_refuses_writes():
+    vn = RecordingVanna()
+    set_vanna_client(vn)
+    for sql in ["DELETE FROM orders WHERE id = 1", "drop table orders", "SELECT 1; UPDATE t SET a = 1"]:
+        result = execute_sql.invoke({"sql": sql})
+        assert result.startswith("安全风险")
+    assert vn.executed == []
+
+
+def test_execute_sql_runs_select():
+    vn = RecordingVanna()
+    set_vanna_client(vn)
+    result = execute_sql.invoke({"sql": "SELECT created_at, update_time FROM orders"})
+    assert result.startswith("查询成功")
+    assert vn.executed == ["SELECT created_at, update_time FROM orders"]
+
+
+def test_validate_sql_syntax_refuses_writes():
+    assert validate_sql_syntax.invoke({"sql": "DELETE FROM orders"}).startswith("安全风险")
+    assert validate_sql_syntax.invoke({"sql": "SELECT 1"}).startswith("语法检查通过")
+
+
+def test_keywords_in_literals_and_comments_are_allowed():
+    vn = RecordingVanna()
+    set_vanna_client(vn)
+    sqls = [
+        "SELECT * FROM orders WHERE status = 'DELETE'",
+        "SELECT * FROM logs WHERE action LIKE '%update%' -- drop old rows",
+        "SELECT `create` FROM t /* alter later */",
+    ]
+    for sql in sqls:
+        assert execute_sql.invoke({"sql": sql}).startswith("查询成功")
+        assert validate_sql_syntax.invoke({"sql": sql}).startswith("语法检查通过")
+    assert len(vn.executed) == 3
+    # MySQL 会执行 /*! ... */ 中的语句
+    assert execute_sql.invoke({"sql": "SELECT 1 /*!50000 ; DELETE FROM t */"}).startswith("安全风险")
@@ -0,0 +1,61 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import numpy as np
+
+from src.Improve.clients.embedding_providers import JinaEmbedding
+from src.Improve.clients.embedding_store import EmbeddingStore
+
+
+class CountingJina(JinaEmbedding):
+    def __init__(self, store, **kwargs):
+        super().__init__(skip_test=True, **kwargs)
+        self.configure_document_store(store)
+        self.requests = []
+
+    def _embed(self, texts):
+        self.requests.append(list(texts))
+        value = 1.0 if self.pooling == "mean" else 2.0
+        return np.full((len(texts), 4), value, dtype=np.float32)
+
+
+def test_document_store_key_includes_request_params(tmp_path):
+    store = EmbeddingStore(str(tmp_path / "embedding_store.db"))
+    mean = CountingJina(store, pooling="mean")
+    mean.encode_documents(["orders 表", "customers 表"])
+    mean.encode_documents(["orders 表"])
+    assert mean.requests == [["orders 表", "customers 表"]]
+
+    # pooling 不同的向量不能复用
+    max_pool = CountingJina(store, pooling="max")
+    vectors = max_pool.encode_documents(["orders 表"])
+    assert max_pool.requests == [["orders 表"]]
+    assert vectors[0][0] == 2.0
+    max_pool.close()
+
+
+def test_async_client_is_closed_when_loop_changes():
+    import asyncio
+    import threading
+
+    emb = CountingJina(None)
+    other_loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=other_loop.run_forever, daemon=True)
+    thread.start()
+
+    async def get_client():
+        return emb._get_async_client()
+
+    first = asyncio.run_coroutine_threadsafe(get_client(), other_loop).result(5)
+    second = asyncio.run(get_client())
+    assert second is not first
+    # 旧客户端在它所属的（仍在运行的）事件循环中关闭
+    asyncio.run_coroutine_threadsafe(asyncio.sleep(0.05), other_loop).result(5)
+    assert first.is_closed
+
+    other_loop.call_soon_threadsafe(other_loop.stop)
+    thread.join(5)
+    other_loop.close()
+    emb.close()
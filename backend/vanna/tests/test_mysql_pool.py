@@ -0,0 +1,188 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import threading
+
+import pymysql
+import pytest
+
+from src.Improve.clients.mysql_pool import MySQLConnectionPool, MySQLPoolRegistry
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.connection = conn
+        self.description = None
+        self._rows = []
+
+    def execute(self, sql):
+        self.connection.executed.append(sql)
+        if self.connection.fail_execute:
+            self.connection.open = False
+            raise pymysql.err.OperationalError(2013, "Lost connection to MySQL server during query")
+        self.description = [("n",)]
+        self._rows = list(self.connection.rows)
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def fetchmany(self, size):
+        if self.connection.fail_fetch:
+            raise pymysql.err.DataError(1366, "Incorrect value")
+        chunk, self._rows = self._rows[:size], self._rows[size:]
+        return chunk
+
+    def close(self):
+        self.connection.cursor_closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FakeConnection:
+    def __init__(self, fail_execute=False, fail_fetch=False, rows=((1,),)):
+        self.fail_execute = fail_execute
+        self.fail_fetch = fail_fetch
+        self.rows = rows
+        self.executed = []
+        self.open = True
+        self.cursor_closed = False
+
+    def cursor(self, cursor_class=None):
+        return FakeCursor(self)
+
+    def ping(self, reconnect=False):
+        pass
+
+    def close(self):
+        self.open = False
+
+
+def make_pool(monkeypatch, connections):
+    pool = MySQLConnectionPool(host="localhost", user="root", password="", database="sales", min_idle=0)
+    created = []
+
+    def connect():
+        conn = connections.pop(0)
+        pool._created_at[id(conn)] = 0
+        created.append(conn)
+        return conn
+
+    monkeypatch.setattr(pool, "_connect", connect)
+    pool.max_lifetime = 0
+    return pool, created
+
+
+def test_query_retries_read_only_after_connection_lost(monkeypatch):
+    pool, created = make_pool(monkeypatch, [FakeConnection(fail_execute=True), FakeConnection()])
+    assert pool.query("SELECT n FROM t") == (["n"], [(1,)])
+    assert len(created) == 2
+    assert pool.stats()["total"] == 1
+
+
+def test_query_does_not_retry_sent_write(monkeypatch):
+    pool, created = make_pool(monkeypatch, [FakeConnection(fail_execute=True), FakeConnection()])
+    with pytest.raises(pymysql.err.OperationalError):
+        pool.query("UPDATE t SET n = n + 1")
+    assert len(created) == 1
+    assert created[0].executed == ["UPDATE t SET n = n + 1"]
+    assert pool.stats()["total"] == 0
+
+
+def test_query_limited_complete_read_returns_connection(monkeypatch):
+    rows = [(i,) for i in range(5)]
+    pool, created = make_pool(monkeypatch, [FakeConnection(rows=rows)])
+    columns, result, truncated = pool.query_limited("SELECT n FROM t", max_rows=10, chunk_size=2)
+    assert (columns, result, truncated) == (["n"], rows, None)
+    assert created[0].open and created[0].cursor_closed
+    assert pool.stats()["idle"] == 1
+
+
+def test_query_limited_max_rows_discards_connection(monkeypatch):
+    pool, created = make_pool(monkeypatch, [FakeConnection(rows=[(i,) for i in range(10)])])
+    columns, result, truncated = pool.query_limited("SELECT n FROM t", max_rows=3, chunk_size=2)
+    assert result == [(0,), (1,), (2,)]
+    assert truncated == "max_rows"
+    assert not created[0].open and not created[0].cursor_closed
+    assert pool.stats()["total"] == 0
+
+
+def test_query_limited_max_bytes_cutoff(monkeypatch):
+    rows = [("x" * 100,) for _ in range(10)]
+    pool, created = make_pool(monkeypatch, [FakeConnection(rows=rows)])
+    columns, result, truncated = pool.query_limited("SELECT s FROM t", max_bytes=250, chunk_size=2)
+    assert truncated == "max_bytes"
+    assert len(result) == 4
+    assert not created[0].open
+    assert pool.stats()["total"] == 0
+
+
+def test_query_limited_error_discards_connection_without_draining(monkeypatch):
+    pool, created = make_pool(monkeypatch, [FakeConnection(fail_execute=True), FakeConnection()])
+    with pytest.raises(pymysql.err.OperationalError):
+        pool.query_limited("DELETE FROM t")
+    assert len(created) == 1
+    assert not created[0].cursor_closed
+    assert pool.stats()["total"] == 0
+
+
+def test_query_limited_fetch_error_discards_open_connection(monkeypatch):
+    pool, created = make_pool(monkeypatch, [FakeConnection(fail_fetch=True)])
+    with pytest.raises(pymysql.err.DataError):
+        pool.query_limited("SELECT n FROM t")
+    assert not created[0].open and not created[0].cursor_closed
+    assert pool.stats()["total"] == 0
+
+
+def test_query_limited_retries_read_only(monkeypatch):
+    pool, created = make_pool(monkeypatch, [FakeConnection(fail_execute=True), FakeConnection()])
+    assert pool.query_limited("SELECT n FROM t") == (["n"], [(1,)], None)
+    assert len(created) == 2
+    assert pool.stats()["total"] == 1
+
+
+def test_registry_forwards_connect_kwargs(monkeypatch):
+    captured = []
+    monkeypatch.setattr(pymysql, "connect", lambda **kwargs: captured.append(kwargs) or FakeConnection())
+    registry = MySQLPoolRegistry(min_idle=1)
+    registry.register("sales", {"host": "db", "dbname": "sales", "connect_kwargs": {"charset": "utf8mb4"}})
+    registry.get("sales")
+    assert captured[0]["charset"] == "utf8mb4" and captured[0]["database"] == "sales"
+
+    # 参数变化时重建连接池
+    registry.register("sales", {"host": "db", "dbname": "sales", "connect_kwargs": {"charset": "latin1"}})
+    registry.get("sales")
+    assert captured[1]["charset"] == "latin1"
+    registry.close_all()
+
+
+def test_registry_builds_pools_outside_lock(monkeypatch):
+    slow_started = threading.Event()
+    release = threading.Event()
+
+    def connect(**kwargs):
+        if kwargs["host"] == "slow":
+            slow_started.set()
+            release.wait(5)
+        return FakeConnection()
+
+    monkeypatch.setattr(pymysql, "connect", connect)
+    registry = MySQLPoolRegistry(min_idle=1)
+    registry.register("slow", {"host": "slow"})
+    registry.register("fast", {"host": "fast"})
+    results = []
+    thread = threading.Thread(target=lambda: results.append(registry.get("slow")))
+    thread.start()
+    assert slow_started.wait(5)
+    # 慢主机建池期间其他数据库不受影响
+    assert registry.get("fast").host == "fast"
+    release.set()
+    thread.join(5)
+    assert registry.get("slow") is results[0]
+    registry.close_all()
@@ -0,0 +1,52 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from benchmarks.offline_pipeline import (
+    BenchmarkConfig,
+    OfflineBenchmark,
+    StageResult,
+    compare_with_baseline,
+    percentile,
+)
+
+
+def test_percentile():
+    assert percentile([], 95) == 0.0
+    assert percentile([5.0], 50) == 5.0
+    assert percentile([1.0, 2.0, 3.0, 4.0], 50) == 2.5
+    assert percentile(list(range(101)), 95) == 95
+
+
+def test_compare_with_baseline():
+    results = [
+        StageResult("sql", 10, 1.0, 13.0, 1.0, 20.0, 1.0, 10.0, None),
+        StageResult("agent", 10, 1.0, 10.0, 1.0, 20.0, 1.0, 10.0, None),
+    ]
+    baseline = [{"stage": "sql", "p95_ms": 10.0}, {"stage": "agent", "p95_ms": 10.0}]
+    regressions = compare_with_baseline(results, baseline, max_regression=0.2)
+    assert len(regressions) == 1 and regressions[0].startswith("sql:")
+
+
+def test_offline_benchmark_smoke(tmp_path):
+    config = BenchmarkConfig(
+        iterations=1,
+        concurrency=2,
+        questions=["一共有多少客户", "每个城市的客户数量"],
+        customers=50,
+        orders=200,
+        workdir=str(tmp_path),
+    )
+    with OfflineBenchmark(config) as bench:
+        results = bench.run()
+
+    stages = {r.stage: r for r in results}
+    assert list(stages) == ["training", "embedding", "retrieval", "sql", "agent", "agent_x2"]
+    assert stages["agent"].count == 2
+    assert stages["agent_x2"].count == 4
+    for r in results:
+        assert r.count > 0
+        assert 0 <= r.p50_ms <= r.p95_ms <= r.max_ms
+        assert r.throughput > 0
+        assert r.peak_memory_mb is not None
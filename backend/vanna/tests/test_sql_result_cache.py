@@ -0,0 +1,80 @@
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import pandas as pd
+
+from src.Improve.clients.sql_result_cache import SQLResultCache, normalize_sql, referenced_tables
+
+
+def test_normalize_sql():
+    assert normalize_sql("select  a, count(*)\n from orders -- c\n group   by a;") == \
+        "SELECT a, count(*) FROM orders GROUP BY a"
+    assert normalize_sql("SELECT * FROM t WHERE s = 'a  b'") == "SELECT * FROM t WHERE s = 'a  b'"
+
+
+def test_normalize_sql_keeps_identifier_case():
+    assert normalize_sql("select * from user") == "SELECT * FROM user"
+    assert normalize_sql("select * from user") != normalize_sql("select * from USER")
+    assert normalize_sql("select Status from t") == "SELECT Status FROM t"
+
+
+def test_referenced_tables():
+    assert referenced_tables("SELECT * FROM a, b AS x JOIN `Db`.`C` c ON c.id = x.id") == {"a", "b", "db.c"}
+    assert referenced_tables("SELECT * FROM (SELECT id FROM t1) s WHERE id IN (SELECT id FROM t2)") == {"t1", "t2"}
+    assert referenced_tables("SELECT EXTRACT(YEAR FROM created_at) y FROM orders GROUP BY y") == {"orders"}
+    assert referenced_tables("SELECT TRIM(BOTH 'x' FROM name) FROM customers") == {"customers"}
+    assert referenced_tables("SELECT * FROM orders WHERE note = 'shipped from warehouse'") == {"orders"}
+
+
+def test_cache_key_rejects_uncacheable_sql():
+    cache = SQLResultCache()
+    assert cache.cache_key("SELECT RAND() FROM t") is None
+    assert cache.cache_key("SELECT * FROM t FOR UPDATE") is None
+    assert cache.cache_key("SELECT * FROM information_schema.tables") is None
+    assert cache.cache_key("DELETE FROM t") is None
+    assert cache.cache_key("SELECT 1; SELECT 2") is None
+
+
+def test_get_put_and_ttl():
+    cache = SQLResultCache(ttl=60)
+    df = pd.DataFrame({"n": [1, 2], "s": ["a", "b"]})
+    cache.put("shop", "select n, s from t", df)
+    pd.testing.assert_frame_equal(cache.get("shop", "SELECT n, s  FROM t"), df)
+    assert cache.get("other", "SELECT n, s FROM t") is None
+
+    cache._data[("shop", "SELECT n, s FROM t")].created_at = time.time() - 120
+    assert cache.get("shop", "SELECT n, s FROM t") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_lru_eviction_by_bytes():
+    df = pd.DataFrame({"s": ["x" * 1000] * 10})
+    entry_bytes = len(SQLResultCache._serialize(df)[0])
+    cache = SQLResultCache(ttl=60, max_bytes=entry_bytes * 2 + 10, max_entry_bytes=entry_bytes * 2)
+    cache.put("shop", "SELECT s FROM a", df)
+    cache.put("shop", "SELECT s FROM b", df)
+    assert cache.get("shop", "SELECT s FROM a") is not None  # a 变为最近使用
+    cache.put("shop", "SELECT s FROM c", df)
+    assert cache.get("shop", "SELECT s FROM b") is None
+    assert cache.get("shop", "SELECT s FROM a") is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_invalidate_by_table():
+    cache = SQLResultCache(ttl=60)
+    df = pd.DataFrame({"n": [1]})
+    cache.put("shop", "SELECT n FROM orders", df)
+    cache.put("shop", "SELECT n FROM customers", df)
+    cache.put("crm", "SELECT n FROM orders", df)
+
+    cache.invalidate_for("shop", "UPDATE Orders SET n = 2")
+    assert cache.get("shop", "SELECT n FROM orders") is None
+    assert cache.get("shop", "SELECT n FROM customers") is not None
+    assert cache.get("crm", "SELECT n FROM orders") is not None
+
+    assert cache.invalidate("crm", ["shop.orders"]) == 1
+    assert cache.invalidate("shop") == 1
+    assert cache.stats()["entries"] == 0
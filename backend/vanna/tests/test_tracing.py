@@ -0,0 +1,50 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import pytest
+
+from src.Improve.shared.tracing import Tracer, set_span_attributes
+
+
+def test_spans_are_grouped_by_run_id():
+    tracer = Tracer()
+    with tracer.trace("run-1", "agent.run", db_name="shop"):
+        with tracer.span("sql", kind="sql", sql="SELECT 1") as span:
+            set_span_attributes(span, rows=3, truncated=None)
+        with pytest.raises(ValueError):
+            with tracer.span("tool.execute_sql", kind="tool"):
+                raise ValueError("boom")
+
+    trace = tracer.get_trace("run-1")
+    root, sql, tool = trace["spans"]
+    assert root["name"] == "agent.run" and root["parent_id"] is None
+    assert root["attributes"]["db_name"] == "shop"
+    assert sql["parent_id"] == root["span_id"] and sql["kind"] == "sql"
+    assert sql["attributes"] == {"sql": "SELECT 1", "rows": 3}
+    assert tool["status"] == "error" and "boom" in tool["error"]
+    assert trace["duration_ms"] == root["duration_ms"]
+    assert trace["summary"]["sql"]["count"] == 1
+    assert trace["summary"]["tool"]["errors"] == 1
+    tracer.shutdown()
+
+
+def test_spans_outside_a_run_are_not_recorded():
+    tracer = Tracer()
+    with tracer.span("sql", kind="sql") as span:
+        assert not span.is_recording()
+    with tracer.trace(None) as span:
+        assert not span.is_recording()
+    assert tracer.stats()["traces"] == 0
+    assert Tracer(enabled=False).get_trace("run-1") is None
+
+
+def test_oldest_traces_are_evicted():
+    tracer = Tracer(max_traces=2)
+    for run_id in ("a", "b", "c"):
+        with tracer.trace(run_id):
+            pass
+    assert tracer.get_trace("a") is None
+    assert tracer.get_trace("c")["duration_ms"] is not None
+    assert tracer.stats()["traces"] == 2
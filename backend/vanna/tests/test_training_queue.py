@@ -0,0 +1,20 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from src.Improve.training.training_queue import DONE, TrainingQueue
+
+
+def test_submit_deduplicates_only_unfinished_jobs(tmp_path):
+    queue = TrainingQueue(vanna_client=None, db_path=str(tmp_path / "training_queue.db"))
+    first = queue.submit("一共有多少客户", [], db_name="shop")
+    assert queue.submit(" 一共有多少客户 ", [], db_name="shop") == {"job_id": first["job_id"], "deduplicated": True}
+    assert not queue.submit("一共有多少客户", [], db_name="crm")["deduplicated"]
+
+    # 已完成的问题可以再次入队（训练数据变化后需要重新评估）
+    queue._finish(first["job_id"], DONE, result="skipped")
+    again = queue.submit("一共有多少客户", [], db_name="shop")
+    assert not again["deduplicated"] and again["job_id"] != first["job_id"]
+    assert queue.stats()["deduplicated"] == 1
+    queue.shutdown()
@@ -0,0 +1,33 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from src.Improve.middleware import ui_events_middleware as ui
+
+
+def test_args_shape_masks_literals():
+    a = ui._args_shape({"sql": "SELECT * FROM orders WHERE city = '北京' AND amount > 100"})
+    b = ui._args_shape({"sql": "select *  from orders where city = '上海' and amount > 5"})
+    assert a == b
+
+
+def test_cached_labels_are_not_shared_across_questions():
+    ui.configure_tool_descriptions(llm_enabled=True)
+    args = {"sql": "SELECT COUNT(*) FROM customers WHERE gender = 'F'"}
+    token = ui.CURRENT_QUESTION.set("女性客户有多少")
+    try:
+        key = ("execute_sql", ui._args_shape(args), ui._question_hash("女性客户有多少"))
+        ui._description_cache[key] = "统计女性客户数量，回答客户占比问题"
+        assert ui._tool_description("execute_sql", args, "c1") == "统计女性客户数量，回答客户占比问题"
+    finally:
+        ui.CURRENT_QUESTION.reset(token)
+
+    token = ui.CURRENT_QUESTION.set("男性客户有多少")
+    try:
+        # 其他问题命中不到该描述，使用模板描述（不在 Agent run 中，不请求 LLM）
+        assert ui._tool_description("execute_sql", {"sql": "SELECT COUNT(*) FROM customers WHERE gender = 'M'"}, "c2") \
+            == "执行数据库查询"
+    finally:
+        ui.CURRENT_QUESTION.reset(token)
+        ui._description_cache.clear()
@@ -264,6 +264,11 @@ export function ChatPanel({ selectedTable, selectedDatabase, onQueryResult }: Ch
             } else if (data.type === 'answer') {
               // 累加答案
               setAnswer(prev => prev + data.content);
+            } else if (data.type === 'answer_reset') {
+              // 已显示的文本是调用工具前的开场白，清空后等待最终回答（查询数据会在最终回答前重新推送）
+              setAnswer('');
+              setChartConfig(null);
+              setQueryData(null);
             } else if (data.type === 'chart_config') {
               // 接收图表配置
               console.log('[图表配置] 收到图表配置事件:', data.config);